@@ -0,0 +1,6 @@
+"""
+검색 경로 벤치마크.
+
+저장소 루트에서 `python benchmarks/retrieval.py`로 실행합니다. 합성 임베딩 코퍼스(benchmarks/synthetic.py)와
+정확 검색 정답으로 각 검색 백엔드의 recall@k, QPS, 지연 시간 분위수, 빌드 시간, 메모리를 측정해 JSON으로 저장합니다.
+"""
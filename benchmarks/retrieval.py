@@ -0,0 +1,224 @@
+"""
+검색 경로 벤치마크.
+
+합성 코퍼스(BENCH_SIZES 크기별)와 코퍼스 밖에서 뽑은 질의로 각 백엔드를 common.retrievers 인터페이스로
+같은 입력에 대해 실행하고, 다음을 JSON으로 저장합니다 (릴리스 간 비교용).
+
+- recall@k: 정확 검색 정답 대비 재현율
+- qps: 질의 전체를 한 번에(batch) 검색한 처리량
+- latency_ms: 질의 하나씩 검색한 지연 시간 p50/p95/p99
+- build_sec: 인덱스 빌드(적재) 시간
+- rss_mb: 빌드 전후 프로세스 상주 메모리(RSS) 증가량
+
+백엔드:
+- numpy: chap5/bigquery.py의 메모리 행렬 검색 (InMemoryVectorIndex)
+- faiss_flat, faiss_ivf_flat, faiss_ivf_pq, faiss_hnsw: chap6/faiss_search.py의 FAISS 인덱스 (자동 튜닝 포함)
+- bigquery_brute_force: BigQuery ML.DISTANCE 전체 스캔의 로컬 대역 (인덱스 없이 블록 단위로 코퍼스 전체를 읽음)
+- bigquery_vector_index: BigQuery IVF 벡터 인덱스의 로컬 대역 (IVF-Flat, fraction_lists_to_search 비율만 탐색)
+- matching_engine: Matching Engine Tree-AH의 로컬 대역 (양자화 + 재정렬 IVF-PQ)
+
+사용 예:
+    BENCH_SIZES=10000,100000 BENCH_BACKENDS=numpy,faiss_hnsw python benchmarks/retrieval.py
+"""
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+# 저장소 루트의 공통 모듈(common/)을 가져오기 위해 경로 추가
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.synthetic import default_clusters, exact_search, ground_truth, make_corpus, make_queries
+from common.retrievers import FaissRetriever, Hit, NumpyRetriever
+
+# 코퍼스 크기 목록 (쉼표 구분, 1천만까지)
+BENCH_SIZES = [int(s) for s in os.getenv("BENCH_SIZES", "10000,100000").split(",") if s.strip()]
+BENCH_DIM = int(os.getenv("BENCH_DIM", "768"))
+# 질의 수와 지연 시간을 측정할 질의 수 (하나씩 검색)
+BENCH_QUERIES = int(os.getenv("BENCH_QUERIES", "1000"))
+BENCH_LATENCY_QUERIES = int(os.getenv("BENCH_LATENCY_QUERIES", "200"))
+BENCH_K = int(os.getenv("BENCH_K", "10"))
+BENCH_SEED = int(os.getenv("BENCH_SEED", "0"))
+# 실행할 백엔드 (쉼표 구분)
+BENCH_BACKENDS = os.getenv(
+    "BENCH_BACKENDS",
+    "numpy,faiss_flat,faiss_ivf_flat,faiss_ivf_pq,faiss_hnsw,bigquery_brute_force,bigquery_vector_index,matching_engine",
+).split(",")
+# bigquery_vector_index 대역에서 탐색할 IVF 목록 비율 (BQ_FRACTION_LISTS_TO_SEARCH에 해당)
+BENCH_BQ_FRACTION_LISTS = float(os.getenv("BENCH_BQ_FRACTION_LISTS", "0.05"))
+# 합성 코퍼스/정답 캐시 디렉토리와 결과 JSON 경로
+BENCH_DATA_DIR = os.getenv("BENCH_DATA_DIR", os.path.join("benchmarks", "data"))
+BENCH_OUTPUT = os.getenv("BENCH_OUTPUT", os.path.join("benchmarks", "results",
+                                                      f"retrieval-{time.strftime('%Y%m%d-%H%M%S')}.json"))
+RESULT_FORMAT_VERSION = 1
+
+
+class ScanRetriever:
+    """BigQuery 전체 스캔 대역: 인덱스 없이 매 질의마다 코퍼스 전체를 블록 단위로 읽어 정확 검색합니다."""
+    name = "bigquery_brute_force"
+    input_kind = "vector"
+
+    def __init__(self, corpus: np.ndarray):
+        self.corpus = corpus
+
+    def search(self, queries, k: int = 10, filters: dict = None) -> list[list[Hit]]:
+        scores, rows = exact_search(self.corpus, np.array(queries, dtype=np.float32, ndmin=2), k)
+        return [[Hit(int(r), float(s)) for s, r in zip(row_s, row_r)] for row_s, row_r in zip(scores, rows)]
+
+
+def _faiss_builder(index_type: str, nprobe_fraction: float = None):
+    def build(corpus: np.ndarray, ids: list):
+        import faiss
+        from common.faiss_index import build_faiss_index
+
+        index, info = build_faiss_index(corpus, corpus.shape[1], index_type=index_type, k=BENCH_K)
+        if nprobe_fraction:
+            ivf = faiss.extract_index_ivf(index)
+            ivf.nprobe = max(1, int(round(ivf.nlist * nprobe_fraction)))
+            info = {**info, "params": {**info.get("params", {}), "nprobe": ivf.nprobe}}
+        return FaissRetriever(index, ids, normalize=False), info
+    return build
+
+
+def _numpy_builder(corpus: np.ndarray, ids: list):
+    return NumpyRetriever.from_arrays(ids, corpus), {}
+
+
+def _scan_builder(corpus: np.ndarray, ids: list):
+    return ScanRetriever(corpus), {}
+
+
+BACKENDS = {
+    "numpy": _numpy_builder,
+    "faiss_flat": _faiss_builder("flat"),
+    "faiss_ivf_flat": _faiss_builder("ivf_flat"),
+    "faiss_ivf_pq": _faiss_builder("ivf_pq"),
+    "faiss_hnsw": _faiss_builder("hnsw"),
+    "bigquery_brute_force": _scan_builder,
+    "bigquery_vector_index": _faiss_builder("ivf_flat", nprobe_fraction=BENCH_BQ_FRACTION_LISTS),
+    "matching_engine": _faiss_builder("ivf_pq"),
+}
+
+
+def rss_mb() -> float:
+    """현재 프로세스의 상주 메모리(MB). /proc이 없으면 최대 상주 메모리로 대신합니다."""
+    try:
+        with open("/proc/self/status", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def recall_at_k(results: list[list[Hit]], truth: np.ndarray, k: int) -> float:
+    """질의별 |결과 ∩ 정답| / k의 평균."""
+    hits = sum(len({int(h.id) for h in row[:k]} & set(truth_row[:k].tolist())) for row, truth_row in zip(results, truth))
+    return hits / (len(truth) * k)
+
+
+def run_backend(name: str, corpus: np.ndarray, queries: np.ndarray, truth: np.ndarray, k: int) -> dict:
+    """백엔드 하나를 빌드하고 재현율, 처리량, 지연 시간을 측정합니다."""
+    gc.collect()
+    rss_before = rss_mb()
+    started = time.perf_counter()
+    retriever, build_info = BACKENDS[name](corpus, list(range(len(corpus))))
+    build_sec = time.perf_counter() - started
+    rss_delta = rss_mb() - rss_before
+
+    started = time.perf_counter()
+    results = retriever.search(queries, k=k)
+    batch_sec = time.perf_counter() - started
+
+    latencies = []
+    for q in queries[:BENCH_LATENCY_QUERIES]:
+        started = time.perf_counter()
+        retriever.search([q], k=k)
+        latencies.append((time.perf_counter() - started) * 1000)
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+
+    result = {
+        "backend": name,
+        "recall_at_k": round(recall_at_k(results, truth, k), 4),
+        "qps": round(len(queries) / batch_sec, 1),
+        "latency_ms": {"p50": round(float(p50), 3), "p95": round(float(p95), 3), "p99": round(float(p99), 3),
+                       "queries": len(latencies)},
+        "build_sec": round(build_sec, 3),
+        "rss_mb": round(rss_delta, 1),
+        "params": build_info.get("params", {}),
+        "index_type": build_info.get("index_type"),
+    }
+    del retriever, results
+    return result
+
+
+def environment() -> dict:
+    """결과 비교에 필요한 실행 환경 정보."""
+    info = {"python": platform.python_version(), "platform": platform.platform(), "cpu_count": os.cpu_count(),
+            "numpy": np.__version__}
+    try:
+        import faiss
+        info["faiss"] = faiss.__version__
+    except ImportError:
+        info["faiss"] = None
+    try:
+        info["git_commit"] = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                                            cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        info["git_commit"] = None
+    return info
+
+
+def main():
+    report = {"format_version": RESULT_FORMAT_VERSION, "started": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+              "environment": environment(),
+              "config": {"sizes": BENCH_SIZES, "dim": BENCH_DIM, "queries": BENCH_QUERIES, "k": BENCH_K,
+                         "latency_queries": BENCH_LATENCY_QUERIES, "seed": BENCH_SEED,
+                         "bq_fraction_lists": BENCH_BQ_FRACTION_LISTS},
+              "runs": []}
+    for size in BENCH_SIZES:
+        clusters = default_clusters(size)
+        print(f"\n[정보] 코퍼스 {size}개 x {BENCH_DIM}차원 (군집 {clusters}개) 준비 중...")
+        started = time.perf_counter()
+        corpus = make_corpus(BENCH_DATA_DIR, size, BENCH_DIM, seed=BENCH_SEED, clusters=clusters)
+        queries = make_queries(BENCH_QUERIES, BENCH_DIM, seed=BENCH_SEED, clusters=clusters)
+        truth = ground_truth(BENCH_DATA_DIR, corpus, queries, BENCH_K,
+                             tag=f"{size}x{BENCH_DIM}_c{clusters}_s{BENCH_SEED}_q{BENCH_QUERIES}")
+        print(f"[정보] 코퍼스/정답 준비 완료 ({time.perf_counter() - started:.1f}초)")
+
+        for name in BENCH_BACKENDS:
+            name = name.strip()
+            if name not in BACKENDS:
+                print(f"[알림] 알 수 없는 백엔드를 건너뜁니다: {name}")
+                continue
+            try:
+                result = run_backend(name, corpus, queries, truth, BENCH_K)
+            except ImportError as e:
+                print(f"[알림] {name}: 필요한 패키지가 없어 건너뜁니다 ({e})")
+                result = {"backend": name, "error": str(e)}
+            except Exception as e:
+                print(f"[오류] {name}: {e}")
+                result = {"backend": name, "error": str(e)}
+            else:
+                print(f"[정보] {name}: recall@{BENCH_K}={result['recall_at_k']:.3f}, QPS {result['qps']:.0f}, "
+                      f"p50/p95/p99 {result['latency_ms']['p50']:.2f}/{result['latency_ms']['p95']:.2f}/"
+                      f"{result['latency_ms']['p99']:.2f}ms, 빌드 {result['build_sec']:.1f}초, "
+                      f"메모리 +{result['rss_mb']:.0f}MB")
+            report["runs"].append({"size": size, "dim": BENCH_DIM, **result})
+        del corpus
+
+    os.makedirs(os.path.dirname(os.path.abspath(BENCH_OUTPUT)), exist_ok=True)
+    with open(BENCH_OUTPUT, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n[성공] 벤치마크 결과 저장: {BENCH_OUTPUT}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+벤치마크용 합성 임베딩 코퍼스와 정확 검색 정답.
+
+실제 문서 임베딩처럼 군집이 있는 분포(가우시안 혼합)에서 L2 정규화된 float32 벡터를 만들고,
+.npy 파일에 블록 단위로 써서 메모리 매핑(memmap)으로 엽니다. 그래서 1천만 × 768(약 30GB) 코퍼스도
+메모리에 한 번에 올리지 않고 만들고 읽을 수 있습니다. 같은 (크기, 차원, 시드)의 파일이 있으면 재사용합니다.
+
+정답(ground truth)은 코퍼스를 블록 단위로 훑으며 질의별 top-k를 누적하는 정확 내적 검색으로 구하고,
+파일로 저장해 두어 백엔드마다 다시 계산하지 않습니다.
+"""
+import os
+
+import numpy as np
+
+# 코퍼스 생성/정확 검색 시 한 번에 처리할 행 수
+BLOCK_ROWS = 65536
+# 군집 중심 주변의 잡음 크기 (클수록 군집이 흐려져 근사 검색이 어려워짐)
+NOISE_SCALE = 0.6
+
+
+def _normalize(block: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(block, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return block / norms
+
+
+def _centers(dim: int, clusters: int, seed: int) -> np.ndarray:
+    return np.random.default_rng(seed).normal(size=(clusters, dim)).astype(np.float32)
+
+
+def default_clusters(count: int) -> int:
+    """코퍼스 크기에 맞춘 군집 수 (행 1,000개당 1개, 16~10,000개)."""
+    return int(min(10000, max(16, count // 1000)))
+
+
+def _sample(rng, centers: np.ndarray, rows: int) -> np.ndarray:
+    assign = rng.integers(0, len(centers), size=rows)
+    block = centers[assign] + NOISE_SCALE * rng.standard_normal((rows, centers.shape[1]), dtype=np.float32)
+    return _normalize(block).astype(np.float32)
+
+
+def make_corpus(data_dir: str, count: int, dim: int = 768, seed: int = 0, clusters: int = None) -> np.ndarray:
+    """
+    합성 코퍼스를 만들거나 이미 있는 파일을 읽기 전용 memmap으로 엽니다.
+
+    Returns:
+        numpy.memmap: (count, dim) float32 행렬 (행별 L2 정규화).
+    """
+    clusters = clusters or default_clusters(count)
+    path = os.path.join(data_dir, f"corpus_{count}x{dim}_c{clusters}_s{seed}.npy")
+    if os.path.exists(path):
+        corpus = np.load(path, mmap_mode="r")
+        if corpus.shape == (count, dim):
+            return corpus
+    os.makedirs(data_dir, exist_ok=True)
+    centers = _centers(dim, clusters, seed)
+    rng = np.random.default_rng(seed + 1)
+    tmp_path = path + ".tmp.npy"
+    out = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=(count, dim))
+    for start in range(0, count, BLOCK_ROWS):
+        rows = min(BLOCK_ROWS, count - start)
+        out[start:start + rows] = _sample(rng, centers, rows)
+    out.flush()
+    del out
+    os.replace(tmp_path, path)
+    return np.load(path, mmap_mode="r")
+
+
+def make_queries(count: int, dim: int = 768, seed: int = 0, clusters: int = None, corpus_size: int = None) -> np.ndarray:
+    """
+    코퍼스와 같은 분포(같은 군집 중심)에서 뽑은 새 질의 벡터. 코퍼스 행을 그대로 쓰지 않습니다.
+
+    Args:
+        clusters: 코퍼스의 군집 수. None이면 default_clusters(corpus_size).
+    """
+    clusters = clusters or default_clusters(corpus_size or count)
+    return _sample(np.random.default_rng(seed + 2), _centers(dim, clusters, seed), count)
+
+
+def exact_search(corpus: np.ndarray, queries: np.ndarray, k: int, block_rows: int = BLOCK_ROWS):
+    """
+    코퍼스를 블록 단위로 읽으며 내적 top-k를 구합니다 (memmap 코퍼스도 메모리 사용량 일정).
+
+    Returns:
+        tuple: (scores, rows). 각각 (질의 수, k) 배열이며 점수 내림차순입니다.
+    """
+    queries = np.asarray(queries, dtype=np.float32)
+    best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+    best_rows = np.full((len(queries), k), -1, dtype=np.int64)
+    for start in range(0, len(corpus), block_rows):
+        block = np.asarray(corpus[start:start + block_rows], dtype=np.float32)
+        scores = np.concatenate([best_scores, queries @ block.T], axis=1)
+        rows = np.concatenate([best_rows, np.broadcast_to(np.arange(start, start + len(block)),
+                                                          (len(queries), len(block)))], axis=1)
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        best_scores = np.take_along_axis(scores, top, axis=1)
+        best_rows = np.take_along_axis(rows, top, axis=1)
+    order = np.argsort(-best_scores, axis=1)
+    return np.take_along_axis(best_scores, order, axis=1), np.take_along_axis(best_rows, order, axis=1)
+
+
+def ground_truth(data_dir: str, corpus: np.ndarray, queries: np.ndarray, k: int, tag: str) -> np.ndarray:
+    """
+    정확 검색 정답 행 번호 (질의 수, k). 같은 tag와 k로 저장된 파일이 있으면 재사용합니다.
+
+    Args:
+        tag: 코퍼스/질의 조합을 구분하는 이름 (파일 이름에 사용).
+    """
+    path = os.path.join(data_dir, f"truth_{tag}_k{k}.npy")
+    if os.path.exists(path):
+        truth = np.load(path)
+        if truth.shape == (len(queries), k):
+            return truth
+    os.makedirs(data_dir, exist_ok=True)
+    _, truth = exact_search(corpus, queries, k)
+    np.save(path, truth)
+    return truth
@@ -1,10 +1,43 @@
 from dotenv import load_dotenv
+import json
 import os
+import sys
+import time
 import vertexai
-from vertexai.preview.language_models import TextEmbeddingModel, TextEmbeddingInput
 from vertexai.generative_models import GenerativeModel 
 from google.cloud import bigquery
 
+# 저장소 루트의 공통 모듈(common/)을 가져오기 위해 경로 추가
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.embedding import EmbeddingService # 디스크 캐시를 거치는 임베딩 facade
+from common.bq_search import DEFAULT_SEARCH_MODE, fetch_rows, search_vectors # 전체 스캔 또는 VECTOR_SEARCH(벡터 인덱스)
+from common.tokens import DEFAULT_PROMPT_TOKEN_BUDGET, count_tokens, fit_passages # 로컬 토큰 계산
+from common.answer_cache import SemanticAnswerCache # 비슷한 질문의 답변 재사용
+from common.lexical import DEFAULT_CANDIDATES, BM25Index, reciprocal_rank_fusion # BM25 + 벡터 하이브리드 검색
+from common.shards import BigQueryShardLoader, NotebookRegistry, NotebookShardPool # 노트북별 샤드 검색
+from common.filters import SQL_COLUMNS, MetadataTable, resolve_notebook # 메타데이터 필터 (WHERE로 검색 전에 적용)
+from common.manifest import IngestManifest # 인제스트 시각(ingested_at) 조회
+from common.dedup import load_linked_sources # 근접 중복 링크 (원본 청크 ID → 링크한 source)
+from common.rerank import DEFAULT_RERANKER, RERANK_CANDIDATES, RERANK_TOP_N, create_reranker # 2단계 검색 (후보 검색 → 재순위)
+from common.retrievers import Hit
+
+# 시맨틱 답변 캐시 사용 여부 (임계값/TTL/크기는 ANSWER_CACHE_THRESHOLD, ANSWER_CACHE_TTL_HOURS, ANSWER_CACHE_MAX_ENTRIES)
+USE_ANSWER_CACHE = os.getenv("ANSWER_CACHE", "true").lower() == "true"
+# 하이브리드 검색 사용 여부: 로컬 BM25 역색인 결과와 벡터 검색 결과를 RRF로 결합 (제품명·용어가 정확히 일치하는 청크 보강)
+USE_HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "false").lower() == "true"
+# BM25 역색인 저장 경로 (코퍼스 버전이 바뀌면 다시 만듦)
+LEXICAL_INDEX_PATH = os.getenv("LEXICAL_INDEX_PATH", os.path.join("output_embeddings", "lexical_index.npz"))
+# 질문할 노트북 ID. 지정하면 전체 테이블 대신 그 노트북 source의 샤드만 검색 (NOTEBOOKS_PATH에 등록된 노트북)
+NOTEBOOK_ID = os.getenv("NOTEBOOK_ID") or None
+# 검색 메타데이터 필터 (JSON, common.filters 형식). 예: '{"source": "manual.pdf", "ingested_at": {"gte": "2026-01-01"}}'
+SEARCH_FILTERS = json.loads(os.getenv("SEARCH_FILTERS", "") or "{}")
+# 테이블에 없는 열(ingested_at)의 필터를 source 목록으로 바꿀 때 읽는 인제스트 매니페스트 (chap5/embed_store.py)
+BQ_MANIFEST_PATH = os.getenv("BQ_INGEST_MANIFEST", "output_embeddings/bigquery_manifest.json")
+# 근접 중복 인덱스 (chap5/embed_store.py). 다른 파일의 원본 행에 링크만 남긴 청크를 노트북/source 검색에 포함할 때 읽음
+BQ_DEDUP_INDEX_PATH = os.getenv("BQ_DEDUP_INDEX", "output_embeddings/bigquery_dedup.npz")
+EMBEDDING_MODEL = "text-embedding-004"
+GENERATION_MODEL = "gemini-2.0-flash-lite-001" # 모델명을 최신으로 수정
+
 def main():
     """
     메인 실행 함수
@@ -44,34 +77,116 @@ def main():
         print("질문이 입력되지 않았습니다.")
         return
 
-    embedding_model = TextEmbeddingModel.from_pretrained("text-embedding-004")
-    embedding_input = TextEmbeddingInput(task_type="RETRIEVAL_QUERY", text=user_question)
-    question_embedding = embedding_model.get_embeddings([embedding_input])[0].values
-
-    # --- BigQuery 벡터 검색 (변경 없음) ---
-    top_k = 3
-    sql = f"""
-        SELECT id, {text_column_name},
-               (1 - ML.DISTANCE(embedding, @query_vector, 'COSINE')) AS cosine_sim
-        FROM `{TABLE_NAME}`
-        ORDER BY cosine_sim DESC
-        LIMIT {top_k}
-    """
-    job_config = bigquery.QueryJobConfig(
-        query_parameters=[bigquery.ArrayQueryParameter("query_vector", "FLOAT64", question_embedding)]
-    )
+    # 같은 질문을 다시 하면 디스크 캐시에서 바로 가져오므로 임베딩 API를 호출하지 않음
+    embedding_service = EmbeddingService(EMBEDDING_MODEL, backend="vertexai")
+    question_embedding = embedding_service.embed_one(user_question, task_type="RETRIEVAL_QUERY")
+
+    # --- 시맨틱 답변 캐시 조회 ---
+    # 임베딩 테이블이 바뀌면(수정 시각/행 수) 코퍼스 버전이 달라져 이전 답변은 사용하지 않음
+    answer_cache = SemanticAnswerCache() if USE_ANSWER_CACHE else None
+    corpus_version = f"{TABLE_NAME}|{table.modified.isoformat() if table.modified else ''}|{table.num_rows}|" \
+                     f"{EMBEDDING_MODEL}|{GENERATION_MODEL}"
+    # 검색 범위(노트북, 메타데이터 필터)나 검색 방식(하이브리드, 재순위)이 다른 답변은 재사용하지 않음
+    # (다른 노트북이나 필터 밖의 문서가 답변에 섞이지 않도록).
+    # 범위는 버전과 따로 저장되므로 설정을 바꿔도 다른 범위의 캐시된 답변은 지워지지 않음
+    answer_scope = json.dumps({"notebook": NOTEBOOK_ID, "filters": SEARCH_FILTERS, "hybrid": USE_HYBRID_SEARCH,
+                               "rerank": DEFAULT_RERANKER, "rerank_top_n": RERANK_TOP_N if DEFAULT_RERANKER != "none" else None},
+                              sort_keys=True, ensure_ascii=False)
+    if answer_cache:
+        hit = answer_cache.lookup(question_embedding, corpus_version, scope=answer_scope)
+        if hit:
+            print(f"[정보] 답변 캐시 적중 (유사도 {hit['similarity']:.3f}, 캐시된 질문: {hit['question']})")
+            print("\n[생성된 답변]")
+            print(hit["answer"])
+            print(f"\n[정보] {answer_cache.report()}")
+            return
+    started = time.perf_counter()
+
+    # --- BigQuery 벡터 검색 ---
+    # BQ_SEARCH_MODE=vector_index이면 벡터 인덱스 + VECTOR_SEARCH (BQ_FRACTION_LISTS_TO_SEARCH로 정확도 조절),
+    # 인덱스가 아직 빌드 중이면 ML.DISTANCE 전체 스캔으로 대체
+    # RERANK=llm 또는 cross_encoder이면 2단계 검색: 후보 RERANK_CANDIDATES개를 재순위하여 RERANK_TOP_N개만 생성에 사용
+    reranker = create_reranker()
+    top_k = RERANK_TOP_N if reranker else 3
+    candidate_k = RERANK_CANDIDATES if reranker else top_k
+    # 하이브리드 검색이면 RRF 결합을 위해 벡터 검색 후보를 더 많이 가져옴
+    search_k = max(DEFAULT_CANDIDATES, candidate_k) if USE_HYBRID_SEARCH else candidate_k
+    # 필터가 있으면 노트북도 source 조건으로 바꾸고, 테이블에 없는 열은 매니페스트로 source 조건으로 바꿔 WHERE로 적용
+    # 중복으로 건너뛴 청크는 다른 source의 원본 행으로만 있으므로, source 범위 검색은 링크된 원본 행도 포함
+    linked_sources = load_linked_sources(BQ_DEDUP_INDEX_PATH)
+    filters = SEARCH_FILTERS
+    if filters:
+        if NOTEBOOK_ID:
+            filters = {**filters, "notebook": NOTEBOOK_ID}
+        filters = resolve_notebook(filters, NotebookRegistry())
+        if any(column not in SQL_COLUMNS for column in filters):
+            filters = MetadataTable.from_manifest(IngestManifest(BQ_MANIFEST_PATH)).to_source_filter(filters)
+        print(f"[정보] 메타데이터 필터: {filters}")
     try:
-        results = list(bq_client.query(sql, job_config=job_config).result())
+        if filters:
+            results = search_vectors(bq_client, TABLE_NAME, [question_embedding], top_k=search_k,
+                                     columns=("id", text_column_name), mode=DEFAULT_SEARCH_MODE, filters=filters,
+                                     linked_sources=linked_sources)[0]
+        elif NOTEBOOK_ID:
+            # 노트북 샤드(그 노트북 source의 행만)를 불러와 메모리에서 검색하고, 본문은 결과 ID만 조회
+            shard_pool = NotebookShardPool(BigQueryShardLoader(bq_client, TABLE_NAME, NotebookRegistry(),
+                                                               corpus_version=corpus_version,
+                                                               linked_sources=linked_sources, model=EMBEDDING_MODEL))
+            hits = shard_pool.search(NOTEBOOK_ID, question_embedding, k=search_k)
+            rows = fetch_rows(bq_client, TABLE_NAME, [doc_id for doc_id, _ in hits], columns=(text_column_name,))
+            results = [{"id": doc_id, text_column_name: rows.get(doc_id, {}).get(text_column_name, ""),
+                        "cosine_sim": score} for doc_id, score in hits]
+            print(f"[정보] {shard_pool.report()}")
+        else:
+            results = search_vectors(bq_client, TABLE_NAME, [question_embedding], top_k=search_k,
+                                     columns=("id", text_column_name), mode=DEFAULT_SEARCH_MODE)[0]
     except Exception as e:
         print(f"\n--- 쿼리 실행 중 오류 발생 ---\n오류: {e}")
         return
 
+    if USE_HYBRID_SEARCH:
+        # --- BM25 + 벡터 하이브리드 (RRF) ---
+        lexical = BM25Index.load(LEXICAL_INDEX_PATH, version=corpus_version)
+        if lexical is None:
+            print("[정보] BM25 역색인을 만드는 중...")
+            lexical = BM25Index.from_bigquery(bq_client, TABLE_NAME, text_column=text_column_name,
+                                              version=corpus_version, store_text=True)
+            lexical.save(LEXICAL_INDEX_PATH)
+        texts = {row["id"]: row[text_column_name] for row in results}
+        # 역색인은 테이블 전체이므로 BM25 후보도 벡터 검색과 같은 범위(필터 또는 노트북 source)로 제한
+        # (청크 ID에서 source/chunk_index를 읽음)
+        lexical_filters = filters or ({"source": NotebookRegistry().sources(NOTEBOOK_ID)} if NOTEBOOK_ID else None)
+        lexical_rows = MetadataTable.from_ids(lexical.ids, linked_sources=linked_sources).rows(lexical_filters) \
+            if lexical_filters else None
+        lexical_hits = lexical.search(user_question, DEFAULT_CANDIDATES, rows=lexical_rows)
+        fused = reciprocal_rank_fusion([lexical_hits,
+                                        [(row["id"], row["cosine_sim"]) for row in results]], limit=candidate_k)
+        print(f"[정보] 하이브리드 검색: BM25 + 벡터 {len(results)}개 후보를 RRF로 결합")
+        results = [{"id": doc_id, text_column_name: texts.get(doc_id) or lexical.text(doc_id) or "", "cosine_sim": score}
+                   for doc_id, score in fused]
+    retrieve_sec = time.perf_counter() - started
+
+    if reranker:
+        # --- 2단계: 후보를 재순위하여 상위 top_k개만 사용 (점수는 질문/청크별로 캐시) ---
+        candidates = [Hit(row["id"], row["cosine_sim"], row[text_column_name]) for row in results]
+        reranked = reranker.rerank(user_question, candidates, top_n=top_k, version=corpus_version)
+        results = [{"id": hit.id, text_column_name: hit.text} for hit in reranked]
+        print(f"[정보] 1단계 검색 {retrieve_sec * 1000:.0f}ms ({len(candidates)}개 후보), {reranker.report()}")
+        print("[정보] 재순위 결과: " + ", ".join(f"{hit.id}(1단계 {hit.metadata['first_stage_rank'] + 1}위)"
+                                             for hit in reranked))
+
     # --- 5. 검색 결과로 LLM 프롬프트 구성 및 답변 생성 ---
-    retrieved_texts = [getattr(row, text_column_name) for row in results]
-    context_prompt = "\n\n".join(retrieved_texts) if retrieved_texts else "(관련 문서를 찾지 못했습니다.)"
+    retrieved_texts = [row[text_column_name] for row in results]
+    # 요청을 보내기 전에 로컬에서 토큰을 세어 상위 문서부터 예산(PROMPT_TOKEN_BUDGET) 안으로 채움
+    context_texts = fit_passages(retrieved_texts, DEFAULT_PROMPT_TOKEN_BUDGET, model=GENERATION_MODEL)
+    if context_texts != retrieved_texts:
+        print(f"[알림] 토큰 예산({DEFAULT_PROMPT_TOKEN_BUDGET})에 맞춰 컨텍스트를 줄였습니다: "
+              f"{len(retrieved_texts)}개 중 {len(context_texts)}개 사용")
+    context_prompt = "\n\n".join(context_texts) if context_texts else "(관련 문서를 찾지 못했습니다.)"
     prompt = f"""다음 문서를 참고하여 질문에 답하세요:\n\n{context_prompt}\n\n질문: {user_question}\n답변:"""
+    print(f"[정보] 프롬프트 토큰 수: {count_tokens(prompt, GENERATION_MODEL)}")
 
-    text_model = GenerativeModel("gemini-2.0-flash-lite-001") # 모델명을 최신으로 수정
+    text_model = GenerativeModel(GENERATION_MODEL)
 
     # --- 3. 답변 생성 함수 수정 ---
     # .predict() 대신 .generate_content()를 사용합니다.
@@ -81,5 +196,10 @@ def main():
     print("\n[생성된 답변]")
     print(answer)
 
+    if answer_cache:
+        answer_cache.put(user_question, question_embedding, corpus_version, answer, context_texts,
+                         latency_sec=time.perf_counter() - started, scope=answer_scope)
+        print(f"\n[정보] {answer_cache.report()}")
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,8 +1,14 @@
 import os
+import sys
 import numpy as np
-from google import genai
 from dotenv import load_dotenv
 from google.cloud import bigquery
+
+# 저장소 루트의 공통 모듈(common/)을 가져오기 위해 경로 추가
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.embedding import EmbeddingService # 디스크 캐시를 거치는 임베딩 facade
+from common.vector_search import InMemoryVectorIndex # 정규화된 float32 행렬 기반 top-k 검색
+from common.lexical import BM25Index, hybrid_search # 로컬 BM25 역색인 + RRF 결합
 # .env 파일에서 GCP 설정 로드
 load_dotenv()
 project_id = os.environ["GOOGLE_CLOUD_PROJECT"]
@@ -12,8 +18,8 @@ print("project_id=", project_id, " : project_location=", project_location)
 # Vertex AI GenAI 사용 설정
 os.environ["GOOGLE_GENAI_USE_VERTEXAI"] = "true"
 
-# genai 클라이언트 초기화
-client = genai.Client()
+# 임베딩 서비스 초기화 (google-genai backend, 디스크 캐시 사용)
+embed_service = EmbeddingService("text-multilingual-embedding-002", backend="genai")
 
 # BigQuery 클라이언트 초기화
 bq_client = bigquery.Client()
@@ -22,19 +28,17 @@ table_id = f"{dataset_id}.embeddings"
 
 # 벡터 유사도 검색 예시
 query_text = "example query"
-query_response = client.models.embed_content(model="text-multilingual-embedding-002", contents=query_text)
-query_vec = np.array(query_response.embeddings[0].values)
-
-# BigQuery에서 모든 벡터 불러오기
-query_job = bq_client.query(f"SELECT id, embedding FROM `{table_id}`")
-rows = query_job.result()
-data = [(row["id"], np.array(row["embedding"])) for row in rows]
+query_vec = np.array(embed_service.embed([query_text], task_type=None)[0])
 
-# 코사인 유사도 계산
-def cosine_similarity(a, b):
-    return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
+# BigQuery Storage Read API로 모든 벡터를 하나의 정규화된 float32 행렬에 불러오기
+index = InMemoryVectorIndex.from_bigquery(bq_client, table_id)
+print(f"[정보] 벡터 {len(index)}개 (차원 {index.dim}) 적재 완료")
 
-sims = [(item[0], cosine_similarity(query_vec, item[1])) for item in data]
-# 유사도 상위 3개 선택
-top3 = sorted(sims, key=lambda x: x[1], reverse=True)[:3]
+# 코사인 유사도 = 정규화된 벡터의 내적: 행렬-벡터 곱 한 번 + argpartition으로 상위 3개 선택
+top3 = index.search(query_vec, k=3)
 print("유사도 상위 3개 문서:", top3)
+
+# 하이브리드 검색: content 열의 BM25 상위 후보 안에서만 벡터 점수를 계산하고 두 순위를 RRF로 결합
+lexical = BM25Index.from_bigquery(bq_client, table_id, text_column="content")
+hybrid3 = hybrid_search(query_text, query_vec, lexical, index, k=3)
+print("하이브리드(BM25 + 벡터, RRF) 상위 3개 문서:", hybrid3)
@@ -1,7 +1,6 @@
 import os
+import sys
 from dotenv import load_dotenv
-from google import genai
-from google.genai.types import EmbedContentConfig
 from scipy.spatial.distance import cosine
 
 load_dotenv()
@@ -11,16 +10,19 @@ project_location = os.environ["GOOGLE_CLOUD_LOCATION"]
 print("project_id=", project_id, " : project_location=", project_location)
 os.environ["GOOGLE_GENAI_USE_VERTEXAI"] = "true"
 
-client = genai.Client()
+# 저장소 루트의 공통 모듈(common/)을 가져오기 위해 경로 추가
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.embedding import EmbeddingService # 디스크 캐시를 거치는 임베딩 facade
 
 models = ["text-embedding-005", "text-multilingual-embedding-002"]#, "gemini-embedding-001"]
 sentence = "What is the role of Vertex AI in document search?"
 
 # 각 모델로부터 임베딩 벡터 생성
 embeddings = {}
+services = {model: EmbeddingService(model, backend="genai") for model in models}
 for model in models:
-    response = client.models.embed_content(model=model, contents=sentence, config=EmbedContentConfig())
-    vector = response.embeddings[0].values  # 임베딩 벡터 값 (첫 번째 결과)
+    # 같은 문장은 캐시에서 바로 가져오므로 재실행 시 API를 호출하지 않음
+    vector = services[model].embed([sentence], task_type=None)[0]  # 임베딩 벡터 값 (첫 번째 결과)
     embeddings[model] = vector
 
 # 벡터 차원(길이) 출력
@@ -34,3 +36,6 @@ for i in range(len(models)):
         v2 = embeddings[models[j]]
         similarity = 1 - cosine(v1, v2)
         print(f"{models[i]} vs {models[j]} 코사인 유사도: {similarity:.3f}")
+
+for service in services.values():
+    print(service.report())
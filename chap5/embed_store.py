@@ -1,10 +1,56 @@
 import os
-import fitz  # PyMuPDF
+import sys
 from dotenv import load_dotenv
 from google.cloud import bigquery
-from google.cloud.bigquery import Dataset, Table, SchemaField
 import vertexai
-from vertexai.preview.language_models import TextEmbeddingModel, TextEmbeddingInput
+
+# 저장소 루트의 공통 모듈(common/)을 가져오기 위해 경로 추가
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.async_embedding import AsyncEmbeddingClient
+from common.chunking import ChunkingConfig, chunk_text
+from common.dedup import NearDuplicateIndex
+from common.embedding import EmbeddingService
+from common.extraction import default_text_cache
+from common.manifest import IngestManifest
+from common.pipeline import run_ingestion
+from common.sinks import BigQuerySink
+from common.bq_search import DEFAULT_SEARCH_MODE, ensure_vector_index
+from common.shards import NotebookRegistry
+
+# 청킹 설정 (rag.py의 rag.ChunkingConfig(chunk_size=512, chunk_overlap=50)과 동일한 기본값)
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "512"))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "50"))
+# 텍스트 추출 프로세스 수 (미설정 시 CPU 코어 수)
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", "0")) or None
+# 추출 텍스트 캐시 사용 여부 (파일 해시가 같은 PDF는 다시 파싱하지 않음, 위치는 EXTRACT_CACHE_DIR)
+USE_EXTRACT_CACHE = os.getenv("EXTRACT_CACHE", "true").lower() == "true"
+# 근접 중복 청크 제거 (MinHash/LSH, 유사도 기준은 DEDUP_THRESHOLD)와 중복 인덱스 저장 위치
+USE_DEDUP = os.getenv("DEDUP", "true").lower() == "true"
+DEDUP_INDEX_PATH = os.getenv("BQ_DEDUP_INDEX", "output_embeddings/bigquery_dedup.npz")
+EMBEDDING_MODEL = "text-multilingual-embedding-002"
+# 증분 인제스트 매니페스트 (파일 경로별 SHA-256, 임베딩 모델, 저장된 행 ID)
+MANIFEST_PATH = os.getenv("BQ_INGEST_MANIFEST", "output_embeddings/bigquery_manifest.json")
+# BigQuery 적재 방식: load(Parquet load job, 기본), load_avro, storage_write(Storage Write API), streaming
+BQ_WRITE_MODE = os.getenv("BQ_WRITE_MODE", "load")
+# 한 번에 적재할 최대 행 수 (메모리 사용량 상한)
+BQ_BATCH_ROWS = int(os.getenv("BQ_BATCH_ROWS", "5000"))
+# 임베딩 분당 요청 쿼터 (토큰 버킷이 이 값의 90%까지만 요청을 보냄)
+EMBEDDING_RPM = int(os.getenv("EMBEDDING_RPM", "600"))
+# 동시에 보낼 수 있는 임베딩 요청 수 상한 (실제 동시성은 쿼터 초과 여부에 따라 자동 조절)
+EMBEDDING_MAX_CONCURRENCY = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", "8"))
+# 선택: 이 실행의 파일들을 등록할 노트북 ID (chap11/qa_agent.py를 같은 NOTEBOOK_ID로 실행하면 이 파일들만 검색)
+NOTEBOOK_ID = os.getenv("NOTEBOOK_ID") or None
+
+
+def to_records(chunks, vectors):
+    """청크 묶음과 임베딩 벡터를 BigQuery 행으로 변환합니다."""
+    return [{
+        "id": chunk.chunk_id,
+        "content": chunk.text,
+        "embedding": vector,
+        "source": chunk.source,
+        "chunk_index": chunk.index,
+    } for chunk, vector in zip(chunks, vectors)]
 
 def main():
     """
@@ -18,16 +64,16 @@ def main():
 
     # Vertex AI SDK 초기화
     vertexai.init(project=project_id, location=project_location)
-    
+
     # BigQuery 클라이언트 초기화
     bq_client = bigquery.Client(project=project_id)
-    
-    # Vertex AI 임베딩 모델 로드
-    embedding_model = TextEmbeddingModel.from_pretrained("text-multilingual-embedding-002")
 
-    # --- 2. 텍스트 추출 및 임베딩 생성 ---
+    # Vertex AI 임베딩 모델 (디스크 캐시를 거치므로 이미 임베딩한 청크는 API를 호출하지 않음)
+    embedding_service = EmbeddingService(EMBEDDING_MODEL, backend="vertexai")
+
+    # --- 2. 변경된 파일 확인 (매니페스트와 비교) ---
     data_dir = "data"
-    processed_data = []  # id, content, embedding을 담을 리스트
+    chunking_config = ChunkingConfig(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
 
     try:
         filenames = [f for f in os.listdir(data_dir) if os.path.isfile(os.path.join(data_dir, f))]
@@ -35,91 +81,102 @@ def main():
         print(f"[오류] '{data_dir}' 디렉토리를 찾을 수 없습니다. 스크립트와 같은 위치에 만들어주세요.")
         return
 
-    print(f"'{data_dir}' 디렉토리에서 파일 처리 시작...")
-    for fname in filenames:
-        file_path = os.path.join(data_dir, fname)
-        text = ""
-
-        # 파일 확장자에 따라 텍스트 추출
-        if fname.lower().endswith(".pdf"):
-            try:
-                with fitz.open(file_path) as doc:
-                    text = "".join(page.get_text() for page in doc)
-            except Exception as e:
-                print(f"[오류] PDF 처리 실패: {fname} - {e}")
-                continue
-        elif fname.lower().endswith(".txt"):
-            try:
-                with open(file_path, "r", encoding="utf-8") as f:
-                    text = f.read()
-            except Exception as e:
-                print(f"[오류] TXT 읽기 실패: {fname} - {e}")
-                continue
-        else:
-            print(f"[알림] 지원하지 않는 파일 형식, 건너뜀: {fname}")
-            continue
-
-        if not text.strip():
-            print(f"[알림] 내용이 비어 있음, 건너뜀: {fname}")
-            continue
-
-        # 텍스트 임베딩 생성 (Vertex AI SDK 사용)
-        try:
-            # RETRIEVAL_DOCUMENT는 저장/인덱싱될 문서를 임베딩할 때 사용
-            embedding_input = TextEmbeddingInput(task_type="RETRIEVAL_DOCUMENT", text=text)
-            embedding_response = embedding_model.get_embeddings([embedding_input])
-            vector = embedding_response[0].values
-            
-            processed_data.append({
-                "id": fname,
-                "content": text,
-                "embedding": vector
-            })
-            print(f"[성공] 임베딩 생성 완료: {fname}")
-        except Exception as e:
-            print(f"[오류] 임베딩 생성 실패: {fname} - {e}")
-            continue
-
-    print(f"\n총 {len(processed_data)}개의 파일 처리가 완료되었습니다.")
-
-    if not processed_data:
-        print("처리할 데이터가 없어 프로그램을 종료합니다.")
-        return
-
-    # --- 3. BigQuery에 데이터 저장 ---
     dataset_id = "book_data"
     table_id = "embeddings"
-    full_dataset_id = f"{project_id}.{dataset_id}"
-    full_table_id = f"{full_dataset_id}.{table_id}"
-
-    print(f"\nBigQuery에 데이터 저장 시작: {full_table_id}")
-
-    dataset = Dataset(full_dataset_id)
-    dataset.location = "US"
-    bq_client.create_dataset(dataset, exists_ok=True)
-    print(f"데이터셋 '{dataset_id}' 준비 완료.")
-
-    schema = [
-        SchemaField("id", "STRING", mode="REQUIRED"),
-        SchemaField("content", "STRING", mode="REQUIRED"),
-        SchemaField("embedding", "FLOAT", mode="REPEATED"), # FLOAT64 대신 FLOAT 사용
-    ]
-    table = Table(full_table_id, schema=schema)
-
-    # 기존 테이블 삭제 후 새로 생성
-    bq_client.delete_table(table, not_found_ok=True)
-    print(f"기존 테이블 '{table_id}' 삭제 (스키마 업데이트를 위해).")
-    bq_client.create_table(table)
-    print(f"새로운 스키마로 테이블 '{table_id}' 생성 완료.")
+    full_table_id = f"{project_id}.{dataset_id}.{table_id}"
+    sink = BigQuerySink(bq_client, full_table_id, mode=BQ_WRITE_MODE, batch_rows=BQ_BATCH_ROWS)
+    manifest = IngestManifest(MANIFEST_PATH)
+
+    # 테이블을 새로 만들었다면 기존 행이 없으므로 전체 파일을 다시 처리
+    if not sink.prepare():
+        manifest.reset()
+    paths = [os.path.join(data_dir, f) for f in filenames]
+    plan = manifest.plan(paths, model=EMBEDDING_MODEL)
+    print(f"[정보] 증분 인제스트 계획: {plan.summary()}")
+
+    # 근접 중복 인덱스에서 다시 처리할 파일의 청크를 빼고, 빠지는 청크를 원본으로 삼아 건너뛴 청크가 있는
+    # (변경 없는) 파일도 다시 처리 (그 내용은 원본 청크로만 저장되어 있었으므로)
+    dedup = NearDuplicateIndex.load(DEDUP_INDEX_PATH) if USE_DEDUP else None
+    if dedup is not None:
+        if not manifest.entries:
+            dedup.clear()
+        orphaned = dedup.remove_sources(manifest.sources(plan.to_remove))
+        if orphaned:
+            plan.reprocess(manifest.paths_for(orphaned))
+            print(f"[정보] 중복 원본이 바뀌어 다시 처리할 파일: {sorted(orphaned)}")
+        dedup.save(DEDUP_INDEX_PATH)
+
+    # 새/변경/삭제된 파일의 기존 행만 삭제 (변경 없는 파일의 행은 그대로 유지)
+    sink.delete_sources(manifest.sources(plan.to_remove))
+    for path in plan.deleted:
+        manifest.forget(path)
+
+    if not plan.to_ingest:
+        manifest.save()
+        print("새로 추가되거나 변경된 파일이 없어 프로그램을 종료합니다.")
+        return
 
-    try:
-        errors = bq_client.insert_rows_json(table, processed_data)
-        if not errors:
-            print(f"성공적으로 {len(processed_data)}개의 행을 BigQuery에 저장했습니다.")
-        else:
-            print("BigQuery 삽입 중 오류 발생:", errors)
-    except Exception as e:
-        print(f"BigQuery 데이터 삽입 중 예외 발생: {e}")
+    # --- 3. 추출 → 청킹 → 임베딩 → BigQuery 적재 파이프라인 (새 파일/변경된 파일만) ---
+    # 단계들이 크기 제한 큐로 연결되어 있어 임베딩이 쿼터에 묶이면 추출도 그만큼 늦춰집니다.
+    # sink는 BQ_BATCH_ROWS 단위로 적재하므로 전체 결과를 메모리에 쌓지 않습니다.
+    print(f"'{data_dir}' 디렉토리에서 파일 처리 시작...")
+    print(f"BigQuery에 데이터 저장: {full_table_id} (적재 방식: {BQ_WRITE_MODE})")
+    embedding_client = AsyncEmbeddingClient(embedding_service, requests_per_minute=EMBEDDING_RPM,
+                                            max_concurrency=EMBEDDING_MAX_CONCURRENCY)
+    # 파일 전체를 하나의 벡터로 만들면 모델 입력 한도(2,048 토큰)를 넘는 부분이 잘리므로
+    # 토큰 기준으로 청킹하여 각 청크를 하나의 검색 단위(행)로 저장
+    result = run_ingestion(
+        plan.to_ingest,
+        chunk_fn=lambda doc: chunk_text(doc.text, chunking_config, source=doc.source),
+        embedding_client=embedding_client,
+        to_records=to_records,
+        sink=sink,
+        extract_workers=EXTRACT_WORKERS,
+        text_cache=default_text_cache() if USE_EXTRACT_CACHE else None,
+        dedup=dedup,
+        task_type="RETRIEVAL_DOCUMENT", # 저장/인덱싱될 문서를 임베딩할 때 사용
+    )
+    print(result.pipeline.report())
+    print(f"[정보] {result.extraction.report()}")
+    if result.pipeline.aborted or not sink.flush():
+        manifest.save()
+        return
+    print(f"\n총 {result.embedded}개의 청크 임베딩이 완료되었습니다.")
+    print(f"[정보] {embedding_service.report()}")
+    print(f"[정보] {embedding_client.report()}")
+    if dedup is not None:
+        print(f"[정보] {result.dedup_report()}")
+
+    # 일부 청크라도 실패한 파일은 이미 적재된 행을 지우고 다음 실행에서 다시 처리
+    if result.failed_sources:
+        print(f"[알림] 임베딩 실패로 다음 실행에서 다시 처리할 파일: {sorted(result.failed_sources)}")
+        sink.delete_sources(sorted(result.failed_sources))
+        for path in manifest.paths_for(result.failed_sources):
+            manifest.forget(path)
+
+    # 적재에 성공한 파일만 매니페스트에 기록 (추출에 실패한 파일도 다음 실행에서 다시 처리)
+    for source, path in result.paths.items():
+        if source in result.failed_sources:
+            continue
+        manifest.record(path, source, plan.hashes[path], EMBEDDING_MODEL, result.ids_by_source.get(source, []),
+                        shards=sink.locations(source))
+    manifest.save()
+    print(f"매니페스트 저장 완료: {MANIFEST_PATH}")
+    if dedup is not None:
+        dedup.save(DEDUP_INDEX_PATH)
+
+    # 노트북 샤드 등록: 현재 데이터 디렉토리에 있는 파일의 source를 노트북 source 목록으로 기록
+    if NOTEBOOK_ID:
+        registry = NotebookRegistry()
+        registry.set_sources(NOTEBOOK_ID, manifest.sources(paths))
+        registry.save()
+        print(f"[정보] 노트북 '{NOTEBOOK_ID}' source {len(paths)}개 등록: {registry.path}")
+
+    # VECTOR_SEARCH를 쓰는 경우 벡터 인덱스가 없으면 만들어 둠 (새 행은 BigQuery가 자동으로 인덱스에 반영)
+    if DEFAULT_SEARCH_MODE == "vector_index":
+        status = ensure_vector_index(bq_client, full_table_id)
+        if status:
+            print(f"[정보] 벡터 인덱스 상태: {status['status']}, 커버리지 {status['coverage']}%")
 
 if __name__ == "__main__":
     main()
@@ -1,9 +1,13 @@
 from dotenv import load_dotenv
 import os
+import sys
 import numpy as np
 from google.cloud import bigquery
-from google import genai
-from google.genai.types import EmbedContentConfig
+
+# 저장소 루트의 공통 모듈(common/)을 가져오기 위해 경로 추가
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.embedding import EmbeddingService # 디스크 캐시를 거치는 임베딩 facade
+from common.bq_search import DEFAULT_SEARCH_MODE, search_texts # 질문 여러 개를 임베딩 요청 1번 + 쿼리 작업 1번으로 검색
 
 # 환경변수 로드
 load_dotenv()
@@ -21,38 +25,18 @@ full_table_id = f"{project}.{dataset_id}.{table_id}"
 # 검색할 질문 목록
 queries = ["Rag는 뭐지", "Agent Builder 기능 설명해줘", "text embeding이 뭐지?"]
 
-# Google GenAI 클라이언트 (Vertex AI 임베딩 모델)
-embed_client = genai.Client()
+# Google GenAI 임베딩 서비스 (Vertex AI 임베딩 모델, 반복되는 질문은 디스크 캐시에서 조회)
+embed_service = EmbeddingService("text-multilingual-embedding-002", backend="genai")
+
+# 모든 질문을 한 번에 임베딩하고, 하나의 쿼리 작업으로 질문별 코사인 유사도 상위 3개 문서 조회
+# (질문 수와 관계없이 테이블은 한 번만 스캔. BQ_SEARCH_MODE=vector_index이면 VECTOR_SEARCH로 인덱스 사용)
+results = search_texts(bq_client, full_table_id, embed_service, queries, top_k=3,
+                       task_type="RETRIEVAL_DOCUMENT", mode=DEFAULT_SEARCH_MODE)
 
-for query in queries:
-    # 텍스트 임베딩 생성
-    response = embed_client.models.embed_content(
-        model="text-multilingual-embedding-002",
-        contents=query,
-        config=EmbedContentConfig(task_type="RETRIEVAL_DOCUMENT"),
-    )
-    # 임베딩 벡터 추출
-    embedding = list(response.embeddings[0].values)
-    
-    # BigQuery에서 코사인 유사도로 상위 3개 문서 조회
-    # Corrected SQL query
-    sql = f"""
-        SELECT
-            id,
-            (1 - ML.DISTANCE(embedding, @query_vector, 'COSINE')) AS cosine_sim
-        FROM `{full_table_id}`
-        ORDER BY cosine_sim DESC
-        LIMIT 3
-    """
-    job_config = bigquery.QueryJobConfig(
-        query_parameters=[
-            bigquery.ArrayQueryParameter("query_vector", "FLOAT64", embedding)
-        ]
-    )
-    query_job = bq_client.query(sql, job_config=job_config)
-    results = query_job.result()
-    
-    # 결과 출력
+# 결과 출력
+for query, rows in zip(queries, results):
     print(f"\n질문: {query}")
-    for row in results:
-        print(f"ID: {row.id}, 유사도: {row.cosine_sim:.6f}")
+    for row in rows:
+        print(f"ID: {row['id']}, 유사도: {row['cosine_sim']:.6f}")
+
+print(f"\n{embed_service.report()}")
@@ -1,11 +1,22 @@
 import os
-import fitz  # PyMuPDF: PDF 텍스트 추출용
-import json # JSON 처리를 위해 추가
+import sys
+import time
 from google import genai
-from google.genai.types import EmbedContentConfig # EmbedContentConfig 임포트 추가
 from dotenv import load_dotenv
 from google.cloud import storage # GCS 연동을 위해 추가
 
+# 저장소 루트의 공통 모듈(common/)을 가져오기 위해 경로 추가
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.async_embedding import AsyncEmbeddingClient # 쿼터를 고려한 비동기 임베딩 요청
+from common.chunking import Chunk, estimate_tokens
+from common.extraction import default_text_cache # 추출 텍스트 캐시
+from common.embedding_matrix import jsonl_to_matrix, upload_matrix # FAISS용 .npy 행렬 내보내기
+from common.dedup import NearDuplicateIndex # 근접 중복 청크 제거 (MinHash/LSH)
+from common.embedding import EmbeddingService # 디스크 캐시를 거치는 임베딩 facade
+from common.manifest import IngestManifest # 증분 인제스트 매니페스트
+from common.pipeline import run_ingestion # 추출 → 청킹 → 임베딩 → 저장 단계 파이프라인
+from common.sinks import JsonlSink, MatchingEngineStreamSink # Matching Engine용 JSONL 샤드 저장/업로드, 스트림 upsert
+
 # .env 파일에서 GCP 설정 로드
 load_dotenv()
 project_id = os.getenv("GOOGLE_CLOUD_PROJECT")
@@ -20,153 +31,230 @@ GCS_BUCKET_NAME = os.getenv("GCS_BUCKET_FOR_EMBEDDINGS", "notebook-docs")
 GCS_OUTPUT_FOLDER = "embeddings/" # '/'로 끝나야 합니다.
 # 로컬에 생성될 JSONL 파일 관련 설정
 LOCAL_OUTPUT_DIR = "output_embeddings" # 로컬에 저장될 디렉토리
-OUTPUT_JSONL_FILENAME = "embeddings_for_matching_engine.json" # 생성될 JSONL 파일 이름
-
-# Vertex AI GenAI 사용 설정
-os.environ["GOOGLE_GENAI_USE_VERTEXAI"] = "true"
-
-# genai 클라이언트 초기화
-try:
-    client = genai.Client()
-except Exception as e:
-    print(f"GenAI 클라이언트 초기화 실패: {e}")
-    print("GOOGLE_APPLICATION_CREDENTIALS 환경 변수가 올바르게 설정되었는지, "
-          "또는 gcloud auth application-default login이 실행되었는지 확인하세요.")
-    exit()
-
-# 데이터 디렉토리에서 파일 목록 읽기
-data_dir = "data"
-if not os.path.isdir(data_dir):
-    print(f"[오류] 데이터 디렉토리 '{data_dir}'를 찾을 수 없습니다. "
-          f"스크립트와 같은 위치에 '{data_dir}' 디렉토리를 생성하고 PDF 또는 TXT 파일을 넣어주세요.")
-    exit()
-
-filenames = [
-    f for f in os.listdir(data_dir)
-    if os.path.isfile(os.path.join(data_dir, f))
-]
-
-embedding_records = []  # {"id": 파일명, "embedding": 벡터} 딕셔너리를 저장할 리스트
-
-# 각 파일에 대해 파일 확장자에 맞게 텍스트 추출 후 임베딩 생성
-print(f"\n총 {len(filenames)}개의 파일에 대해 임베딩 생성을 시작합니다...")
-for fname in filenames:
-    file_path = os.path.join(data_dir, fname)
-    text_content = "" # 변수명 변경: text -> text_content
-
-    # PDF 파일 처리 (.pdf 확장자)
-    if fname.lower().endswith(".pdf"):
-        try:
-            pdf_document = fitz.open(file_path)
-            for page_num in range(len(pdf_document)):
-                page = pdf_document.load_page(page_num)
-                text_content += page.get_text()
-            pdf_document.close()
-            print(f"[정보] PDF 파일 텍스트 추출 완료: {fname}")
-        except Exception as e:
-            print(f"[오류] PDF 처리 실패: {fname} - {e}")
-            continue
-
-    # 텍스트 파일 처리 (.txt 확장자)
-    elif fname.lower().endswith(".txt"):
-        try:
-            with open(file_path, "r", encoding="utf-8") as f:
-                text_content = f.read()
-            print(f"[정보] TXT 파일 읽기 완료: {fname}")
-        except Exception as e:
-            print(f"[오류] TXT 읽기 실패: {fname} - {e}")
-            continue
-
-    # 지원하지 않는 파일 형식 건너뜀
-    else:
-        print(f"[알림] 지원하지 않는 파일 형식 ({os.path.splitext(fname)[1]}), 건너뜀: {fname}")
-        continue
+# 이전 버전이 만들던 단일 JSONL 파일 이름 (현재는 part-<실행ID>.json 샤드로 저장)
+LEGACY_JSONL_FILENAME = "embeddings_for_matching_engine.json"
+# 증분 인제스트 매니페스트 (파일 경로별 SHA-256, 임베딩 모델, 행 ID, 샤드 이름)
+MANIFEST_PATH = os.getenv("ME_INGEST_MANIFEST", os.path.join(LOCAL_OUTPUT_DIR, "matching_engine_manifest.json"))
+EMBEDDING_MODEL = "text-embedding-005"
+# 텍스트 추출 프로세스 수 (미설정 시 CPU 코어 수)
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", "0")) or None
+# 추출 텍스트 캐시 사용 여부 (파일 해시가 같은 PDF는 다시 파싱하지 않음, 위치는 EXTRACT_CACHE_DIR)
+USE_EXTRACT_CACHE = os.getenv("EXTRACT_CACHE", "true").lower() == "true"
+# 근접 중복 청크 제거 (MinHash/LSH, 유사도 기준은 DEDUP_THRESHOLD)와 중복 인덱스 저장 위치
+USE_DEDUP = os.getenv("DEDUP", "true").lower() == "true"
+DEDUP_INDEX_PATH = os.getenv("ME_DEDUP_INDEX", os.path.join(LOCAL_OUTPUT_DIR, "matching_engine_dedup.npz"))
+# 임베딩 분당 요청 쿼터와 동시 요청 수 상한 (동시성은 쿼터 초과 여부에 따라 자동 조절)
+EMBEDDING_RPM = int(os.getenv("EMBEDDING_RPM", "600"))
+EMBEDDING_MAX_CONCURRENCY = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", "8"))
+# 샤드 하나의 최대 크기(MB). 넘으면 다음 샤드로 넘어가고 다 쓴 샤드는 임베딩과 병렬로 업로드
+SHARD_MAX_MB = int(os.getenv("ME_SHARD_MAX_MB", "64"))
+UPLOAD_WORKERS = int(os.getenv("ME_UPLOAD_WORKERS", "4"))
+# 선택: Matching Engine 필터링용 restricts ("네임스페이스=레코드필드" 쉼표 구분, 예: "source=source")
+RESTRICT_FIELDS = dict(item.split("=", 1) for item in os.getenv("ME_RESTRICTS", "").split(",") if "=" in item)
+# 선택: 범위 필터용 numeric restricts ("네임스페이스=레코드필드" 쉼표 구분, 예: "chunk_index=chunk_index,ingested_at=ingested_at")
+NUMERIC_RESTRICT_FIELDS = dict(item.split("=", 1) for item in os.getenv("ME_NUMERIC_RESTRICTS", "").split(",")
+                               if "=" in item)
+# 선택: crowding_tag로 쓸 레코드 필드 (예: "source"면 한 파일의 결과가 검색 결과를 독점하지 않음)
+CROWDING_TAG_FIELD = os.getenv("ME_CROWDING_TAG_FIELD") or None
+# 선택: FAISS 검색용 .npy 행렬도 함께 만들기 (JSONL은 Matching Engine 입력/교환용으로 유지)
+EXPORT_MATRIX = os.getenv("ME_EXPORT_MATRIX", "false").lower() == "true"
+MATRIX_DTYPE = os.getenv("ME_MATRIX_DTYPE", "float32") # float32 또는 float16 (절반 크기)
+# contents_delta_uri 폴더와 섞이지 않도록 별도 폴더에 저장 (chap6/faiss_search.py의 GCS_MATRIX_PREFIX와 일치)
+GCS_MATRIX_PREFIX = os.getenv("GCS_MATRIX_PREFIX", "embeddings_matrix/embeddings")
+LOCAL_MATRIX_PREFIX = os.path.join(LOCAL_OUTPUT_DIR, "matrix", "embeddings")
+# 인덱스 갱신 방식: "batch"(contents_delta_uri 샤드만 갱신, 인덱스 재빌드 필요) 또는
+# "stream"(샤드 갱신과 함께 STREAM_UPDATE 인덱스에 바로 upsert/remove, 몇 초 안에 검색 가능)
+UPDATE_MODE = os.getenv("ME_UPDATE_MODE", "batch")
+# 스트림 갱신 대상 인덱스 표시 이름 (vertex_ai_matching_engine.py의 INDEX_DISPLAY_NAME과 일치)
+INDEX_DISPLAY_NAME = os.getenv("ME_INDEX_DISPLAY_NAME",
+                               f"my-embeddings-idx-{project_id.replace('-', '')[:10] if project_id else 'default'}")
+
+
+def whole_document(doc):
+    """
+    파일 전체 텍스트를 하나의 청크로 취급합니다 (파일 하나 = Matching Engine 데이터포인트 하나).
+    입력당 토큰 한도를 넘는 긴 파일은 임베딩 단계에서 조각별로 임베딩한 뒤 하나의 벡터로 합칩니다.
+    """
+    return [Chunk(text=doc.text, index=0, token_count=estimate_tokens(doc.text), source=doc.source)]
+
+
+def to_records(chunks, vectors):
+    """
+    청크 묶음과 임베딩 벡터를 Matching Engine 레코드로 변환합니다 (ID는 파일명).
+    chunk_index와 ingested_at(유닉스 초)은 restricts/numeric restricts 필터 값으로 쓸 수 있습니다.
+    """
+    ingested_at = int(time.time())
+    return [{"id": chunk.source, "embedding": vector, "source": chunk.source, "chunk_index": chunk.index,
+             "ingested_at": ingested_at}
+            for chunk, vector in zip(chunks, vectors)]
 
-    # 추출된 텍스트가 비어있으면 건너뜀
-    if not text_content.strip():
-        print(f"[알림] 내용이 비어 있음, 건너뜀: {fname}")
-        continue
 
-    # 모델에 텍스트 전송하여 임베딩 생성
+def main():
+    """
+    데이터 디렉토리의 파일들을 임베딩하여 Matching Engine용 JSONL로 저장하고 GCS에 업로드합니다.
+    """
+    # Vertex AI GenAI 사용 설정
+    os.environ["GOOGLE_GENAI_USE_VERTEXAI"] = "true"
+
+    # genai 클라이언트 초기화
     try:
-        # EmbedContentConfig를 사용하여 task_type 설정
-        config = EmbedContentConfig(task_type="RETRIEVAL_DOCUMENT")
-        # 모델 이름을 Vertex AI 특정 모델 ID로 변경 시도
-        response = client.models.embed_content(
-            model="text-embedding-005", # 이전: "models/text-multilingual-embedding-002"
-            contents=text_content,
-            config=config
-        )
-        # API 응답 구조 확인: response는 딕셔너리, 실제 임베딩은 'embedding' 키에 있음
-        # Vertex AI 사용 시 응답 구조가 다를 수 있음. response.embeddings[0].values 또는 response['embedding']
-        if 'embedding' in response:
-             vec = response['embedding']
-        elif hasattr(response, 'embeddings') and response.embeddings:
-             vec = response.embeddings[0].values
-        else:
-            print(f"[오류] 임베딩 벡터를 찾을 수 없음: {fname} - 응답: {response}")
-            continue
-
-        embedding_records.append({"id": fname, "embedding": vec})
-        print(f"[성공] 임베딩 생성 완료: {fname}, 차원={len(vec)}")
+        client = genai.Client()
     except Exception as e:
-        print(f"[오류] 임베딩 생성 실패: {fname} - {e}") # 전체 예외 메시지 출력
-        # 실패 시 추가 정보 출력 (예: API 응답 내용)
-        if hasattr(e, 'response') and hasattr(e.response, 'text') and e.response.text:
-            print(f"API 응답 본문: {e.response.text}")
-        # google.api_core.exceptions.GoogleAPIError의 경우 추가 정보가 있을 수 있음
-        if hasattr(e, 'errors') and e.errors:
-            print(f"API 오류 상세: {e.errors}")
-        if hasattr(e, 'message') and e.message: # 이미 출력되지만 명시
-             print(f"오류 메시지 요약: {e.message}")
-        continue
-
-# 생성된 임베딩 레코드 확인
-print(f"\n총 임베딩 생성 레코드 수: {len(embedding_records)}")
-if embedding_records:
-    for record in embedding_records[:2]: # 처음 2개 샘플 출력
-        print(f"  샘플 레코드 - ID: {record['id']}, 벡터 미리보기 (처음 3개 차원): {record['embedding'][:3]}...")
-
-    # --- 로컬에 JSONL 파일로 저장 ---
-    if not os.path.exists(LOCAL_OUTPUT_DIR):
-        os.makedirs(LOCAL_OUTPUT_DIR)
-        print(f"로컬 출력 디렉토리 생성: '{LOCAL_OUTPUT_DIR}'")
-
-    local_file_path = os.path.join(LOCAL_OUTPUT_DIR, OUTPUT_JSONL_FILENAME)
-    try:
-        with open(local_file_path, "w", encoding="utf-8") as f:
-            for record in embedding_records:
-                f.write(json.dumps(record) + "\n")
-        print(f"\n[성공] 임베딩 데이터를 로컬 파일에 저장 완료: {local_file_path}")
-
-        # --- GCS에 업로드 ---
-        if not project_id:
-            print("[오류] GCS 업로드를 위해 GOOGLE_CLOUD_PROJECT 환경 변수가 필요합니다. 업로드를 건너<0xEB><0><0x81>니다.")
-        else:
-            try:
-                storage_client = storage.Client(project=project_id)
-                bucket = storage_client.bucket(GCS_BUCKET_NAME)
-                gcs_blob_path = f"{GCS_OUTPUT_FOLDER.strip('/')}/{OUTPUT_JSONL_FILENAME}"
-                blob = bucket.blob(gcs_blob_path)
-
-                print(f"로컬 파일 '{local_file_path}'을(를) GCS 'gs://{GCS_BUCKET_NAME}/{gcs_blob_path}'에 업로드 중...")
-                blob.upload_from_filename(local_file_path)
-                print(f"[성공] GCS 업로드 완료: gs://{GCS_BUCKET_NAME}/{gcs_blob_path}")
-                print(f"이 GCS 폴더 경로 ('gs://{GCS_BUCKET_NAME}/{GCS_OUTPUT_FOLDER.strip('/')}/')를 "
-                      f"Matching Engine의 contents_delta_uri로 사용할 수 있습니다.")
-
-            except Exception as e:
-                print(f"[오류] GCS 업로드 실패: {e}")
-                print("  GCS 버킷 이름, 권한, 인증 설정을 확인하세요.")
-                print(f"  - GCS 버킷: {GCS_BUCKET_NAME}")
-                print(f"  - 대상 경로: {gcs_blob_path}")
-                print(f"  - 로컬 파일: {local_file_path}")
-                print(f"  - 프로젝트 ID: {project_id}")
+        print(f"GenAI 클라이언트 초기화 실패: {e}")
+        print("GOOGLE_APPLICATION_CREDENTIALS 환경 변수가 올바르게 설정되었는지, "
+              "또는 gcloud auth application-default login이 실행되었는지 확인하세요.")
+        return
+    # 같은 텍스트는 디스크 캐시에서 바로 가져오므로 재실행 시 API를 호출하지 않음
+    embedding_service = EmbeddingService(EMBEDDING_MODEL, backend="genai", client=client)
 
+    # 데이터 디렉토리에서 파일 목록 읽기
+    data_dir = "data"
+    if not os.path.isdir(data_dir):
+        print(f"[오류] 데이터 디렉토리 '{data_dir}'를 찾을 수 없습니다. "
+              f"스크립트와 같은 위치에 '{data_dir}' 디렉토리를 생성하고 PDF 또는 TXT 파일을 넣어주세요.")
+        return
+
+    filenames = [
+        f for f in os.listdir(data_dir)
+        if os.path.isfile(os.path.join(data_dir, f))
+    ]
+
+
+    # --- 증분 인제스트: 매니페스트와 비교하여 새 파일/변경된 파일만 처리 ---
+    bucket = None
+    if project_id:
+        storage_client = storage.Client(project=project_id)
+        bucket = storage_client.bucket(GCS_BUCKET_NAME)
+    else:
+        print("[알림] GOOGLE_CLOUD_PROJECT 환경 변수가 없어 GCS 업로드 없이 로컬에만 저장합니다.")
+
+    manifest = IngestManifest(MANIFEST_PATH)
+    sink = JsonlSink(LOCAL_OUTPUT_DIR, manifest, bucket=bucket, gcs_folder=GCS_OUTPUT_FOLDER,
+                     max_shard_bytes=SHARD_MAX_MB * 1024 * 1024, upload_workers=UPLOAD_WORKERS,
+                     restrict_fields=RESTRICT_FIELDS, crowding_tag_field=CROWDING_TAG_FIELD,
+                     numeric_restrict_fields=NUMERIC_RESTRICT_FIELDS)
+    if UPDATE_MODE == "stream":
+        from google.cloud import aiplatform
+        from common.matching_engine import find_index
+
+        aiplatform.init(project=project_id, location=project_location)
+        index = find_index(INDEX_DISPLAY_NAME)
+        if index is None:
+            print(f"[오류] 스트림 갱신할 인덱스 '{INDEX_DISPLAY_NAME}'를 찾을 수 없습니다. "
+                  f"vertex_ai_matching_engine.py를 ME_INDEX_UPDATE_METHOD=STREAM_UPDATE로 먼저 실행하세요.")
+            return
+        sink = MatchingEngineStreamSink(index, sink)
+        print(f"[정보] 스트림 갱신 모드: {index.resource_name}")
+    sink.prepare()
+    if not manifest.entries:
+        # 이전 버전의 단일 JSONL 파일은 샤드와 내용이 중복되므로 첫 증분 실행 시 제거
+        legacy_path = os.path.join(LOCAL_OUTPUT_DIR, LEGACY_JSONL_FILENAME)
+        if os.path.exists(legacy_path):
+            os.remove(legacy_path)
+        if bucket is not None:
+            legacy_blob = bucket.blob(f"{GCS_OUTPUT_FOLDER.strip('/')}/{LEGACY_JSONL_FILENAME}")
+            if legacy_blob.exists():
+                legacy_blob.delete()
+                print(f"[정보] 이전 단일 JSONL 파일 삭제: gs://{GCS_BUCKET_NAME}/{legacy_blob.name}")
+
+    paths = [os.path.join(data_dir, f) for f in filenames]
+    plan = manifest.plan(paths, model=EMBEDDING_MODEL)
+    print(f"[정보] 증분 인제스트 계획: {plan.summary()}")
+
+    # 근접 중복 인덱스에서 다시 처리할 파일의 청크를 빼고, 빠지는 청크를 원본으로 삼아 건너뛴 청크가 있는
+    # (변경 없는) 파일도 다시 처리 (그 내용은 원본 청크로만 저장되어 있었으므로)
+    dedup = NearDuplicateIndex.load(DEDUP_INDEX_PATH) if USE_DEDUP else None
+    if dedup is not None:
+        if not manifest.entries:
+            dedup.clear()
+        orphaned = dedup.remove_sources(manifest.sources(plan.to_remove))
+        if orphaned:
+            plan.reprocess(manifest.paths_for(orphaned))
+            print(f"[정보] 중복 원본이 바뀌어 다시 처리할 파일: {sorted(orphaned)}")
+        dedup.save(DEDUP_INDEX_PATH)
+
+    # 변경/삭제된 파일의 기존 행만 샤드에서 제거 (변경 없는 파일의 행은 그대로 유지)
+    sink.delete_sources(manifest.sources(plan.to_remove))
+    for path in plan.deleted:
+        manifest.forget(path)
+
+    # --- 추출 → 임베딩 → 로컬 JSONL 샤드 기록 파이프라인 ---
+    # 캐시 미스인 파일만 쿼터(EMBEDDING_RPM) 안에서 동시에 API를 호출하고, 레코드는 나오는 즉시
+    # 샤드에 기록합니다 (크기 한도를 넘은 샤드는 백그라운드에서 GCS 업로드).
+    print(f"\n총 {len(plan.to_ingest)}개의 파일에 대해 텍스트 추출과 임베딩 생성을 시작합니다...")
+    embedding_client = AsyncEmbeddingClient(embedding_service, requests_per_minute=EMBEDDING_RPM,
+                                            max_concurrency=EMBEDDING_MAX_CONCURRENCY)
+    result = run_ingestion(
+        plan.to_ingest,
+        chunk_fn=whole_document,
+        embedding_client=embedding_client,
+        to_records=to_records,
+        sink=sink,
+        extract_workers=EXTRACT_WORKERS,
+        text_cache=default_text_cache() if USE_EXTRACT_CACHE else None,
+        dedup=dedup,
+        task_type="RETRIEVAL_DOCUMENT",
+    )
+    print(result.pipeline.report())
+    print(f"[정보] {result.extraction.report()}")
+    if result.pipeline.aborted:
+        print(f"[오류] 로컬 JSONL 샤드 저장 실패: {sink.run_shard}")
+        manifest.save()
+        return
+
+    # 생성된 임베딩 레코드 확인
+    print(f"\n총 임베딩 생성 레코드 수: {result.embedded}")
+    print(f"[정보] {embedding_service.report()}")
+    print(f"[정보] {embedding_client.report()}")
+    if dedup is not None:
+        print(f"[정보] {result.dedup_report()}")
+    if not result.embedded:
+        print("\n생성된 임베딩 레코드가 없어 JSONL 파일 생성을 건너뜁니다.")
+
+    if not sink.flush():
+        # 업로드에 실패한 파일은 매니페스트에 기록하지 않아 다음 실행에서 다시 처리됨
+        print("[오류] GCS 업로드 실패")
+        print("  GCS 버킷 이름, 권한, 인증 설정을 확인하세요.")
+        print(f"  - GCS 버킷: {GCS_BUCKET_NAME}")
+        print(f"  - 대상 폴더: {GCS_OUTPUT_FOLDER}")
+        print(f"  - 프로젝트 ID: {project_id}")
+        manifest.save()
+        return
+    if bucket is not None:
+        print(f"이 GCS 폴더 경로 ('gs://{GCS_BUCKET_NAME}/{GCS_OUTPUT_FOLDER.strip('/')}/')를 "
+              f"Matching Engine의 contents_delta_uri로 사용할 수 있습니다.")
+
+    # 임베딩에 실패한 파일(및 그 청크에 링크된 중복 파일)의 행은 업로드가 끝난 샤드에서 제거하고 다음 실행에서 다시 처리
+    if result.failed_sources:
+        print(f"[알림] 임베딩 실패로 다음 실행에서 다시 처리할 파일: {sorted(result.failed_sources)}")
+        sink.delete_sources(sorted(result.failed_sources))
+        for path in manifest.paths_for(result.failed_sources):
+            manifest.forget(path)
+        if not sink.flush():
+            print("[오류] 실패한 파일의 행을 지운 샤드 업로드 실패, 다음 실행에서 다시 처리합니다.")
+            manifest.save()
+            return
+
+    # 저장/업로드에 성공한 파일만 매니페스트에 기록 (내용이 모두 중복이라 행이 없는 파일도 기록)
+    for source, path in result.paths.items():
+        if source not in result.failed_sources:
+            manifest.record(path, source, plan.hashes[path], EMBEDDING_MODEL,
+                            result.ids_by_source.get(source, []), shards=sink.locations(source))
+    manifest.save()
+    print(f"매니페스트 저장 완료: {MANIFEST_PATH}")
+    if UPDATE_MODE == "stream":
+        print(f"[정보] Matching Engine 스트림 갱신: upsert {sink.upserted}개, 삭제 {sink.removed}개")
+    if dedup is not None:
+        dedup.save(DEDUP_INDEX_PATH)
+
+    # --- 선택: 전체 샤드를 .npy 행렬로 변환 (faiss_search.py에서 메모리 매핑으로 로드) ---
+    if EXPORT_MATRIX:
+        header = jsonl_to_matrix(sink.shard_paths(), LOCAL_MATRIX_PREFIX, EMBEDDING_MODEL, MATRIX_DTYPE)
+        print(f"[성공] 임베딩 행렬 저장 완료: {LOCAL_MATRIX_PREFIX}.npy "
+              f"({header['count']}개 x {header['dim']}차원, {header['dtype']})")
+        if bucket is not None:
+            upload_matrix(bucket, LOCAL_MATRIX_PREFIX, GCS_MATRIX_PREFIX)
 
-    except Exception as e:
-        print(f"[오류] 로컬 JSONL 파일 저장 실패: {local_file_path} - {e}")
-else:
-    print("\n생성된 임베딩 레코드가 없어 JSONL 파일 생성 및 GCS 업로드를 건너<0xEB><0><0x81>니다.")
 
- 
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,21 @@
 from dotenv import load_dotenv
 import os
+import sys
 import numpy as np
-import google.generativeai as genai
 from google.cloud import storage # For reading files from GCS
 import json # For parsing JSON embedding files
-import faiss # For FAISS similarity search
+
+# 저장소 루트의 공통 모듈(common/)을 가져오기 위해 경로 추가
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.embedding import EmbeddingService # 디스크 캐시를 거치는 임베딩 facade
+from common.embedding_matrix import MATRIX_SUFFIXES, download_matrix, load_matrix # .npy 행렬 형식
+from common.faiss_index import (build_config, build_faiss_index, download_snapshot, gcs_manifest_hash,
+                                load_index_snapshot, read_snapshot_meta, save_index_snapshot, snapshot_is_current,
+                                upload_snapshot)
+from common.retrievers import FaissRetriever # 검색 백엔드 공통 인터페이스 (결과: Hit 리스트)
+from common.filters import MetadataTable # 메타데이터 필터 (행 비트맵 → IDSelector)
+from common.dedup import load_linked_sources # 근접 중복 링크 (원본 청크 ID → 링크한 source)
+from common.manifest import IngestManifest # 인제스트 시각(ingested_at) 조회
 # import time # No longer strictly needed for ME deployment waits
 
 # --- 기본 환경 설정 (Basic Environment Setup) ---
@@ -27,9 +38,29 @@ print(f"Using GCS bucket: gs://{BUCKET_NAME}/ (Must be in the same region as Ver
 GCS_EMBEDDINGS_FOLDER = os.getenv("GCS_EMBEDDINGS_FOLDER_NAME", "embeddings/")
 CONTENTS_DELTA_URI_PREFIX = f"{GCS_EMBEDDINGS_FOLDER.strip('/')}/" # Used as a prefix for listing blobs
 
+# 임베딩 로드 형식: "jsonl"(Matching Engine용 JSONL 샤드를 파싱) 또는 "npy"(바이너리 행렬을 메모리 매핑)
+# npy 행렬은 chap6/embed_store4vertex_ai_matching_engine.py를 ME_EXPORT_MATRIX=true로 실행하면 생성됩니다.
+EMBEDDINGS_FORMAT = os.getenv("EMBEDDINGS_FORMAT", "jsonl")
+GCS_MATRIX_PREFIX = os.getenv("GCS_MATRIX_PREFIX", "embeddings_matrix/embeddings")
+LOCAL_MATRIX_PREFIX = os.getenv("LOCAL_MATRIX_PREFIX", os.path.join("output_embeddings", "matrix_cache", "embeddings"))
+
 # 임베딩 차원 (Embedding dimension)
 # "textembedding-gecko-multilingual", "text-multilingual-embedding-002", "models/text-embedding-004" (Gemini) 등 모델 기준
 EMBEDDING_DIMENSION = 768 # 사용하는 임베딩 모델에 맞게 조정하세요.
+# 문서/쿼리 임베딩 모델 (스냅샷 메타데이터에 기록되며, 바뀌면 인덱스를 다시 빌드)
+EMBED_MODEL = os.getenv("FAISS_EMBED_MODEL", "models/text-embedding-004")
+
+# FAISS 인덱스 스냅샷 위치. 원본 임베딩의 매니페스트 해시가 같으면 다시 빌드하지 않고 메모리 매핑으로 로드
+FAISS_INDEX_DIR = os.getenv("FAISS_INDEX_DIR", os.path.join("output_embeddings", "faiss_index"))
+# 빌드한 스냅샷을 GCS에도 올려 다른 검색 워커가 내려받아 쓰도록 함 (빈 문자열이면 사용 안 함)
+GCS_FAISS_INDEX_PREFIX = os.getenv("GCS_FAISS_INDEX_PREFIX", "faiss_index/")
+# 검색 메타데이터 필터 (JSON, common.filters 형식). 예: '{"source": ["a.pdf"], "chunk_index": {"lt": 20}}'
+FAISS_FILTERS = json.loads(os.getenv("FAISS_FILTERS", "") or "{}")
+# 청크별 메타데이터 열 테이블(스냅샷 옆에 저장)과 인제스트 시각을 읽을 Matching Engine 인제스트 매니페스트
+METADATA_PATH = os.path.join(FAISS_INDEX_DIR, "metadata.npz")
+ME_MANIFEST_PATH = os.getenv("ME_INGEST_MANIFEST", os.path.join("output_embeddings", "matching_engine_manifest.json"))
+# 근접 중복 인덱스. 다른 파일의 원본 행에 링크만 남긴 청크를 source 필터에 포함할 때 읽음
+ME_DEDUP_INDEX_PATH = os.getenv("ME_DEDUP_INDEX", os.path.join("output_embeddings", "matching_engine_dedup.npz"))
 
 # --- Vertex AI 및 GenAI 클라이언트 초기화 (Initialize Vertex AI and GenAI Clients) ---
 if not PROJECT_ID or not LOCATION:
@@ -118,92 +149,158 @@ def load_embeddings_and_ids_from_gcs(bucket_name, gcs_folder_prefix):
 
     return all_embeddings_np, all_doc_ids
 
-def build_faiss_index(embeddings_np, embedding_dimension):
+def load_embeddings_and_ids_from_matrix(bucket_name, gcs_matrix_prefix, local_prefix):
     """
-    주어진 임베딩으로 FAISS 인덱스를 빌드합니다.
+    GCS의 .npy 임베딩 행렬을 로컬로 내려받아(이미 있으면 재사용) 메모리 매핑으로 로드합니다.
+    JSON 파싱과 Python float 리스트 변환을 거치지 않으므로 추가 복사본이 생기지 않습니다.
 
     Args:
-        embeddings_np (numpy.ndarray): float32 타입의 임베딩 numpy 배열.
-        embedding_dimension (int): 임베딩 차원.
+        bucket_name (str): GCS 버킷 이름.
+        gcs_matrix_prefix (str): 버킷 내 행렬 파일 접두어 (예: "embeddings_matrix/embeddings").
+        local_prefix (str): 내려받을 로컬 파일 접두어.
+
+    Returns:
+        tuple: (embeddings, doc_ids)
+               embeddings (numpy.memmap): (개수, 차원) float32 또는 float16 행렬.
+               doc_ids (list): 문자열 ID 리스트.
+    """
+    storage_client = storage.Client(project=PROJECT_ID)
+    bucket = storage_client.bucket(bucket_name)
+    print(f"\nGCS에서 임베딩 행렬 로드 중: gs://{bucket_name}/{gcs_matrix_prefix}.npy")
+    if not download_matrix(bucket, gcs_matrix_prefix, local_prefix):
+        print("GCS에서 임베딩 행렬을 찾지 못했습니다. ME_EXPORT_MATRIX=true로 임베딩 스크립트를 실행했는지 확인하세요.")
+        return None, None
+
+    embeddings, doc_ids, header = load_matrix(local_prefix, mmap=True)
+    print(f"임베딩 행렬 로드 완료: {header['count']}개 x {header['dim']}차원 ({header['dtype']}, 모델: {header['model']})")
+    if header["dim"] != EMBEDDING_DIMENSION:
+        raise ValueError(f"임베딩 행렬의 차원({header['dim']})이 EMBEDDING_DIMENSION({EMBEDDING_DIMENSION})과 일치하지 않습니다.")
+    return embeddings, doc_ids
+
+def source_manifest_hash(bucket):
+    """
+    인덱스 원본(EMBEDDINGS_FORMAT에 따라 JSONL 샤드 또는 .npy 행렬 파일)의 GCS 매니페스트 해시.
+    객체 목록만 조회하므로 임베딩을 내려받지 않고 스냅샷이 최신인지 판단할 수 있습니다.
+    """
+    if EMBEDDINGS_FORMAT == "npy":
+        blobs = [bucket.get_blob(GCS_MATRIX_PREFIX + suffix) for suffix in MATRIX_SUFFIXES]
+        blobs = [b for b in blobs if b is not None]
+    else:
+        blobs = [b for b in bucket.list_blobs(prefix=CONTENTS_DELTA_URI_PREFIX) if b.name.endswith(".json")]
+    return gcs_manifest_hash(blobs)
+
+def load_or_build_index():
+    """
+    최신 스냅샷이 있으면 로드하고, 없으면 임베딩을 읽어 인덱스를 빌드한 뒤 스냅샷으로 저장합니다.
+
+    순서: 로컬 스냅샷 → GCS 스냅샷 → 원본 임베딩으로 빌드 (빌드 후 로컬 저장 및 GCS 업로드)
 
     Returns:
-        faiss.Index: 빌드된 FAISS 인덱스.
+        tuple: (faiss_index, doc_ids). 임베딩을 로드하지 못하면 (None, None).
     """
-    print(f"\nFAISS 인덱스 빌드 중... (임베딩 개수: {embeddings_np.shape[0]}, 차원: {embedding_dimension})")
-    # DOT_PRODUCT_DISTANCE와 유사하게 작동하도록 IndexFlatIP 사용
-    # (정규화된 벡터의 경우 코사인 유사도와 동일)
-    index = faiss.IndexFlatIP(embedding_dimension)
-    index.add(embeddings_np)
-    print(f"FAISS 인덱스 빌드 완료. 인덱스에 총 {index.ntotal}개의 벡터가 있습니다.")
-    return index
-
-# --- FAISS 인덱스 로드 및 빌드 ---
-embeddings_np, doc_ids = load_embeddings_and_ids_from_gcs(BUCKET_NAME, CONTENTS_DELTA_URI_PREFIX)
-
-if embeddings_np is not None and doc_ids:
-    faiss_index = build_faiss_index(embeddings_np, EMBEDDING_DIMENSION)
-
-    # --- 검색할 쿼리 텍스트 및 임베딩 생성 (Query Text and Embedding Generation) ---
-    query_text = "RAG란 무엇인가요?"
-    # query_text = "Vertex AI Matching Engine의 주요 기능은 무엇인가?"
-    # query_text = "LLM 모델을 평가하는 일반적인 기준은 무엇인가?"
+    storage_client = storage.Client(project=PROJECT_ID)
+    bucket = storage_client.bucket(BUCKET_NAME)
+    manifest_hash = source_manifest_hash(bucket)
+    # FAISS_INDEX_TYPE/FAISS_TARGET_RECALL이 바뀌어도 다시 빌드
+    config = build_config()
+
+    if snapshot_is_current(read_snapshot_meta(FAISS_INDEX_DIR), EMBED_MODEL, EMBEDDING_DIMENSION, manifest_hash, config):
+        loaded = load_index_snapshot(FAISS_INDEX_DIR, mmap=True)
+        if loaded:
+            print(f"[정보] FAISS 스냅샷 로드 (메모리 매핑): {FAISS_INDEX_DIR} ({loaded[2]['count']}개)")
+            return loaded[0], loaded[1]
+    if GCS_FAISS_INDEX_PREFIX and download_snapshot(bucket, GCS_FAISS_INDEX_PREFIX, FAISS_INDEX_DIR,
+                                                    EMBED_MODEL, EMBEDDING_DIMENSION, manifest_hash, config):
+        loaded = load_index_snapshot(FAISS_INDEX_DIR, mmap=True)
+        if loaded:
+            print(f"[정보] GCS의 FAISS 스냅샷 로드: gs://{BUCKET_NAME}/{GCS_FAISS_INDEX_PREFIX} ({loaded[2]['count']}개)")
+            return loaded[0], loaded[1]
+
+    print("[알림] 최신 FAISS 스냅샷이 없어 인덱스를 새로 빌드합니다.")
+    if EMBEDDINGS_FORMAT == "npy":
+        embeddings_np, doc_ids = load_embeddings_and_ids_from_matrix(BUCKET_NAME, GCS_MATRIX_PREFIX, LOCAL_MATRIX_PREFIX)
+    else:
+        embeddings_np, doc_ids = load_embeddings_and_ids_from_gcs(BUCKET_NAME, CONTENTS_DELTA_URI_PREFIX)
+    if embeddings_np is None or not doc_ids:
+        return None, None
+
+    faiss_index, build_info = build_faiss_index(embeddings_np, EMBEDDING_DIMENSION,
+                                                index_type=config["index_type"], target_recall=config["target_recall"])
+    save_index_snapshot(FAISS_INDEX_DIR, faiss_index, doc_ids, EMBED_MODEL, manifest_hash,
+                        extra={"build_config": config, "build": build_info})
+    print(f"[성공] FAISS 스냅샷 저장 완료: {FAISS_INDEX_DIR}")
+    if GCS_FAISS_INDEX_PREFIX:
+        try:
+            upload_snapshot(bucket, FAISS_INDEX_DIR, GCS_FAISS_INDEX_PREFIX)
+        except Exception as e:
+            print(f"[오류] FAISS 스냅샷 GCS 업로드 실패: {e}")
+    return faiss_index, doc_ids
+
+def load_or_build_metadata(doc_ids):
+    """
+    인덱스 행 순서와 같은 메타데이터 테이블을 로드하고, 없거나 ID가 다르거나
+    스냅샷의 원본 매니페스트 해시가 바뀌었으면(다시 인제스트됨) ID와 매니페스트로 다시 만듭니다.
+    """
+    snapshot_meta = read_snapshot_meta(FAISS_INDEX_DIR) or {}
+    manifest_hash = snapshot_meta.get("manifest_hash", "")
+    metadata = MetadataTable.load(METADATA_PATH, ids=doc_ids, source_hash=manifest_hash)
+    if metadata is None:
+        manifest = IngestManifest(ME_MANIFEST_PATH) if os.path.exists(ME_MANIFEST_PATH) else None
+        metadata = MetadataTable.from_ids(doc_ids, manifest, linked_sources=load_linked_sources(ME_DEDUP_INDEX_PATH))
+        metadata.save(METADATA_PATH, source_hash=manifest_hash)
+        print(f"[정보] 메타데이터 테이블 저장: {METADATA_PATH} (열: {', '.join(metadata.columns)})")
+    return metadata
+
+def main():
+    # --- FAISS 인덱스 로드 (최신 스냅샷이 없을 때만 빌드) ---
+    faiss_index, doc_ids = load_or_build_index()
+
+    if faiss_index is not None and doc_ids:
+        # --- 검색할 쿼리 텍스트 및 임베딩 생성 (Query Text and Embedding Generation) ---
+        query_text = "RAG란 무엇인가요?"
+        # query_text = "Vertex AI Matching Engine의 주요 기능은 무엇인가?"
+        # query_text = "LLM 모델을 평가하는 일반적인 기준은 무엇인가?"
     
-    # Gemini 1.5 Flash 모델 사용 예시 (text-embedding-004)
-    # embed_model = "models/text-embedding-004" # Gemini 모델
-    # 이전 textembedding-gecko 모델 사용 예시
-    embed_model = "models/text-embedding-004"
-    print(f"\n쿼리 텍스트: '{query_text}'")
-    print(f"이 쿼리에 대한 임베딩 생성 중 (모델: {embed_model})...")
+        # Gemini 1.5 Flash 모델 사용 예시 (text-embedding-004)
+        # embed_model = "models/text-embedding-004" # Gemini 모델
+        # 이전 textembedding-gecko 모델 사용 예시
+        embed_model = EMBED_MODEL
+        print(f"\n쿼리 텍스트: '{query_text}'")
+        print(f"이 쿼리에 대한 임베딩 생성 중 (모델: {embed_model})...")
     
-    try:
-        response_embedding = genai.embed_content(
-            model=embed_model, # Vertex AI 백엔드 사용시 모델 ID
-            content=query_text,
-            task_type="RETRIEVAL_QUERY", # 검색용 쿼리
-            # title="Optional title for query" # 필요시 제목 추가
-        )
-        query_vector = response_embedding['embedding']
-        print(f"쿼리 임베딩 생성 성공. 차원: {len(query_vector)}")
-
-        # --- FAISS 인덱스에서 최근접 이웃 검색 ---
-        print(f"\nFAISS 인덱스를 사용하여 유사 항목 검색 중...")
-        num_neighbors_to_find = 5
-        query_vector_np = np.array([query_vector]).astype('float32')
-
-        # FAISS 검색: D는 거리(유사도 점수), I는 인덱스
-        # IndexFlatIP의 경우 D는 내적값 (클수록 유사함)
-        distances, indices = faiss_index.search(query_vector_np, num_neighbors_to_find)
-
-        if indices.size > 0 and indices[0][0] != -1 : # indices[0][0] == -1 이면 검색 결과 없음
-            print(f"\n'{query_text}'에 대한 검색 결과 ({len(indices[0])}개):")
-            for i in range(len(indices[0])):
-                neighbor_idx = indices[0][i]
-                neighbor_id = doc_ids[neighbor_idx]
-                neighbor_similarity = distances[0][i] # IndexFlatIP는 내적값
-                print(f"  {i+1}. ID: {neighbor_id}, 유사도 (Dot Product): {neighbor_similarity:.6f}")
-        else:
-            print("유사한 항목을 찾지 못했습니다.")
-
-    except Exception as e:
-        print(f"임베딩 생성 또는 FAISS 검색 중 오류 발생: {e}")
-        import traceback
-        traceback.print_exc()
-else:
-    print("\n임베딩 로드에 실패하여 FAISS 검색을 진행할 수 없습니다.")
-
-# --- FAISS 인덱스 저장/로드 (선택 사항) ---
-# 생성된 FAISS 인덱스를 저장하고 싶다면:
-# if 'faiss_index' in locals() and faiss_index:
-#     index_filename = "my_faiss_index.index"
-#     faiss.write_index(faiss_index, index_filename)
-#     print(f"\nFAISS 인덱스가 '{index_filename}' 파일로 저장되었습니다.")
-#     # doc_ids도 함께 저장해야 합니다 (예: pickle 또는 json)
-#     with open("my_doc_ids.json", "w") as f:
-#         json.dump(doc_ids, f)
-#     print(f"문서 ID가 'my_doc_ids.json' 파일로 저장되었습니다.")
-
-# 저장된 FAISS 인덱스를 로드하고 싶다면:
-# loaded_index = faiss.read_index("my_faiss_index.index")
-# with open("my_doc_ids.json", "r") as f:
-#     loaded_doc_ids = json.load(f)
-# print("\n저장된 FAISS 인덱스와 문서 ID를 로드했습니다.")
+        try:
+            # google-generativeai backend, 검색용 쿼리(RETRIEVAL_QUERY). 같은 질문은 디스크 캐시에서 조회
+            embed_service = EmbeddingService(embed_model, backend="generativeai")
+            query_vector = embed_service.embed_one(query_text, task_type="RETRIEVAL_QUERY")
+            print(f"쿼리 임베딩 생성 성공. 차원: {len(query_vector)}")
+
+            # --- FAISS 인덱스에서 최근접 이웃 검색 ---
+            print(f"\nFAISS 인덱스를 사용하여 유사 항목 검색 중...")
+            num_neighbors_to_find = 5
+
+            # 모든 인덱스 종류가 내적(METRIC_INNER_PRODUCT)을 사용하므로 score는 내적값 (클수록 유사함)
+            # IVF/HNSW가 k개보다 적게 찾은 경우(-1)는 어댑터가 걸러냄
+            # FAISS_FILTERS가 있으면 조건을 만족하는 행만 검색 (선택도가 높으면 그 행들만 정확 검색)
+            metadata = load_or_build_metadata(doc_ids) if FAISS_FILTERS else None
+            retriever = FaissRetriever(faiss_index, doc_ids, metadata=metadata)
+            if FAISS_FILTERS:
+                print(f"[정보] 메타데이터 필터: {FAISS_FILTERS} ({int(metadata.mask(FAISS_FILTERS).sum())}/{len(doc_ids)}개 행)")
+            hits = retriever.search([query_vector], k=num_neighbors_to_find, filters=FAISS_FILTERS)[0]
+
+            if hits:
+                print(f"\n'{query_text}'에 대한 검색 결과 ({len(hits)}개):")
+                for i, hit in enumerate(hits):
+                    print(f"  {i+1}. ID: {hit.id}, 유사도 (Dot Product): {hit.score:.6f}")
+            else:
+                print("유사한 항목을 찾지 못했습니다.")
+            print(f"\n{embed_service.report()}")
+
+        except Exception as e:
+            print(f"임베딩 생성 또는 FAISS 검색 중 오류 발생: {e}")
+            import traceback
+            traceback.print_exc()
+    else:
+        print("\n임베딩 로드에 실패하여 FAISS 검색을 진행할 수 없습니다.")
+
+if __name__ == "__main__":
+    main()
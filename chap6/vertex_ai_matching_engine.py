@@ -6,7 +6,14 @@ import os
 import google.generativeai as genai
 # from google.genai.types import EmbedContentConfig # 직접 사용되지 않으나, 확장 시 일관성을 위해 참고 가능
 from google.cloud import aiplatform
-import time # 배포 상태 확인을 위한 time 모듈 추가
+import asyncio # 배포 준비 상태를 비동기로 확인
+import sys
+import time # 정리(cleanup) 단계의 대기에 사용
+
+# 저장소 루트의 공통 모듈(common/)을 가져오기 위해 경로 추가
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.retrievers import MatchingEngineRetriever # 검색 백엔드 공통 인터페이스 (결과: Hit 리스트)
+from common.matching_engine import request_deploy, wait_until_ready # 배포 요청 + 백오프 준비 확인
 
 # --- 기본 환경 설정 (Basic Environment Setup) ---
 # .env 파일에서 환경 변수 로드 (Load environment variables from .env file)
@@ -44,6 +51,12 @@ DEPLOYED_INDEX_ID = f"deployed_idx_{sanitized_project_id}"
 # 임베딩 차원 (Embedding dimension)
 EMBEDDING_DIMENSION = 768 # "textembedding-gecko-multilingual" 또는 "text-multilingual-embedding-002" 모델 기준
 
+# 인덱스 갱신 방식: "BATCH_UPDATE"(contents_delta_uri로 재빌드) 또는 "STREAM_UPDATE"
+# (embed_store4vertex_ai_matching_engine.py를 ME_UPDATE_MODE=stream으로 실행하면 바로 upsert/remove)
+INDEX_UPDATE_METHOD = os.getenv("ME_INDEX_UPDATE_METHOD", "BATCH_UPDATE")
+# 배포를 요청한 뒤 실제로 질의를 받을 수 있을 때까지 기다릴지 여부 (false면 요청만 하고 종료)
+WAIT_FOR_DEPLOY = os.getenv("ME_WAIT_FOR_DEPLOY", "true").lower() == "true"
+
 # --- Vertex AI 및 GenAI 클라이언트 초기화 (Initialize Vertex AI and GenAI Clients) ---
 if not PROJECT_ID or not LOCATION:
     raise ValueError("GOOGLE_CLOUD_PROJECT and GOOGLE_CLOUD_LOCATION 환경 변수를 설정해야 합니다.\n(GOOGLE_CLOUD_PROJECT and GOOGLE_CLOUD_LOCATION environment variables must be set.)")
@@ -60,6 +73,9 @@ indexes = aiplatform.MatchingEngineIndex.list(filter=f'display_name="{INDEX_DISP
 if indexes:
     index = indexes[0]
     print(f"기존 인덱스 사용: {index.resource_name}")
+    if INDEX_UPDATE_METHOD == "STREAM_UPDATE" and \
+            index.to_dict().get("indexUpdateMethod") != "STREAM_UPDATE":
+        print("[알림] 기존 인덱스는 스트림 갱신을 지원하지 않습니다. 스트림 갱신을 쓰려면 인덱스를 다시 만드세요.")
 else:
     print(f"새 인덱스 생성 중... (GCS 경로: {CONTENTS_DELTA_URI})")
     try:
@@ -69,6 +85,7 @@ else:
             dimensions=EMBEDDING_DIMENSION,
             approximate_neighbors_count=10,
             distance_measure_type="DOT_PRODUCT_DISTANCE", # 코사인 유사도와 관련 (COSINE_DISTANCE도 가능)
+            index_update_method=INDEX_UPDATE_METHOD,
         )
         print(f"인덱스 생성됨: {index.resource_name}. 작업이 완료될 때까지 시간이 걸릴 수 있습니다.")
         # 인덱스 생성 완료 대기 (실제 운영 시에는 더 견고한 로직 권장)
@@ -112,34 +129,18 @@ if current_endpoint_state.deployed_indexes:
 if not is_deployed:
     print(f"인덱스 '{index.display_name}' (ID: {DEPLOYED_INDEX_ID})를 엔드포인트 '{index_endpoint.display_name}'에 배포 중...")
     try:
-        index_endpoint.deploy_index(
-            index=index, deployed_index_id=DEPLOYED_INDEX_ID
-        )
-        print(f"인덱스 배포 요청 성공. 배포 완료까지 몇 분 정도 소요될 수 있습니다. (상태 확인 중...)")
-
-        wait_interval = 60 # 초
-        max_attempts = 20  # 최대 시도 횟수 (20 * 60초 = 20분)
-        for attempt in range(max_attempts):
-            current_endpoint = aiplatform.MatchingEngineIndexEndpoint(index_endpoint.name) # 최신 정보 가져오기
-            deployment_ready = False
-            if current_endpoint.deployed_indexes:
-                for di in current_endpoint.deployed_indexes:
-                    if di.id == DEPLOYED_INDEX_ID:
-                        # 실제 배포 상태 확인을 더 정확하게 하려면,
-                        # di.deployment_status (사용 가능한 경우) 또는 엔드포인트의 public_domain_name 등을 확인해야 합니다.
-                        # 여기서는 ID 존재 및 일정 시간 경과로 배포 간주 (프로덕션에서는 더 견고한 확인 필요)
-                        print(f"시도 {attempt + 1}/{max_attempts}: 인덱스 '{DEPLOYED_INDEX_ID}'가 엔드포인트에 있는 것을 확인했습니다.")
-                        deployment_ready = True # 간소화된 확인
-                        break
-            if deployment_ready:
-                # 실제 서비스 가능 상태가 되기까지 추가 시간이 필요할 수 있음
-                print(f"인덱스 '{DEPLOYED_INDEX_ID}'의 배포 프로세스가 시작되었거나 완료된 것으로 보입니다. 서비스 가능까지 몇 분 더 소요될 수 있습니다.")
-                break
-            print(f"시도 {attempt + 1}/{max_attempts}: 배포가 아직 완료되지 않았습니다. {wait_interval}초 후 다시 확인합니다.")
-            time.sleep(wait_interval)
-        else: # for-else: 루프가 break 없이 완료된 경우
-            print("최대 시도 횟수를 초과했습니다. 배포 상태를 Google Cloud Console에서 수동으로 확인해주세요.")
-
+        # deploy_index는 배포가 끝날 때까지 막히므로 요청만 보내고, 준비 상태는 따로 확인
+        deploy_operation = request_deploy(index_endpoint, index, DEPLOYED_INDEX_ID)
+        print(f"인덱스 배포 요청 성공. 배포 완료까지 몇 분 정도 소요될 수 있습니다.")
+        if WAIT_FOR_DEPLOY:
+            # 배포 작업 완료 + 엔드포인트의 배포 인덱스 + 프로브 검색 성공을 지수 백오프 간격으로 확인
+            if asyncio.run(wait_until_ready(index_endpoint.resource_name, DEPLOYED_INDEX_ID,
+                                            dimensions=EMBEDDING_DIMENSION, operation=deploy_operation)):
+                print(f"[성공] 인덱스 '{DEPLOYED_INDEX_ID}'가 질의를 받을 수 있습니다.")
+            else:
+                print("배포 상태를 Google Cloud Console에서 확인해주세요.")
+        else:
+            print("[알림] ME_WAIT_FOR_DEPLOY=false: 배포 완료를 기다리지 않습니다.")
     except Exception as e:
         print(f"인덱스 배포 오류: {e}")
 else:
@@ -173,16 +174,13 @@ try:
         num_neighbors_to_find = 5
         print(f"최근접 이웃 {num_neighbors_to_find}개 검색 요청...")
 
-        response_neighbors = index_endpoint.find_neighbors(
-            deployed_index_id=DEPLOYED_INDEX_ID,
-            queries=[query_vector],
-            num_neighbors=num_neighbors_to_find
-        )
+        retriever = MatchingEngineRetriever(index_endpoint, DEPLOYED_INDEX_ID)
+        hits = retriever.search([query_vector], k=num_neighbors_to_find)[0]
 
-        if response_neighbors and response_neighbors[0]:
-            print(f"\n'{query_text}'에 대한 검색 결과 ({len(response_neighbors[0])}개):")
-            for i, neighbor in enumerate(response_neighbors[0]):
-                print(f"  {i+1}. ID: {neighbor.id}, 거리 (Distance): {neighbor.distance:.6f}")
+        if hits:
+            print(f"\n'{query_text}'에 대한 검색 결과 ({len(hits)}개):")
+            for i, hit in enumerate(hits):
+                print(f"  {i+1}. ID: {hit.id}, 거리 (Distance): {hit.score:.6f}")
         else:
             print("유사한 항목을 찾지 못했거나 응답이 비어 있습니다.")
     else:
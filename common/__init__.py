@@ -0,0 +1,6 @@
+"""
+여러 장(chapter)의 스크립트가 공유하는 인제스트(ingestion)/검색 공통 모듈.
+
+각 장의 스크립트는 저장소 루트를 sys.path에 추가한 뒤
+`from common.chunking import ...` 형태로 가져다 사용합니다.
+"""
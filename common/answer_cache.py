@@ -0,0 +1,188 @@
+"""
+시맨틱(의미 기반) 답변 캐시.
+
+사용자는 같은 질문을 조금씩 다른 말로 반복해서 묻습니다. 질문 임베딩이 캐시된 질문과
+코사인 유사도 threshold 이상이고 같은 코퍼스 버전이면, BigQuery 검색과 generate_content 호출 없이
+캐시된 답변과 컨텍스트를 돌려줍니다.
+
+- 코퍼스 버전: 임베딩 테이블이 바뀌면(수정 시각/행 수) 버전이 달라져 이전 답변은 무효화됩니다.
+- 범위(scope): 같은 코퍼스 안에서 검색 범위(노트북 등)가 다른 답변은 서로 적중하지 않습니다.
+  범위가 다른 항목은 지우지 않으므로 노트북을 오가도 각 노트북의 답변이 남습니다.
+- TTL: ttl_sec가 지난 항목은 사용하지 않고 지웁니다.
+- 크기 제한: max_entries를 넘으면 가장 오래 사용하지 않은 항목부터 지웁니다(LRU).
+- 지표: 적중률과 적중으로 절약한 시간(원래 답변 생성에 걸린 시간의 합)을 실행 간에 누적합니다.
+
+질문 벡터는 EmbeddingCache와 같은 float32 바이트열로 SQLite에 저장하고, 조회 시 같은 버전의 벡터를
+한 번에 행렬로 읽어 내적으로 비교합니다 (max_entries 이내이므로 전체 비교로 충분히 빠릅니다).
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from common.embedding_cache import _decode, _encode
+
+DEFAULT_ANSWER_CACHE_PATH = os.getenv(
+    "ANSWER_CACHE_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "notebooklm", "answers.sqlite3"),
+)
+# 캐시된 질문과 이 코사인 유사도 이상이면 같은 질문으로 봄
+DEFAULT_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+# 답변 유효 시간(시간 단위)
+DEFAULT_TTL_SEC = float(os.getenv("ANSWER_CACHE_TTL_HOURS", "24")) * 3600
+# 최대 저장 답변 수
+DEFAULT_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+
+
+class SemanticAnswerCache:
+    """
+    질문 임베딩 유사도로 조회하는 답변 캐시 (SQLite, 여러 스레드에서 함께 사용해도 안전).
+
+    사용 예:
+        cache = SemanticAnswerCache()
+        hit = cache.lookup(question_vector, corpus_version)
+        if hit is None:
+            ... 검색 및 답변 생성 ...
+            cache.put(question, question_vector, corpus_version, answer, contexts, latency_sec)
+    """
+    def __init__(self, path: str = DEFAULT_ANSWER_CACHE_PATH, threshold: float = DEFAULT_THRESHOLD,
+                 ttl_sec: float = DEFAULT_TTL_SEC, max_entries: int = DEFAULT_MAX_ENTRIES):
+        """
+        Args:
+            path: SQLite 파일 경로.
+            threshold: 적중으로 판단할 최소 코사인 유사도.
+            ttl_sec: 답변 유효 시간(초).
+            max_entries: 최대 저장 답변 수.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.threshold = threshold
+        self.ttl_sec = ttl_sec
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            " id INTEGER PRIMARY KEY, corpus_version TEXT NOT NULL, question TEXT NOT NULL,"
+            " embedding BLOB NOT NULL, answer TEXT NOT NULL, contexts TEXT NOT NULL,"
+            " latency_sec REAL NOT NULL, created REAL NOT NULL, last_access REAL NOT NULL,"
+            " scope TEXT NOT NULL DEFAULT '')"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(answers)")}
+        if "scope" not in columns:
+            # 범위 열이 없던 이전 캐시 파일: 기존 항목은 범위 ''로 둠
+            self._conn.execute("ALTER TABLE answers ADD COLUMN scope TEXT NOT NULL DEFAULT ''")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_answers_version ON answers(corpus_version)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_answers_scope ON answers(corpus_version, scope)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS metrics (name TEXT PRIMARY KEY, value REAL NOT NULL)")
+        self._conn.commit()
+
+    def _add_metric(self, name: str, value: float):
+        self._conn.execute(
+            "INSERT INTO metrics (name, value) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value", (name, value))
+
+    def _expire(self, corpus_version: str, now: float):
+        """다른 코퍼스 버전과 TTL이 지난 항목을 지웁니다."""
+        cur = self._conn.execute("DELETE FROM answers WHERE corpus_version != ? OR created < ?",
+                                 (corpus_version, now - self.ttl_sec))
+        if cur.rowcount:
+            self._add_metric("invalidations", cur.rowcount)
+
+    def lookup(self, question_vector, corpus_version: str, scope: str = ""):
+        """
+        의미가 같은 캐시된 질문을 찾습니다.
+
+        Args:
+            question_vector: 질문 임베딩 벡터.
+            corpus_version: 현재 코퍼스 버전 문자열 (임베딩 테이블이 바뀌면 달라지는 값).
+            scope: 검색 범위 문자열 (예: 노트북 ID). 같은 범위로 저장된 답변만 찾습니다.
+
+        Returns:
+            dict: {"question", "answer", "contexts", "similarity", "latency_sec"}. 없으면 None.
+        """
+        query = np.asarray(question_vector, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        now = time.time()
+        with self._lock:
+            self._expire(corpus_version, now)
+            rows = self._conn.execute(
+                "SELECT id, embedding FROM answers WHERE corpus_version = ? AND scope = ?",
+                (corpus_version, scope)).fetchall()
+            best_id, best_score = None, self.threshold
+            if rows:
+                matrix = np.array([_decode(blob) for _, blob in rows], dtype=np.float32)
+                if matrix.shape[1] == len(query):
+                    matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+                    scores = matrix @ query
+                    top = int(np.argmax(scores))
+                    if scores[top] >= best_score:
+                        best_id, best_score = rows[top][0], float(scores[top])
+            if best_id is None:
+                self._add_metric("misses", 1)
+                self._conn.commit()
+                return None
+            question, answer, contexts, latency_sec = self._conn.execute(
+                "SELECT question, answer, contexts, latency_sec FROM answers WHERE id = ?", (best_id,)).fetchone()
+            self._conn.execute("UPDATE answers SET last_access = ? WHERE id = ?", (now, best_id))
+            self._add_metric("hits", 1)
+            self._add_metric("saved_sec", latency_sec)
+            self._conn.commit()
+        return {"question": question, "answer": answer, "contexts": json.loads(contexts),
+                "similarity": best_score, "latency_sec": latency_sec}
+
+    def put(self, question: str, question_vector, corpus_version: str, answer: str, contexts: list,
+            latency_sec: float, scope: str = ""):
+        """
+        답변을 저장합니다. max_entries를 넘으면 가장 오래 사용하지 않은 항목부터 지웁니다.
+
+        Args:
+            latency_sec: 이 답변을 만드는 데 걸린 시간 (검색 + 생성). 적중 시 절약한 시간으로 집계합니다.
+            scope: 검색 범위 문자열 (lookup과 같은 값).
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO answers (corpus_version, scope, question, embedding, answer, contexts, latency_sec,"
+                " created, last_access) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (corpus_version, scope, question, _encode(question_vector), answer,
+                 json.dumps(contexts, ensure_ascii=False), latency_sec, now, now))
+            cur = self._conn.execute(
+                "DELETE FROM answers WHERE id IN (SELECT id FROM answers ORDER BY last_access DESC"
+                " LIMIT -1 OFFSET ?)", (self.max_entries,))
+            if cur.rowcount:
+                self._add_metric("evictions", cur.rowcount)
+            self._conn.commit()
+
+    def clear(self):
+        """모든 답변을 지웁니다 (지표는 유지)."""
+        with self._lock:
+            self._conn.execute("DELETE FROM answers")
+            self._conn.commit()
+
+    def metrics(self) -> dict:
+        """누적 지표: hits, misses, evictions, invalidations, saved_sec, hit_rate, entries."""
+        with self._lock:
+            values = dict(self._conn.execute("SELECT name, value FROM metrics").fetchall())
+            entries = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+        result = {name: values.get(name, 0) for name in ("hits", "misses", "evictions", "invalidations", "saved_sec")}
+        lookups = result["hits"] + result["misses"]
+        result["hit_rate"] = result["hits"] / lookups if lookups else 0.0
+        result["entries"] = entries
+        return result
+
+    def report(self) -> str:
+        m = self.metrics()
+        return (f"답변 캐시: 적중 {int(m['hits'])}회 / 조회 {int(m['hits'] + m['misses'])}회 "
+                f"(적중률 {m['hit_rate']:.1%}), 절약한 시간 {m['saved_sec']:.1f}초, "
+                f"저장 {m['entries']}개, 축출 {int(m['evictions'])}개, 무효화 {int(m['invalidations'])}개")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,237 @@
+"""
+쿼터를 고려한 비동기 임베딩 클라이언트.
+
+rag.py의 "쿼터 초과" 폴백처럼 임베딩 API는 분당 요청 수(RPM) 쿼터에 자주 걸립니다.
+AsyncEmbeddingClient는 다음 세 가지로 쿼터 바로 아래의 처리량을 유지합니다.
+
+- 토큰 버킷: 초당 (RPM / 60) × quota_headroom 개의 요청만 내보냅니다.
+- AIMD 동시성 조절: 성공하면 동시 요청 한도를 조금씩(가산) 늘리고,
+  ResourceExhausted(429)를 받으면 절반으로(승산) 줄입니다.
+- 지터 재시도: 429/503 오류는 지수 백오프 + 전체 지터(full jitter)로 다시 시도합니다.
+"""
+import asyncio
+import os
+import random
+import time
+
+from common.chunking import MAX_TOKENS_PER_REQUEST, pack_batches
+from common.embedding import pool_vectors, split_oversize
+from common.embedding_cache import cache_key
+
+DEFAULT_RPM = int(os.getenv("EMBEDDING_RPM", "600"))
+DEFAULT_MAX_CONCURRENCY = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", "8"))
+
+
+def is_quota_error(error: Exception) -> bool:
+    """쿼터 초과(429 / RESOURCE_EXHAUSTED) 오류인지 확인합니다."""
+    try:
+        from google.api_core.exceptions import ResourceExhausted, TooManyRequests
+        if isinstance(error, (ResourceExhausted, TooManyRequests)):
+            return True
+    except ImportError:
+        pass
+    # google-genai의 errors.ClientError는 code 속성에 HTTP 상태 코드를 담습니다.
+    if getattr(error, "code", None) == 429:
+        return True
+    message = str(error)
+    return "429" in message or "RESOURCE_EXHAUSTED" in message or "Quota exceeded" in message
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """잠시 후 다시 시도할 만한 오류(쿼터 초과, 일시적 서버 오류)인지 확인합니다."""
+    if is_quota_error(error):
+        return True
+    try:
+        from google.api_core.exceptions import ServiceUnavailable, DeadlineExceeded, InternalServerError
+        if isinstance(error, (ServiceUnavailable, DeadlineExceeded, InternalServerError)):
+            return True
+    except ImportError:
+        pass
+    return getattr(error, "code", None) in (500, 503, 504)
+
+
+class TokenBucket:
+    """초당 rate개씩 채워지는 토큰 버킷. 요청 하나를 보낼 때마다 토큰 하나를 씁니다."""
+    def __init__(self, rate_per_sec: float, capacity: float):
+        self.rate = rate_per_sec
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AIMDLimiter:
+    """
+    동시 실행 요청 수 한도를 AIMD(가산 증가/승산 감소)로 조절하는 리미터.
+    """
+    def __init__(self, initial: int, maximum: int, minimum: int = 1):
+        self.limit = float(initial)
+        self.maximum = maximum
+        self.minimum = minimum
+        self.in_flight = 0
+        self._cond = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self, throttled: bool = False):
+        async with self._cond:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(self.minimum, self.limit / 2)
+            else:
+                # 한도만큼 성공할 때마다 약 1씩 증가
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+
+class AsyncEmbeddingClient:
+    """
+    EmbeddingService를 감싸 쿼터 안에서 여러 임베딩 요청을 동시에 보내는 비동기 클라이언트.
+
+    사용 예:
+        client = AsyncEmbeddingClient(EmbeddingService("text-embedding-005"), requests_per_minute=600)
+        async for tag, vectors, error in client.embed_stream(batches, task_type="RETRIEVAL_DOCUMENT"):
+            ...
+    """
+    def __init__(self, service, requests_per_minute: int = DEFAULT_RPM,
+                 max_concurrency: int = DEFAULT_MAX_CONCURRENCY, initial_concurrency: int = 2,
+                 quota_headroom: float = 0.9, max_retries: int = 6,
+                 base_delay: float = 1.0, max_delay: float = 60.0):
+        """
+        Args:
+            service: 실제 API 호출과 캐시를 담당하는 EmbeddingService.
+            requests_per_minute: 프로젝트의 임베딩 분당 요청 쿼터.
+            max_concurrency: 동시 요청 수 상한.
+            initial_concurrency: 시작 동시 요청 수.
+            quota_headroom: 쿼터 대비 목표 사용률 (0.9면 쿼터의 90%까지만 사용).
+            max_retries: 재시도 가능한 오류의 최대 재시도 횟수.
+            base_delay: 백오프 기본 대기 시간(초).
+            max_delay: 백오프 최대 대기 시간(초).
+        """
+        self.service = service
+        self.requests_per_minute = requests_per_minute
+        self.max_concurrency = max_concurrency
+        self.initial_concurrency = min(initial_concurrency, max_concurrency)
+        self.quota_headroom = quota_headroom
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.requests = 0
+        self.throttled = 0
+        self.retries = 0
+        self._bucket = None
+        self._limiter = None
+
+    def _ensure_primitives(self):
+        # asyncio 객체는 실행 중인 이벤트 루프 안에서 만들어야 합니다.
+        if self._bucket is None:
+            rate = self.requests_per_minute * self.quota_headroom / 60
+            self._bucket = TokenBucket(rate, capacity=max(1.0, min(rate, self.max_concurrency)))
+            self._limiter = AIMDLimiter(self.initial_concurrency, self.max_concurrency)
+
+    async def _request(self, texts: list[str], task_type: str, output_dimensionality):
+        """리미터/토큰 버킷을 거쳐 요청 하나를 보내고, 재시도 가능한 오류는 지터 백오프로 재시도합니다."""
+        attempt = 0
+        while True:
+            await self._limiter.acquire()
+            await self._bucket.acquire()
+            throttled = False
+            try:
+                self.requests += 1
+                return await self.service.request_embeddings_async(texts, task_type, output_dimensionality)
+            except Exception as e:
+                throttled = is_quota_error(e)
+                if throttled:
+                    self.throttled += 1
+                if not is_retryable_error(e) or attempt >= self.max_retries:
+                    raise
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                attempt += 1
+                self.retries += 1
+            finally:
+                await self._limiter.release(throttled=throttled)
+            await asyncio.sleep(delay)
+
+    async def embed_batch(self, texts: list[str], task_type: str = "RETRIEVAL_DOCUMENT",
+                          output_dimensionality: int = None) -> list[list[float]]:
+        """
+        요청 한도 이내로 묶인 텍스트 묶음 하나를 임베딩합니다. 캐시에 있는 텍스트는 요청하지 않습니다.
+        """
+        self._ensure_primitives()
+        cache = self.service.cache
+        keys = [cache_key(self.service.model, task_type, output_dimensionality, t) for t in texts]
+        found = cache.get_many(keys) if cache else {}
+        missing = list(dict.fromkeys((k, t) for k, t in zip(keys, texts) if k not in found))
+        pieces = split_oversize(missing)
+        parts = {}
+        # 보통은 한 번의 요청이지만, 한도를 넘는 텍스트가 나뉘면 조각들을 다시 요청 한도로 묶습니다.
+        for batch in pack_batches(pieces, max_inputs=self.service.max_inputs, max_tokens=MAX_TOKENS_PER_REQUEST,
+                                  token_count=lambda item: item[2]):
+            vectors = await self._request([piece for _, piece, _ in batch], task_type, output_dimensionality)
+            for (key, _, tokens), vector in zip(batch, vectors):
+                parts.setdefault(key, []).append((tokens, vector))
+        if parts:
+            fresh = {key: pool_vectors(key_parts) for key, key_parts in parts.items()}
+            if cache:
+                cache.put_many(fresh)
+            found.update(fresh)
+        return [found[k] for k in keys]
+
+    async def embed_stream(self, batches, task_type: str = "RETRIEVAL_DOCUMENT",
+                           output_dimensionality: int = None):
+        """
+        (tag, texts) 묶음들을 동시에 임베딩하고 끝나는 순서대로 돌려줍니다.
+        진행 중인 작업 수를 max_concurrency의 두 배로 제한하므로 입력이 많아도 메모리가 일정합니다.
+
+        Args:
+            batches: (tag, texts) 튜플의 iterable. tag는 결과와 함께 그대로 돌려받을 값.
+            task_type: 임베딩 task_type.
+            output_dimensionality: 출력 차원.
+
+        Yields:
+            tuple: (tag, vectors, error). 실패한 묶음은 vectors=None, error=예외.
+        """
+        self._ensure_primitives()
+
+        async def run(tag, texts):
+            try:
+                return tag, await self.embed_batch(texts, task_type, output_dimensionality), None
+            except Exception as e:
+                return tag, None, e
+
+        pending = set()
+        iterator = iter(batches)
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < self.max_concurrency * 2:
+                try:
+                    tag, texts = next(iterator)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending.add(asyncio.ensure_future(run(tag, texts)))
+            if not pending:
+                return
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+
+    def report(self) -> str:
+        limit = self._limiter.limit if self._limiter else self.initial_concurrency
+        return (f"비동기 임베딩: 요청 {self.requests}회, 쿼터 초과 {self.throttled}회, 재시도 {self.retries}회, "
+                f"현재 동시성 한도 {limit:.1f} (최대 {self.max_concurrency}, "
+                f"{self.requests_per_minute} RPM × {self.quota_headroom:.0%})")
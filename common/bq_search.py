@@ -0,0 +1,275 @@
+"""
+BigQuery 임베딩 테이블 일괄(batch) 검색.
+
+질문마다 임베딩 요청 한 번, 테이블 전체를 스캔하는 쿼리 작업 한 번을 보내면
+N개 질문에 임베딩 왕복 N번, 전체 스캔 N번이 듭니다.
+batch_search는 모든 질문 벡터를 하나의 쿼리 파라미터(ARRAY<STRUCT<qid, vec>>)로 넘겨
+테이블과 교차 조인(CROSS JOIN)하고, 질문별 top-k는 윈도 함수(QUALIFY ROW_NUMBER)로 고릅니다.
+테이블은 한 번만 스캔되므로 평가 스윕이나 대량 조회도 스캔 비용이 한 번입니다.
+
+BQ_SEARCH_MODE=vector_index이면 테이블에 벡터 인덱스(CREATE VECTOR INDEX, IVF 또는 TREE_AH)를 만들어 두고
+VECTOR_SEARCH로 검색하여 질문마다 전체 테이블을 스캔하지 않습니다. 인덱스가 없거나 아직 빌드 중이면
+(INFORMATION_SCHEMA.VECTOR_INDEXES의 상태/커버리지로 판단) 기존 전체 스캔 검색으로 대체합니다.
+
+filters(common.filters 형식)를 주면 WHERE 절로 바꾸어 거리 계산 앞에서 행을 거릅니다. 벡터 인덱스는 필터 열
+(source, chunk_index)을 STORING으로 함께 저장하므로 VECTOR_SEARCH도 인덱스 안에서 미리 거를 수 있습니다.
+"""
+import json
+import os
+import time
+
+from google.cloud import bigquery
+
+from common.filters import to_sql
+
+# 검색 방식: "brute_force"(ML.DISTANCE 전체 스캔) 또는 "vector_index"(VECTOR_SEARCH + 벡터 인덱스)
+DEFAULT_SEARCH_MODE = os.getenv("BQ_SEARCH_MODE", "brute_force")
+# 벡터 인덱스 이름과 종류 ("IVF" 또는 "TREE_AH")
+DEFAULT_VECTOR_INDEX_NAME = os.getenv("BQ_VECTOR_INDEX_NAME", "embeddings_index")
+DEFAULT_VECTOR_INDEX_TYPE = os.getenv("BQ_VECTOR_INDEX_TYPE", "IVF")
+# VECTOR_SEARCH에서 탐색할 목록(list) 비율 (0~1). 비워 두면 BigQuery 기본값. 클수록 정확하고 느림
+DEFAULT_FRACTION_LISTS = float(os.getenv("BQ_FRACTION_LISTS_TO_SEARCH", "0") or 0) or None
+# 이 커버리지(%) 이상 인덱싱되어야 VECTOR_SEARCH 사용 (미만이면 빌드 중으로 보고 전체 스캔)
+MIN_INDEX_COVERAGE = float(os.getenv("BQ_VECTOR_INDEX_MIN_COVERAGE", "100"))
+# 인덱스 상태 조회 결과를 재사용할 시간(초). 상태 조회도 쿼리 작업이므로 매 검색마다 하지 않습니다.
+INDEX_STATUS_TTL_SEC = 60
+
+_status_cache = {}
+# 이 프로세스에서 인덱스 생성에 실패한 (테이블, 인덱스) — 검색마다 DDL을 다시 보내지 않기 위함
+_create_failed = set()
+
+
+def _query_parameter(query_vectors) -> bigquery.ArrayQueryParameter:
+    """질문 벡터 목록을 ARRAY<STRUCT<qid INT64, vec ARRAY<FLOAT64>>> 쿼리 파라미터로 만듭니다."""
+    return bigquery.ArrayQueryParameter("queries", "STRUCT", [
+        bigquery.StructQueryParameter(
+            None,
+            bigquery.ScalarQueryParameter("qid", "INT64", qid),
+            bigquery.ArrayQueryParameter("vec", "FLOAT64", [float(v) for v in vector]),
+        )
+        for qid, vector in enumerate(query_vectors)
+    ])
+
+
+def batch_search(client: bigquery.Client, table: str, query_vectors, top_k: int = 3,
+                 columns=("id",), embedding_column: str = "embedding", filters: dict = None,
+                 linked_sources: dict = None) -> list[list[dict]]:
+    """
+    여러 질문 벡터의 코사인 유사도 top-k를 쿼리 작업 하나로 찾습니다.
+
+    Args:
+        client: bigquery.Client.
+        table: "project.dataset.table" 형식의 테이블 ID.
+        query_vectors: 질문 임베딩 벡터 목록.
+        top_k: 질문별 결과 수.
+        columns: 결과에 포함할 테이블 열 이름.
+        embedding_column: 임베딩(ARRAY<FLOAT64>) 열 이름.
+        filters: 메타데이터 필터 (common.filters 형식). 조건을 만족하는 행만 거리를 계산합니다.
+        linked_sources: 근접 중복 링크 {원본 청크 ID: 링크한 source 목록}. source 필터에 링크된 원본 행을 포함합니다.
+
+    Returns:
+        list[list[dict]]: 질문 순서대로, 유사도 내림차순 행 목록.
+                          각 행은 columns의 값과 "cosine_sim"을 담은 dict.
+    """
+    query_vectors = list(query_vectors)
+    if not query_vectors:
+        return []
+    select_columns = "".join(f"t.{col}, " for col in columns)
+    # QUALIFY는 WHERE/GROUP BY/HAVING 중 하나와 함께 써야 하므로 필터가 없으면 WHERE TRUE를 둡니다.
+    where, filter_params = to_sql(filters, alias="t", linked_sources=linked_sources)
+    sql = f"""
+        SELECT q.qid, {select_columns}
+               (1 - ML.DISTANCE(t.{embedding_column}, q.vec, 'COSINE')) AS cosine_sim
+        FROM UNNEST(@queries) AS q
+        CROSS JOIN `{table}` AS t
+        WHERE {where}
+        QUALIFY ROW_NUMBER() OVER (PARTITION BY q.qid ORDER BY cosine_sim DESC) <= @top_k
+        ORDER BY q.qid, cosine_sim DESC
+    """
+    job_config = bigquery.QueryJobConfig(query_parameters=[
+        _query_parameter(query_vectors),
+        bigquery.ScalarQueryParameter("top_k", "INT64", top_k),
+        *filter_params,
+    ])
+    results = [[] for _ in query_vectors]
+    for row in client.query(sql, job_config=job_config).result():
+        results[row["qid"]].append({**{col: row[col] for col in columns}, "cosine_sim": row["cosine_sim"]})
+    return results
+
+
+def vector_index_status(client: bigquery.Client, table: str, index_name: str = DEFAULT_VECTOR_INDEX_NAME,
+                        use_cache: bool = True):
+    """
+    INFORMATION_SCHEMA.VECTOR_INDEXES에서 벡터 인덱스 상태를 조회합니다.
+
+    Returns:
+        dict: {"status", "coverage", "ddl"}. 인덱스가 없으면 None.
+    """
+    key = (table, index_name)
+    cached = _status_cache.get(key)
+    if use_cache and cached and time.monotonic() - cached[0] < INDEX_STATUS_TTL_SEC:
+        return cached[1]
+    project, dataset, table_name = table.split(".")
+    sql = f"""
+        SELECT index_status, coverage_percentage, ddl
+        FROM `{project}.{dataset}.INFORMATION_SCHEMA.VECTOR_INDEXES`
+        WHERE table_name = @table_name AND index_name = @index_name
+    """
+    job_config = bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ScalarQueryParameter("table_name", "STRING", table_name),
+        bigquery.ScalarQueryParameter("index_name", "STRING", index_name),
+    ])
+    rows = list(client.query(sql, job_config=job_config).result())
+    status = None
+    if rows:
+        status = {"status": rows[0]["index_status"], "coverage": rows[0]["coverage_percentage"] or 0,
+                  "ddl": rows[0]["ddl"]}
+    _status_cache[key] = (time.monotonic(), status)
+    return status
+
+
+def index_is_ready(status, min_coverage: float = MIN_INDEX_COVERAGE) -> bool:
+    """인덱스가 활성(ACTIVE) 상태이고 min_coverage(%) 이상 인덱싱되었는지 확인합니다."""
+    return bool(status) and status["status"] == "ACTIVE" and status["coverage"] >= min_coverage
+
+
+def ensure_vector_index(client: bigquery.Client, table: str, index_name: str = DEFAULT_VECTOR_INDEX_NAME,
+                        index_type: str = DEFAULT_VECTOR_INDEX_TYPE, embedding_column: str = "embedding",
+                        distance_type: str = "COSINE", stored_columns=("source", "chunk_index")):
+    """
+    벡터 인덱스가 없으면 만듭니다 (CREATE VECTOR INDEX IF NOT EXISTS).
+    stored_columns는 인덱스에 함께 저장(STORING)하여 VECTOR_SEARCH의 필터를 인덱스 안에서 미리 적용합니다.
+    인덱스 빌드와 이후 새 행의 반영은 BigQuery가 백그라운드에서 자동으로 처리합니다.
+    이미 있는 인덱스의 종류가 index_type과 다르면 알림만 출력합니다 (DROP VECTOR INDEX 후 다시 실행).
+
+    Returns:
+        dict: 현재 인덱스 상태 (vector_index_status). 방금 만들었으면 빌드 중 상태.
+    """
+    status = vector_index_status(client, table, index_name)
+    if status:
+        if index_type.lower() not in (status["ddl"] or "").lower():
+            print(f"[알림] 벡터 인덱스 {index_name}의 종류가 {index_type}가 아닙니다. "
+                  f"바꾸려면 DROP VECTOR INDEX {index_name} ON `{table}` 후 다시 만드세요.")
+        return status
+    options = {"index_type": f"'{index_type}'", "distance_type": f"'{distance_type}'"}
+    storing = f"STORING({', '.join(stored_columns)})" if stored_columns else ""
+    sql = f"""
+        CREATE VECTOR INDEX IF NOT EXISTS {index_name}
+        ON `{table}`({embedding_column}) {storing}
+        OPTIONS({", ".join(f"{k} = {v}" for k, v in options.items())})
+    """
+    try:
+        client.query(sql).result()
+    except Exception as e:
+        # 작은 테이블 등 인덱스를 만들 수 없는 경우에도 검색은 전체 스캔으로 계속할 수 있습니다.
+        print(f"[오류] 벡터 인덱스 생성 실패: {index_name} - {e}")
+        _create_failed.add((table, index_name))
+        return None
+    print(f"[성공] 벡터 인덱스 생성 요청 완료: {index_name} ({index_type}), 백그라운드에서 빌드됩니다.")
+    return vector_index_status(client, table, index_name, use_cache=False)
+
+
+def vector_search(client: bigquery.Client, table: str, query_vectors, top_k: int = 3, columns=("id",),
+                  embedding_column: str = "embedding",
+                  fraction_lists_to_search: float = DEFAULT_FRACTION_LISTS, filters: dict = None,
+                  linked_sources: dict = None) -> list[list[dict]]:
+    """
+    VECTOR_SEARCH로 여러 질문 벡터의 top-k를 쿼리 작업 하나로 찾습니다 (벡터 인덱스 사용).
+
+    Args:
+        fraction_lists_to_search: 탐색할 인덱스 목록 비율 (0~1). None이면 BigQuery 기본값.
+        filters: 메타데이터 필터. 기본 테이블을 WHERE로 거른 쿼리로 바꾸어 VECTOR_SEARCH 앞에서 적용합니다.
+        나머지 인자와 반환값은 batch_search와 같습니다.
+    """
+    query_vectors = list(query_vectors)
+    if not query_vectors:
+        return []
+    options = {}
+    if fraction_lists_to_search:
+        options["fraction_lists_to_search"] = fraction_lists_to_search
+    select_columns = "".join(f"base.{col} AS {col}, " for col in columns)
+    base_table = f"TABLE `{table}`"
+    filter_params = []
+    if filters:
+        where, filter_params = to_sql(filters, linked_sources=linked_sources)
+        base_table = f"(SELECT * FROM `{table}` WHERE {where})"
+    sql = f"""
+        SELECT query.qid AS qid, {select_columns}
+               (1 - distance) AS cosine_sim
+        FROM VECTOR_SEARCH(
+            {base_table}, '{embedding_column}',
+            (SELECT q.qid, q.vec FROM UNNEST(@queries) AS q), 'vec',
+            top_k => {int(top_k)},
+            distance_type => 'COSINE',
+            options => '{json.dumps(options)}'
+        )
+        ORDER BY qid, cosine_sim DESC
+    """
+    job_config = bigquery.QueryJobConfig(query_parameters=[_query_parameter(query_vectors), *filter_params])
+    results = [[] for _ in query_vectors]
+    for row in client.query(sql, job_config=job_config).result():
+        results[row["qid"]].append({**{col: row[col] for col in columns}, "cosine_sim": row["cosine_sim"]})
+    return results
+
+
+def search_vectors(client: bigquery.Client, table: str, query_vectors, top_k: int = 3, columns=("id",),
+                   mode: str = DEFAULT_SEARCH_MODE, index_name: str = DEFAULT_VECTOR_INDEX_NAME,
+                   fraction_lists_to_search: float = DEFAULT_FRACTION_LISTS,
+                   embedding_column: str = "embedding", filters: dict = None,
+                   linked_sources: dict = None) -> list[list[dict]]:
+    """
+    검색 방식(mode)에 따라 질문 벡터들을 검색합니다.
+
+    mode="vector_index"이면 인덱스 상태를 확인하여 사용할 수 있을 때만 VECTOR_SEARCH를 쓰고,
+    인덱스가 없으면 만들기를 요청한 뒤, 빌드 중이면 그동안 전체 스캔(batch_search)으로 검색합니다.
+    filters는 어느 방식이든 거리 계산 앞에서 WHERE로 적용됩니다 (linked_sources는 batch_search와 같음).
+
+    Returns:
+        list[list[dict]]: batch_search와 같은 형식의 결과.
+    """
+    if mode not in ("brute_force", "vector_index"):
+        raise ValueError(f"지원하지 않는 검색 방식입니다: {mode}")
+    if mode == "vector_index":
+        status = vector_index_status(client, table, index_name)
+        if status is None and (table, index_name) not in _create_failed:
+            status = ensure_vector_index(client, table, index_name, embedding_column=embedding_column)
+        if index_is_ready(status):
+            return vector_search(client, table, query_vectors, top_k=top_k, columns=columns,
+                                 embedding_column=embedding_column,
+                                 fraction_lists_to_search=fraction_lists_to_search, filters=filters,
+                                 linked_sources=linked_sources)
+        if status:
+            print(f"[알림] 벡터 인덱스 빌드 중 (상태: {status['status']}, 커버리지: {status['coverage']}%), "
+                  f"전체 스캔으로 검색합니다.")
+    return batch_search(client, table, query_vectors, top_k=top_k, columns=columns,
+                        embedding_column=embedding_column, filters=filters, linked_sources=linked_sources)
+
+
+def fetch_rows(client: bigquery.Client, table: str, ids, columns=("id", "content")) -> dict:
+    """
+    ID 목록의 행을 한 번의 쿼리로 가져옵니다 (벡터만 가진 검색 결과에 본문을 붙일 때).
+
+    Returns:
+        dict: {ID: {열: 값}}. 테이블에 없는 ID는 빠집니다.
+    """
+    ids = list(ids)
+    if not ids:
+        return {}
+    select_columns = ", ".join(dict.fromkeys(("id",) + tuple(columns)))
+    sql = f"SELECT {select_columns} FROM `{table}` WHERE id IN UNNEST(@ids)"
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[bigquery.ArrayQueryParameter("ids", "STRING", [str(i) for i in ids])])
+    return {row["id"]: dict(row.items()) for row in client.query(sql, job_config=job_config).result()}
+
+
+def search_texts(client: bigquery.Client, table: str, embedding_service, texts: list[str], top_k: int = 3,
+                 columns=("id",), task_type: str = "RETRIEVAL_QUERY", **kwargs) -> list[list[dict]]:
+    """
+    질문 텍스트들을 한 번에 임베딩한 뒤(EmbeddingService가 요청 한도 안에서 한 요청으로 묶음)
+    search_vectors로 검색합니다.
+
+    Returns:
+        list[list[dict]]: texts 순서대로 batch_search와 같은 형식의 결과.
+    """
+    vectors = embedding_service.embed(texts, task_type=task_type)
+    return search_vectors(client, table, vectors, top_k=top_k, columns=columns, **kwargs)
@@ -0,0 +1,219 @@
+"""
+BigQuery 대량 적재(writer) 경로.
+
+BigQuerySink가 일정 크기마다 모아 둔 행 묶음을 실제로 테이블에 쓰는 방식들입니다.
+
+- LoadJobWriter: 묶음을 Parquet(기본) 또는 Avro 임시 파일로 만들어 load job으로 적재.
+  행 단위 과금/요청 크기 제한/스트리밍 버퍼가 없어 전체 재적재(backfill)에 적합합니다.
+- StorageWriteWriter: BigQuery Storage Write API의 기본(_default) 스트림에 protobuf 행을 추가.
+  지속적으로 들어오는 소량 인제스트에 적합합니다.
+- StreamingInsertWriter: 기존 insert_rows_json 방식 (호환용).
+
+pyarrow, fastavro, google-cloud-bigquery-storage는 해당 방식을 선택했을 때만 필요합니다.
+"""
+import os
+import tempfile
+
+from google.cloud import bigquery
+
+# Storage Write API의 AppendRows 요청 하나는 10MB를 넘을 수 없으므로 여유를 두고 자릅니다.
+MAX_APPEND_REQUEST_BYTES = 8 * 1024 * 1024
+
+
+class StreamingInsertWriter:
+    """insert_rows_json(스트리밍 삽입)으로 행을 추가합니다."""
+    def __init__(self, client: bigquery.Client, table_id: str):
+        self.client = client
+        self.table_id = table_id
+
+    def send(self, rows: list[dict]):
+        errors = self.client.insert_rows_json(self.table_id, rows)
+        if errors:
+            raise RuntimeError(f"BigQuery 삽입 중 오류 발생: {errors[:3]}")
+
+    def close(self):
+        pass
+
+
+class LoadJobWriter:
+    """
+    행 묶음을 Parquet/Avro 임시 파일로 직렬화한 뒤 load job(WRITE_APPEND)으로 적재합니다.
+    """
+    def __init__(self, client: bigquery.Client, table_id: str, file_format: str = "PARQUET"):
+        """
+        Args:
+            client: BigQuery 클라이언트.
+            table_id: 전체 테이블 ID.
+            file_format: "PARQUET" 또는 "AVRO".
+        """
+        if file_format not in ("PARQUET", "AVRO"):
+            raise ValueError(f"지원하지 않는 파일 형식입니다: {file_format}")
+        self.client = client
+        self.table_id = table_id
+        self.file_format = file_format
+
+    def _write_parquet(self, rows: list[dict], path: str):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        schema = pa.schema([
+            pa.field("id", pa.string(), nullable=False),
+            pa.field("content", pa.string(), nullable=False),
+            pa.field("embedding", pa.list_(pa.float64())),
+            pa.field("source", pa.string(), nullable=False),
+            pa.field("chunk_index", pa.int64(), nullable=False),
+        ])
+        table = pa.Table.from_pylist(rows, schema=schema)
+        pq.write_table(table, path, compression="snappy")
+
+    def _write_avro(self, rows: list[dict], path: str):
+        import fastavro
+
+        schema = fastavro.parse_schema({
+            "type": "record",
+            "name": "EmbeddingRow",
+            "fields": [
+                {"name": "id", "type": "string"},
+                {"name": "content", "type": "string"},
+                {"name": "embedding", "type": {"type": "array", "items": "double"}},
+                {"name": "source", "type": "string"},
+                {"name": "chunk_index", "type": "long"},
+            ],
+        })
+        with open(path, "wb") as f:
+            fastavro.writer(f, schema, rows, codec="deflate")
+
+    def send(self, rows: list[dict]):
+        job_config = bigquery.LoadJobConfig(write_disposition=bigquery.WriteDisposition.WRITE_APPEND)
+        if self.file_format == "PARQUET":
+            job_config.source_format = bigquery.SourceFormat.PARQUET
+            # list<double> 컬럼을 REPEATED FLOAT로 읽도록 리스트 추론을 켭니다.
+            parquet_options = bigquery.format_options.ParquetOptions()
+            parquet_options.enable_list_inference = True
+            job_config.parquet_options = parquet_options
+        else:
+            job_config.source_format = bigquery.SourceFormat.AVRO
+
+        suffix = ".parquet" if self.file_format == "PARQUET" else ".avro"
+        fd, path = tempfile.mkstemp(suffix=suffix)
+        os.close(fd)
+        try:
+            if self.file_format == "PARQUET":
+                self._write_parquet(rows, path)
+            else:
+                self._write_avro(rows, path)
+            with open(path, "rb") as f:
+                job = self.client.load_table_from_file(f, self.table_id, job_config=job_config)
+            job.result()  # 실패 시 예외 발생
+        finally:
+            os.remove(path)
+
+    def close(self):
+        pass
+
+
+def _embedding_row_class():
+    """
+    Storage Write API에 보낼 행의 protobuf 메시지 클래스를 테이블 스키마에 맞춰 동적으로 만듭니다.
+
+    Returns:
+        tuple: (descriptor, message_class)
+    """
+    from google.protobuf import descriptor_pb2, descriptor_pool, message_factory
+
+    field_proto = descriptor_pb2.FieldDescriptorProto
+    file_proto = descriptor_pb2.FileDescriptorProto(
+        name="notebooklm_embedding_row.proto", package="notebooklm", syntax="proto2"
+    )
+    message = file_proto.message_type.add(name="EmbeddingRow")
+    fields = [
+        ("id", field_proto.TYPE_STRING, field_proto.LABEL_OPTIONAL),
+        ("content", field_proto.TYPE_STRING, field_proto.LABEL_OPTIONAL),
+        ("embedding", field_proto.TYPE_DOUBLE, field_proto.LABEL_REPEATED),
+        ("source", field_proto.TYPE_STRING, field_proto.LABEL_OPTIONAL),
+        ("chunk_index", field_proto.TYPE_INT64, field_proto.LABEL_OPTIONAL),
+    ]
+    for number, (name, field_type, label) in enumerate(fields, start=1):
+        message.field.add(name=name, number=number, type=field_type, label=label)
+
+    pool = descriptor_pool.DescriptorPool()
+    pool.Add(file_proto)
+    descriptor = pool.FindMessageTypeByName("notebooklm.EmbeddingRow")
+    if hasattr(message_factory, "GetMessageClass"):
+        return descriptor, message_factory.GetMessageClass(descriptor)
+    # protobuf 4.21 이전 버전 호환
+    return descriptor, message_factory.MessageFactory(pool).GetPrototype(descriptor)
+
+
+class StorageWriteWriter:
+    """
+    BigQuery Storage Write API 기본 스트림(at-least-once)에 행을 추가합니다.
+    """
+    def __init__(self, table_id: str):
+        """
+        Args:
+            table_id: "프로젝트.데이터셋.테이블" 형식의 전체 테이블 ID.
+        """
+        from google.cloud.bigquery_storage_v1 import BigQueryWriteClient, types, writer
+        from google.protobuf import descriptor_pb2
+
+        self._types = types
+        project, dataset, table = table_id.split(".")
+        self.write_client = BigQueryWriteClient()
+        stream_name = f"{self.write_client.table_path(project, dataset, table)}/streams/_default"
+
+        descriptor, self._row_class = _embedding_row_class()
+        proto_descriptor = descriptor_pb2.DescriptorProto()
+        descriptor.CopyToProto(proto_descriptor)
+        proto_schema = types.ProtoSchema(proto_descriptor=proto_descriptor)
+
+        # 스키마는 스트림의 첫 요청에만 보내면 되므로 요청 템플릿에 넣어 둡니다.
+        request_template = types.AppendRowsRequest(write_stream=stream_name)
+        request_template.proto_rows = types.AppendRowsRequest.ProtoData(writer_schema=proto_schema)
+        self._stream = writer.AppendRowsStream(self.write_client, request_template)
+
+    def _append(self, serialized_rows: list[bytes]):
+        proto_rows = self._types.ProtoRows(serialized_rows=serialized_rows)
+        request = self._types.AppendRowsRequest(
+            proto_rows=self._types.AppendRowsRequest.ProtoData(rows=proto_rows)
+        )
+        self._stream.send(request).result()
+
+    def send(self, rows: list[dict]):
+        # 요청 크기 한도(10MB)를 넘지 않도록 직렬화된 크기 기준으로 나누어 보냅니다.
+        pending = []
+        pending_bytes = 0
+        for row in rows:
+            serialized = self._row_class(**row).SerializeToString()
+            if pending and pending_bytes + len(serialized) > MAX_APPEND_REQUEST_BYTES:
+                self._append(pending)
+                pending = []
+                pending_bytes = 0
+            pending.append(serialized)
+            pending_bytes += len(serialized)
+        if pending:
+            self._append(pending)
+
+    def close(self):
+        self._stream.close()
+
+
+def create_writer(mode: str, client: bigquery.Client, table_id: str):
+    """
+    적재 방식 이름으로 writer를 만듭니다.
+
+    Args:
+        mode: "load" (Parquet load job), "load_avro" (Avro load job),
+              "storage_write" (Storage Write API), "streaming" (insert_rows_json).
+        client: BigQuery 클라이언트.
+        table_id: 전체 테이블 ID.
+    """
+    if mode == "load":
+        return LoadJobWriter(client, table_id, file_format="PARQUET")
+    if mode == "load_avro":
+        return LoadJobWriter(client, table_id, file_format="AVRO")
+    if mode == "storage_write":
+        return StorageWriteWriter(table_id)
+    if mode == "streaming":
+        return StreamingInsertWriter(client, table_id)
+    raise ValueError(f"지원하지 않는 BigQuery 적재 방식입니다: {mode}")
@@ -0,0 +1,211 @@
+"""
+임베딩용 텍스트 청킹(chunking) 및 요청 묶음(batch) 구성 유틸리티.
+
+rag.py가 RAG Engine에 넘기는 `rag.ChunkingConfig(chunk_size=512, chunk_overlap=50)`와
+같은 의미(토큰 단위 청크 크기/중첩)를 로컬 임베딩 스크립트에서도 쓰기 위한 모듈입니다.
+"""
+import math
+import re
+from dataclasses import dataclass
+
+# Vertex AI 텍스트 임베딩 모델(text-multilingual-embedding-002 등)의 요청당 제한
+# - 한 요청에 최대 250개 입력
+# - 한 요청의 입력 토큰 합계 최대 20,000개
+# - 입력 하나당 최대 2,048 토큰 (초과분은 auto_truncate 시 조용히 잘림)
+MAX_INPUTS_PER_REQUEST = 250
+MAX_TOKENS_PER_REQUEST = 20000
+MAX_TOKENS_PER_INPUT = 2048
+
+# 토큰 수 추정용 패턴: 한글 음절 묶음, 영문 단어, 숫자, 그 외 기호/문자 1개
+_TOKEN_RE = re.compile(r"[가-힣]+|[A-Za-z]+|\d+|[^\sA-Za-z\d가-힣]")
+# 청킹 단위: 단어 + 뒤따르는 공백 (원문 공백을 그대로 보존하기 위함)
+_PIECE_RE = re.compile(r"\S+\s*")
+
+
+@dataclass
+class ChunkingConfig:
+    """
+    청킹 설정. rag.ChunkingConfig와 동일하게 토큰 단위로 지정합니다.
+
+    Attributes:
+        chunk_size: 청크 하나의 최대 토큰 수.
+        chunk_overlap: 인접 청크 간에 겹치는 토큰 수.
+    """
+    chunk_size: int = 512
+    chunk_overlap: int = 50
+
+    def __post_init__(self):
+        if self.chunk_size <= 0:
+            raise ValueError("chunk_size는 1 이상이어야 합니다.")
+        if not 0 <= self.chunk_overlap < self.chunk_size:
+            raise ValueError("chunk_overlap은 0 이상, chunk_size 미만이어야 합니다.")
+
+
+@dataclass
+class Chunk:
+    """
+    청킹 결과 하나. BigQuery/Matching Engine에 저장되는 한 행(row)의 단위입니다.
+
+    Attributes:
+        text: 청크 본문.
+        index: 원본 문서 내 청크 순번 (0부터 시작).
+        token_count: 추정 토큰 수.
+        source: 청크가 나온 원본 파일 이름.
+    """
+    text: str
+    index: int
+    token_count: int
+    source: str = ""
+
+    @property
+    def chunk_id(self) -> str:
+        """저장소에서 행을 식별하는 ID ("파일명#순번")."""
+        return f"{self.source}#{self.index}"
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    네트워크 호출 없이 텍스트의 토큰 수를 추정합니다.
+    한글은 대체로 약간 크게 추정하지만 영문은 실제 토크나이저보다 작게 나올 수 있으므로,
+    정확한 한도가 필요하면 실제 토큰 수로 다시 확인해야 합니다 (common.tokens.fit_passages).
+
+    SentencePiece 계열 다국어 토크나이저 기준으로
+    한글은 음절당 약 1토큰, 영문은 4글자당 약 1토큰, 숫자는 3자리당 약 1토큰,
+    기호와 그 외 문자(한자 등)는 글자당 1토큰으로 계산합니다.
+
+    Args:
+        text: 토큰 수를 추정할 텍스트.
+
+    Returns:
+        추정 토큰 수.
+    """
+    count = 0
+    for match in _TOKEN_RE.finditer(text):
+        token = match.group(0)
+        first = token[0]
+        if "가" <= first <= "힣":
+            count += len(token)
+        elif first.isascii() and first.isalpha():
+            count += math.ceil(len(token) / 4)
+        elif first.isdigit():
+            count += math.ceil(len(token) / 3)
+        else:
+            count += 1
+    return count
+
+
+def _split_pieces(text: str, max_tokens: int) -> list[str]:
+    """
+    텍스트를 단어 단위 조각으로 나눕니다. 공백 없이 긴 조각(표, URL 등)은
+    max_tokens를 넘지 않도록 글자 단위로 다시 자릅니다.
+    """
+    pieces = []
+    for match in _PIECE_RE.finditer(text):
+        piece = match.group(0)
+        if estimate_tokens(piece) <= max_tokens:
+            pieces.append(piece)
+            continue
+        # 글자당 최대 1토큰이므로 max_tokens 글자 단위로 자르면 한도를 넘지 않습니다.
+        pieces.extend(piece[i:i + max_tokens] for i in range(0, len(piece), max_tokens))
+    return pieces
+
+
+def chunk_text(text: str, config: ChunkingConfig = None, source: str = "") -> list[Chunk]:
+    """
+    텍스트를 토큰 기준 슬라이딩 윈도우로 청킹합니다.
+
+    Args:
+        text: 청킹할 전체 텍스트.
+        config: 청크 크기/중첩 설정. None이면 기본 설정(ChunkingConfig()).
+        source: 원본 파일 이름 (Chunk.source에 기록).
+
+    Returns:
+        Chunk 리스트. 비어 있는 텍스트이면 빈 리스트.
+    """
+    if config is None:
+        config = ChunkingConfig()
+    pieces = _split_pieces(text, config.chunk_size)
+    counts = [estimate_tokens(p) for p in pieces]
+
+    chunks = []
+    start = 0
+    while start < len(pieces):
+        # chunk_size를 넘지 않는 범위까지 조각을 이어 붙임
+        end = start
+        total = 0
+        while end < len(pieces) and total + counts[end] <= config.chunk_size:
+            total += counts[end]
+            end += 1
+
+        body = "".join(pieces[start:end]).strip()
+        if body:
+            chunks.append(Chunk(text=body, index=len(chunks), token_count=total, source=source))
+        if end >= len(pieces):
+            break
+
+        # 다음 청크는 끝에서부터 chunk_overlap 토큰만큼 되돌아간 위치에서 시작
+        next_start = end
+        overlap = 0
+        while next_start - 1 > start and overlap + counts[next_start - 1] <= config.chunk_overlap:
+            next_start -= 1
+            overlap += counts[next_start]
+        start = next_start
+    return chunks
+
+
+class BatchPacker:
+    """
+    청크를 하나씩 받아 요청 한도에 맞는 묶음을 만드는 상태 객체.
+    입력이 한꺼번에 주어지지 않는 경우(예: common.pipeline의 단계)에 pack_batches 대신 사용합니다.
+    """
+    def __init__(self, max_inputs: int = MAX_INPUTS_PER_REQUEST,
+                 max_tokens: int = MAX_TOKENS_PER_REQUEST, token_count=None):
+        self.max_inputs = max_inputs
+        self.max_tokens = max_tokens
+        self.token_count = token_count or (lambda chunk: chunk.token_count)
+        self._batch = []
+        self._batch_tokens = 0
+
+    def add(self, chunk) -> list:
+        """청크를 추가합니다. 추가로 한도를 넘게 되면 그 전까지의 묶음을 반환하고, 아니면 None."""
+        tokens = self.token_count(chunk)
+        full = None
+        if self._batch and (len(self._batch) >= self.max_inputs or self._batch_tokens + tokens > self.max_tokens):
+            full = self.flush()
+        self._batch.append(chunk)
+        self._batch_tokens += tokens
+        return full
+
+    def flush(self) -> list:
+        """남아 있는 묶음을 반환하고 비웁니다. 비어 있으면 None."""
+        batch = self._batch or None
+        self._batch = []
+        self._batch_tokens = 0
+        return batch
+
+
+def pack_batches(chunks: list,
+                 max_inputs: int = MAX_INPUTS_PER_REQUEST,
+                 max_tokens: int = MAX_TOKENS_PER_REQUEST,
+                 token_count=None):
+    """
+    청크들을 요청당 입력 개수/토큰 합계 제한 안에서 최대한 크게 묶습니다.
+    한 번의 get_embeddings(...) 호출로 여러 청크를 임베딩하기 위해 사용합니다.
+
+    Args:
+        chunks: 임베딩할 청크 목록.
+        max_inputs: 요청당 최대 입력 개수.
+        max_tokens: 요청당 최대 토큰 합계.
+        token_count: 항목의 토큰 수를 돌려주는 함수. 기본값은 Chunk.token_count 사용.
+
+    Yields:
+        한 요청으로 보낼 청크 리스트.
+    """
+    packer = BatchPacker(max_inputs, max_tokens, token_count)
+    for chunk in chunks:
+        batch = packer.add(chunk)
+        if batch:
+            yield batch
+    batch = packer.flush()
+    if batch:
+        yield batch
@@ -0,0 +1,207 @@
+"""
+임베딩 전 근접 중복(near-duplicate) 청크 탐지.
+
+같은 문서의 개정판이나 요약본(예: NotebookLM_상세.pdf와 notebooklm_summary.pdf)에는 거의 같은
+청크가 많습니다. 이런 청크를 그대로 임베딩하면 API 호출과 인덱스 용량이 낭비되고, 검색 시에도
+같은 내용이 top-k를 차지합니다.
+
+NearDuplicateIndex는 문자 n-gram(shingle) 집합의 MinHash 서명을 만들고, LSH(밴드 해싱)로 후보를 찾은 뒤
+추정 자카드 유사도가 threshold 이상이면 중복으로 판단합니다. 중복 청크는 임베딩/저장하지 않고
+원본(canonical) 청크 ID로의 링크만 기록합니다.
+
+원본 청크는 다른 파일(source)의 행으로 저장되므로, source로 행을 고르는 검색(노트북 샤드, source 필터)은
+load_linked_sources()로 링크를 읽어 원본 행을 링크한 파일의 행으로도 취급해야 합니다.
+
+인덱스는 npz 파일로 저장되어 실행 간에 유지되므로, 새로 추가된 파일의 청크도 이미 저장된 청크와 비교됩니다.
+"""
+import json
+import os
+import re
+
+import numpy as np
+
+# 32비트 해시 값에 대한 범용 해시 (a * x + b) mod p, p는 2^32보다 큰 소수
+_PRIME = np.uint64(4294967311)
+_MAX_HASH = np.uint64(0xFFFFFFFF)
+DEFAULT_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.8"))
+
+
+def _normalize(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+class NearDuplicateIndex:
+    """
+    MinHash + LSH 근접 중복 인덱스.
+
+    num_perm=128, bands=16(밴드당 8행)이면 자카드 유사도 약 0.7 이상인 쌍이 높은 확률로 후보가 되고,
+    후보 중 추정 유사도가 threshold 이상인 것만 중복으로 판단합니다.
+    """
+    def __init__(self, threshold: float = DEFAULT_THRESHOLD, num_perm: int = 128, bands: int = 16,
+                 shingle_size: int = 5, seed: int = 1):
+        if num_perm % bands:
+            raise ValueError(f"num_perm({num_perm})은 bands({bands})로 나누어떨어져야 합니다.")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        rng = np.random.RandomState(seed)
+        # a * x가 uint64를 넘지 않도록 a, b는 2^32 미만
+        self._a = rng.randint(1, 2 ** 32 - 1, size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, 2 ** 32 - 1, size=num_perm, dtype=np.uint64)
+        self._signatures = {}   # 청크 ID -> (source, 서명)
+        self._buckets = {}      # (밴드 번호, 밴드 해시) -> 청크 ID 집합
+        self.links = {}         # 중복 청크 ID -> (중복 source, 원본 청크 ID)
+
+    def signature(self, text: str) -> np.ndarray:
+        """텍스트의 MinHash 서명 (num_perm개의 uint32)."""
+        codes = np.frombuffer(_normalize(text).encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+        n = self.shingle_size
+        if len(codes) == 0:
+            return np.full(self.num_perm, 0xFFFFFFFF, dtype=np.uint32)
+        if len(codes) < n:
+            codes = np.concatenate([codes, np.zeros(n - len(codes), dtype=np.uint64)])
+        # 길이 n 문자 n-gram의 다항식 해시 (mod 2^32)
+        hashes = np.zeros(len(codes) - n + 1, dtype=np.uint64)
+        for k in range(n):
+            hashes = (hashes * np.uint64(1000003) + codes[k:len(codes) - n + 1 + k]) & _MAX_HASH
+        hashes = np.unique(hashes)
+        permuted = (self._a[:, None] * hashes[None, :] + self._b[:, None]) % _PRIME
+        return (permuted.min(axis=1) & _MAX_HASH).astype(np.uint32)
+
+    def _band_keys(self, sig: np.ndarray):
+        for band in range(self.bands):
+            yield band, sig[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def find(self, sig: np.ndarray):
+        """서명과 추정 유사도가 threshold 이상인 기존 청크 ID를 찾습니다. 없으면 None."""
+        best, best_score = None, self.threshold
+        seen = set()
+        for key in self._band_keys(sig):
+            for candidate in self._buckets.get(key, ()):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                score = float(np.mean(self._signatures[candidate][1] == sig))
+                if score >= best_score:
+                    best, best_score = candidate, score
+        return best
+
+    def add(self, chunk_id: str, source: str, text: str):
+        """
+        청크를 인덱스에 추가합니다.
+
+        Returns:
+            중복이면 원본 청크 ID (이 청크는 추가하지 않고 링크만 기록), 아니면 None.
+        """
+        sig = self.signature(text)
+        canonical = self.find(sig)
+        if canonical is not None and canonical != chunk_id:
+            self.links[chunk_id] = (source, canonical)
+            return canonical
+        self._signatures[chunk_id] = (source, sig)
+        for key in self._band_keys(sig):
+            self._buckets.setdefault(key, set()).add(chunk_id)
+        return None
+
+    def _remove_chunk(self, chunk_id: str):
+        _, sig = self._signatures.pop(chunk_id)
+        for key in self._band_keys(sig):
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.discard(chunk_id)
+                if not bucket:
+                    del self._buckets[key]
+
+    def remove_sources(self, sources) -> set:
+        """
+        지정한 파일들의 청크와 링크를 인덱스에서 제거합니다 (변경/삭제/실패한 파일).
+
+        제거된 청크를 원본으로 삼아 건너뛴 중복 청크가 있는 다른 파일은 그 내용이 더 이상 저장되어 있지 않으므로,
+        그 파일들도 (연쇄적으로) 제거하고 반환합니다. 호출한 쪽에서 이 파일들을 다시 인제스트해야 합니다.
+
+        Returns:
+            set: 다시 인제스트해야 하는 추가 파일(source) 집합.
+        """
+        pending = set(sources)
+        removed = set()
+        while pending:
+            removed |= pending
+            removed_chunks = [cid for cid, (src, _) in self._signatures.items() if src in pending]
+            for chunk_id in removed_chunks:
+                self._remove_chunk(chunk_id)
+            removed_set = set(removed_chunks)
+            orphaned = set()
+            for dup_id, (dup_source, canonical) in list(self.links.items()):
+                if dup_source in removed:
+                    del self.links[dup_id]
+                elif canonical in removed_set:
+                    orphaned.add(dup_source)
+            pending = orphaned - removed
+        return removed - set(sources)
+
+    def linked_sources(self) -> dict:
+        """원본 청크 ID -> 그 청크의 중복으로 건너뛴 청크가 있는 source 목록 (정렬)."""
+        linked = {}
+        for dup_source, canonical in self.links.values():
+            linked.setdefault(canonical, set()).add(dup_source)
+        return {canonical: sorted(sources) for canonical, sources in linked.items()}
+
+    def clear(self):
+        self._signatures.clear()
+        self._buckets.clear()
+        self.links.clear()
+
+    def __len__(self):
+        return len(self._signatures)
+
+    def save(self, path: str):
+        """서명과 링크를 npz 파일로 저장합니다 (임시 파일 + os.replace)."""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        ids = list(self._signatures)
+        sigs = (np.stack([self._signatures[i][1] for i in ids]) if ids
+                else np.zeros((0, self.num_perm), dtype=np.uint32))
+        meta = {
+            "params": [self.num_perm, self.bands, self.shingle_size],
+            "ids": ids,
+            "sources": [self._signatures[i][0] for i in ids],
+            "links": self.links,
+        }
+        tmp_path = path + ".tmp.npz"
+        np.savez_compressed(tmp_path, signatures=sigs, meta=np.array(json.dumps(meta, ensure_ascii=False)))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, **kwargs) -> "NearDuplicateIndex":
+        """저장된 인덱스를 읽습니다. 파일이 없거나 파라미터가 다르면 빈 인덱스를 반환합니다."""
+        index = cls(**kwargs)
+        if not os.path.exists(path):
+            return index
+        with np.load(path) as data:
+            meta = json.loads(str(data["meta"]))
+            sigs = data["signatures"]
+        if meta["params"] != [index.num_perm, index.bands, index.shingle_size]:
+            print(f"[알림] 중복 인덱스 파라미터가 달라 새로 만듭니다: {path}")
+            return index
+        for chunk_id, source, sig in zip(meta["ids"], meta["sources"], sigs):
+            index._signatures[chunk_id] = (source, sig)
+            for key in index._band_keys(sig):
+                index._buckets.setdefault(key, set()).add(chunk_id)
+        index.links = {k: tuple(v) for k, v in meta["links"].items()}
+        return index
+
+
+def load_linked_sources(path: str) -> dict:
+    """
+    저장된 인덱스의 링크만 읽어 NearDuplicateIndex.linked_sources() 형식으로 돌려줍니다.
+    서명 버킷을 다시 만들지 않으므로 검색 쪽에서 가볍게 쓸 수 있습니다. 파일이 없으면 빈 dict.
+    """
+    if not path or not os.path.exists(path):
+        return {}
+    with np.load(path) as data:
+        meta = json.loads(str(data["meta"]))
+    linked = {}
+    for dup_source, canonical in meta["links"].values():
+        linked.setdefault(canonical, set()).add(dup_source)
+    return {canonical: sorted(sources) for canonical, sources in linked.items()}
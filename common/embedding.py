@@ -0,0 +1,195 @@
+"""
+임베딩 호출 단일 진입점(facade).
+
+저장소의 스크립트들은 서로 다른 SDK로 임베딩을 만듭니다.
+- google-genai: client.models.embed_content(...)      (embed.py, chap5/bigquery.py, chap6/bigquery6.py 등)
+- Vertex AI SDK: TextEmbeddingModel.get_embeddings(...) (chap5/embed_store.py, chap11/qa_agent.py)
+- google-generativeai: genai.embed_content(...)        (chap6/faiss_search.py)
+
+EmbeddingService는 세 방식을 같은 인터페이스로 감싸고, EmbeddingCache에 있는 텍스트는
+API를 호출하지 않고 캐시에서 돌려줍니다. 캐시에 없는 텍스트만 요청 한도 안에서 묶어서 호출합니다.
+입력당 토큰 한도를 넘는 텍스트는 보내기 전에 조각으로 나누어 임베딩한 뒤 하나의 벡터로 합칩니다.
+"""
+import asyncio
+import math
+
+from common.chunking import (MAX_INPUTS_PER_REQUEST, MAX_TOKENS_PER_INPUT, MAX_TOKENS_PER_REQUEST,
+                             estimate_tokens, pack_batches)
+from common.embedding_cache import EmbeddingCache, cache_key
+from common.tokens import split_to_tokens
+
+# 요청당 입력 개수 제한이 기본값(250)과 다른 모델
+MODEL_MAX_INPUTS = {
+    "gemini-embedding-001": 1,
+}
+
+_default_cache = None
+
+
+def default_cache() -> EmbeddingCache:
+    """프로세스 전체에서 공유하는 기본 디스크 캐시 (EMBEDDING_CACHE_PATH)."""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = EmbeddingCache()
+    return _default_cache
+
+
+def split_oversize(items: list[tuple]) -> list[tuple]:
+    """
+    (캐시 키, 텍스트) 목록을 요청에 넣을 (캐시 키, 조각, 추정 토큰 수) 목록으로 펼칩니다.
+
+    입력당 토큰 한도(MAX_TOKENS_PER_INPUT)를 넘는 텍스트는 API가 거부하거나(auto_truncate=False)
+    뒷부분을 조용히 잘라 버리므로, 보내기 전에 여기서 한도 이하의 조각들로 나눕니다.
+    """
+    pieces = []
+    for key, text in items:
+        for piece in split_to_tokens(text, MAX_TOKENS_PER_INPUT):
+            pieces.append((key, piece, estimate_tokens(piece)))
+    return pieces
+
+
+def pool_vectors(parts: list[tuple]) -> list[float]:
+    """
+    한 텍스트에서 나뉜 조각들의 (토큰 수, 벡터) 목록을 토큰 수 가중 평균 후 L2 정규화하여 합칩니다.
+    조각이 하나면 벡터를 그대로 돌려줍니다.
+    """
+    if len(parts) == 1:
+        return parts[0][1]
+    total = [0.0] * len(parts[0][1])
+    for tokens, vector in parts:
+        weight = max(tokens, 1)
+        for i, value in enumerate(vector):
+            total[i] += weight * value
+    norm = math.sqrt(sum(v * v for v in total)) or 1.0
+    return [v / norm for v in total]
+
+
+class EmbeddingService:
+    """
+    캐시를 거쳐 임베딩을 생성하는 서비스.
+
+    사용 예:
+        service = EmbeddingService("text-multilingual-embedding-002", backend="genai")
+        vectors = service.embed(["문장1", "문장2"], task_type="RETRIEVAL_DOCUMENT")
+    """
+    def __init__(self, model: str, backend: str = "genai", cache: EmbeddingCache = None,
+                 client=None, use_cache: bool = True):
+        """
+        Args:
+            model: 임베딩 모델 이름 (예: "text-multilingual-embedding-002", "models/text-embedding-004").
+            backend: "genai"(google-genai), "vertexai"(Vertex AI SDK), "generativeai"(google-generativeai).
+            cache: 사용할 EmbeddingCache. None이면 기본 디스크 캐시 사용.
+            client: backend="genai"일 때 재사용할 genai.Client (None이면 새로 생성).
+            use_cache: False이면 캐시 없이 항상 API 호출.
+        """
+        if backend not in ("genai", "vertexai", "generativeai"):
+            raise ValueError(f"지원하지 않는 임베딩 backend입니다: {backend}")
+        self.model = model
+        self.backend = backend
+        self.cache = (cache or default_cache()) if use_cache else None
+        self.max_inputs = MODEL_MAX_INPUTS.get(model.split("/")[-1], MAX_INPUTS_PER_REQUEST)
+        self.api_calls = 0
+        self._client = client
+        self._vertex_model = None
+
+    def request_embeddings(self, texts: list[str], task_type: str,
+                           output_dimensionality=None) -> list[list[float]]:
+        """캐시를 거치지 않고 backend API를 한 번 호출합니다. texts는 요청 한도 이내여야 합니다."""
+        self.api_calls += 1
+        if self.backend == "genai":
+            from google import genai
+            from google.genai.types import EmbedContentConfig
+
+            if self._client is None:
+                self._client = genai.Client()
+            response = self._client.models.embed_content(
+                model=self.model,
+                contents=texts,
+                config=EmbedContentConfig(task_type=task_type, output_dimensionality=output_dimensionality),
+            )
+            return [list(e.values) for e in response.embeddings]
+
+        if self.backend == "vertexai":
+            from vertexai.preview.language_models import TextEmbeddingInput, TextEmbeddingModel
+
+            if self._vertex_model is None:
+                self._vertex_model = TextEmbeddingModel.from_pretrained(self.model)
+            inputs = [TextEmbeddingInput(task_type=task_type, text=t) for t in texts]
+            kwargs = {"output_dimensionality": output_dimensionality} if output_dimensionality else {}
+            response = self._vertex_model.get_embeddings(inputs, auto_truncate=False, **kwargs)
+            return [list(e.values) for e in response]
+
+        import google.generativeai as generativeai
+
+        kwargs = {"output_dimensionality": output_dimensionality} if output_dimensionality else {}
+        response = generativeai.embed_content(model=self.model, content=texts, task_type=task_type, **kwargs)
+        return [list(v) for v in response["embedding"]]
+
+    async def request_embeddings_async(self, texts: list[str], task_type: str,
+                                       output_dimensionality=None) -> list[list[float]]:
+        """
+        request_embeddings의 비동기 버전. google-genai는 client.aio를 사용하고,
+        비동기 API가 없는 SDK는 스레드에서 실행합니다.
+        """
+        if self.backend != "genai":
+            return await asyncio.to_thread(self.request_embeddings, texts, task_type, output_dimensionality)
+
+        from google import genai
+        from google.genai.types import EmbedContentConfig
+
+        self.api_calls += 1
+        if self._client is None:
+            self._client = genai.Client()
+        response = await self._client.aio.models.embed_content(
+            model=self.model,
+            contents=texts,
+            config=EmbedContentConfig(task_type=task_type, output_dimensionality=output_dimensionality),
+        )
+        return [list(e.values) for e in response.embeddings]
+
+    def embed(self, texts: list[str], task_type: str = "RETRIEVAL_DOCUMENT",
+              output_dimensionality: int = None) -> list[list[float]]:
+        """
+        텍스트 목록의 임베딩을 입력 순서대로 돌려줍니다.
+
+        Args:
+            texts: 임베딩할 텍스트 목록.
+            task_type: "RETRIEVAL_DOCUMENT", "RETRIEVAL_QUERY" 등.
+            output_dimensionality: 출력 차원 (모델이 지원하는 경우). None이면 모델 기본값.
+
+        Returns:
+            list[list[float]]: 텍스트별 임베딩 벡터.
+        """
+        keys = [cache_key(self.model, task_type, output_dimensionality, t) for t in texts]
+        found = self.cache.get_many(keys) if self.cache else {}
+
+        # 캐시에 없는 텍스트만 (중복 제거 후) 한도를 넘는 것은 나누고, 요청 한도 안에서 묶어 호출
+        missing = list(dict.fromkeys((k, t) for k, t in zip(keys, texts) if k not in found))
+        pieces = split_oversize(missing)
+        expected = {}
+        for key, _, _ in pieces:
+            expected[key] = expected.get(key, 0) + 1
+        parts = {}
+        for batch in pack_batches(pieces, max_inputs=self.max_inputs, max_tokens=MAX_TOKENS_PER_REQUEST,
+                                  token_count=lambda item: item[2]):
+            vectors = self.request_embeddings([piece for _, piece, _ in batch], task_type, output_dimensionality)
+            fresh = {}
+            for (key, _, tokens), vector in zip(batch, vectors):
+                parts.setdefault(key, []).append((tokens, vector))
+                # 조각이 모두 모인 텍스트만 합쳐서 캐시에 저장
+                if len(parts[key]) == expected[key]:
+                    fresh[key] = pool_vectors(parts.pop(key))
+            if self.cache:
+                self.cache.put_many(fresh)
+            found.update(fresh)
+        return [found[k] for k in keys]
+
+    def embed_one(self, text: str, task_type: str = "RETRIEVAL_QUERY",
+                  output_dimensionality: int = None) -> list[float]:
+        """텍스트 하나의 임베딩 (질문 임베딩용, 기본 task_type은 RETRIEVAL_QUERY)."""
+        return self.embed([text], task_type=task_type, output_dimensionality=output_dimensionality)[0]
+
+    def report(self) -> str:
+        """API 호출 수와 캐시 통계."""
+        cache_report = self.cache.report() if self.cache else "캐시 사용 안 함"
+        return f"임베딩 API 호출 {self.api_calls}회 ({self.model}), {cache_report}"
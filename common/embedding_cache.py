@@ -0,0 +1,176 @@
+"""
+임베딩 결과 디스크 캐시.
+
+(모델, task_type, 출력 차원, 텍스트 SHA-256)을 키로 임베딩 벡터를 SQLite 파일에 저장합니다.
+값은 float32 리틀엔디언 바이트열(768차원 기준 3KB)로 저장하여 JSON보다 작고 빠르게 읽습니다.
+전체 크기가 max_bytes를 넘으면 가장 오래 사용하지 않은 항목부터 지웁니다(LRU).
+"""
+import hashlib
+import os
+import sqlite3
+import sys
+import threading
+import time
+from array import array
+
+DEFAULT_CACHE_PATH = os.getenv(
+    "EMBEDDING_CACHE_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "notebooklm", "embeddings.sqlite3"),
+)
+DEFAULT_MAX_BYTES = int(os.getenv("EMBEDDING_CACHE_MAX_MB", "1024")) * 1024 * 1024
+
+
+def _encode(values) -> bytes:
+    packed = array("f", values)
+    if sys.byteorder != "little":
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def _decode(blob: bytes) -> list[float]:
+    packed = array("f")
+    packed.frombytes(blob)
+    if sys.byteorder != "little":
+        packed.byteswap()
+    return packed.tolist()
+
+
+def cache_key(model: str, task_type: str, output_dimensionality, text: str) -> str:
+    """캐시 키 문자열을 만듭니다. 텍스트 자체 대신 SHA-256 해시를 사용합니다."""
+    text_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    return f"{model}|{task_type or ''}|{output_dimensionality or ''}|{text_hash}"
+
+
+class EmbeddingCache:
+    """
+    크기 제한이 있는 LRU 임베딩 디스크 캐시. 여러 스레드에서 함께 사용해도 안전합니다.
+    """
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_bytes: int = DEFAULT_MAX_BYTES):
+        """
+        Args:
+            path: SQLite 캐시 파일 경로.
+            max_bytes: 저장된 벡터 바이트 합계의 상한.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON embeddings(last_access)")
+        self._conn.commit()
+        # 저장된 바이트 합계. 시작할 때 한 번만 합산하고 이후에는 삽입/제거 때 갱신합니다.
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+
+    def get_many(self, keys: list[str]) -> dict:
+        """
+        여러 키를 한 번에 조회합니다.
+
+        Returns:
+            dict: 캐시에 있는 키 -> 벡터(list[float]). 없는 키는 포함되지 않습니다.
+        """
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        with self._lock:
+            # SQLite 변수 개수 제한(기본 999)을 넘지 않도록 나누어 조회
+            for i in range(0, len(unique_keys), 500):
+                part = unique_keys[i:i + 500]
+                placeholders = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT key, value FROM embeddings WHERE key IN ({placeholders})", part
+                ).fetchall()
+                found.update((key, _decode(value)) for key, value in rows)
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE key = ?", [(now, k) for k in found]
+                )
+                self._conn.commit()
+            self.hits += sum(1 for k in keys if k in found)
+            self.misses += sum(1 for k in keys if k not in found)
+        return found
+
+    def put_many(self, items: dict):
+        """키 -> 벡터 항목들을 저장하고 필요하면 오래된 항목을 정리합니다."""
+        if not items:
+            return
+        now = time.time()
+        rows = []
+        for key, values in items.items():
+            blob = _encode(values)
+            rows.append((key, blob, len(blob), now))
+        with self._lock:
+            # 덮어쓰는 키의 기존 크기는 합계에서 뺌 (기본 키 조회라 전체 스캔 없음)
+            keys = list(items)
+            replaced = 0
+            for i in range(0, len(keys), 500):
+                part = keys[i:i + 500]
+                placeholders = ",".join("?" * len(part))
+                replaced += self._conn.execute(
+                    f"SELECT COALESCE(SUM(size), 0) FROM embeddings WHERE key IN ({placeholders})", part
+                ).fetchone()[0]
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, value, size, last_access) VALUES (?, ?, ?, ?)", rows
+            )
+            self._conn.commit()
+            self._total_bytes += sum(row[2] for row in rows) - replaced
+            self._evict_if_needed()
+
+    def _evict_if_needed(self):
+        if self._total_bytes <= self.max_bytes:
+            return
+        # 다른 프로세스도 같은 파일에 쓰거나 정리할 수 있으므로 정리하기 전에만 실제 합계로 맞춤
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+        self._total_bytes = total
+        if total <= self.max_bytes:
+            return
+        # 상한의 90%까지 줄여 매 삽입마다 정리가 반복되지 않도록 합니다.
+        target = int(self.max_bytes * 0.9)
+        removed = 0
+        cursor = self._conn.execute("SELECT key, size FROM embeddings ORDER BY last_access")
+        victims = []
+        for key, size in cursor:
+            if total <= target:
+                break
+            victims.append((key,))
+            total -= size
+            removed += 1
+        cursor.close()
+        self._conn.executemany("DELETE FROM embeddings WHERE key = ?", victims)
+        self._conn.commit()
+        self._total_bytes = total
+        self.evictions += removed
+
+    def stats(self) -> dict:
+        """적중/미스/제거 횟수와 현재 항목 수, 바이트 합계."""
+        with self._lock:
+            count, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM embeddings"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": count,
+            "bytes": total,
+        }
+
+    def report(self) -> str:
+        s = self.stats()
+        return (f"임베딩 캐시: 적중 {s['hits']}회, 미스 {s['misses']}회 (적중률 {s['hit_rate']:.1%}), "
+                f"제거 {s['evictions']}개, 저장 {s['entries']}개 / {s['bytes'] / 1024 / 1024:.1f}MB")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,208 @@
+"""
+임베딩 행렬의 바이너리 저장 형식.
+
+JSONL은 Matching Engine 입력과 교환(interchange)용으로만 쓰고, FAISS/NumPy 검색용으로는
+다음 세 파일을 같은 접두어(prefix)로 저장합니다.
+
+- <prefix>.npy: (행 수, 차원) float32 또는 float16 행렬 (NumPy .npy 형식)
+- <prefix>.ids.jsonl: 행 순서대로 한 줄에 하나씩 JSON 문자열로 쓴 ID
+- <prefix>.header.json: {"format_version", "model", "dim", "dtype", "count", "normalized"}
+  (normalized: 행별로 L2 정규화된 벡터를 저장했으면 true. 없으면 false로 봅니다.
+   MatrixWriter의 extra로 준 항목(예: 노트북 샤드의 shard_version)이 함께 기록될 수 있습니다.)
+
+.npy는 np.load(mmap_mode="r")로 메모리 매핑하여 읽으므로, JSON 파싱이나 Python float 리스트를
+거치지 않고 FAISS에 바로 넘길 수 있습니다.
+"""
+import json
+import os
+
+import numpy as np
+
+MATRIX_FORMAT_VERSION = 1
+MATRIX_SUFFIXES = (".npy", ".ids.jsonl", ".header.json")
+SUPPORTED_DTYPES = ("float32", "float16")
+# 임시 원시(raw) 파일을 .npy로 옮길 때 한 번에 복사할 행 수
+COPY_BLOCK_ROWS = 65536
+
+
+class MatrixWriter:
+    """
+    벡터를 조금씩 추가하며 .npy 행렬을 만드는 writer. 전체 행렬을 메모리에 올리지 않습니다.
+
+    add()로 받은 벡터는 임시 원시 파일에 이어 쓰고, close() 때 행 수가 확정되면
+    .npy 파일로 블록 단위 복사합니다.
+    """
+    def __init__(self, prefix: str, model: str, dtype: str = "float32", normalized: bool = False,
+                 extra: dict = None):
+        """
+        Args:
+            normalized: 추가할 벡터가 이미 행별로 정규화되어 있으면 True (헤더에 기록되어
+                        로드하는 쪽이 다시 정규화하지 않음).
+            extra: 헤더에 함께 기록할 추가 항목 (예: {"shard_version": ...}). 기본 항목 이름과 겹칠 수 없습니다.
+        """
+        if extra and set(extra) & {"format_version", "model", "dim", "dtype", "count", "normalized"}:
+            raise ValueError(f"헤더 기본 항목은 extra로 덮어쓸 수 없습니다: {sorted(extra)}")
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(f"지원하지 않는 dtype입니다: {dtype} (지원: {', '.join(SUPPORTED_DTYPES)})")
+        self.prefix = prefix
+        self.model = model
+        self.dtype = np.dtype(dtype)
+        self.normalized = normalized
+        self.extra = dict(extra or {})
+        self.dim = None
+        self.count = 0
+        os.makedirs(os.path.dirname(os.path.abspath(prefix)), exist_ok=True)
+        self._raw_path = prefix + ".raw.tmp"
+        self._raw = open(self._raw_path, "wb")
+        self._ids = open(prefix + ".ids.jsonl.tmp", "w", encoding="utf-8")
+
+    def add(self, ids: list[str], vectors):
+        """ID와 벡터(리스트 또는 2차원 배열)를 같은 순서로 추가합니다."""
+        block = np.asarray(vectors, dtype=self.dtype)
+        if block.ndim != 2 or block.shape[0] != len(ids):
+            raise ValueError(f"ID {len(ids)}개와 벡터 배열 {block.shape}의 크기가 맞지 않습니다.")
+        if self.dim is None:
+            self.dim = block.shape[1]
+        elif block.shape[1] != self.dim:
+            raise ValueError(f"임베딩 차원({block.shape[1]})이 앞선 벡터({self.dim})와 다릅니다.")
+        self._raw.write(np.ascontiguousarray(block).tobytes())
+        for doc_id in ids:
+            self._ids.write(json.dumps(str(doc_id)) + "\n")
+        self.count += len(ids)
+
+    def close(self) -> dict:
+        """.npy/.ids.jsonl/.header.json을 완성하고 헤더 딕셔너리를 반환합니다."""
+        self._raw.close()
+        self._ids.close()
+        dim = self.dim or 0
+        matrix = np.lib.format.open_memmap(self.prefix + ".npy", mode="w+", dtype=self.dtype,
+                                           shape=(self.count, dim))
+        if self.count:
+            raw = np.memmap(self._raw_path, dtype=self.dtype, mode="r", shape=(self.count, dim))
+            for start in range(0, self.count, COPY_BLOCK_ROWS):
+                matrix[start:start + COPY_BLOCK_ROWS] = raw[start:start + COPY_BLOCK_ROWS]
+            del raw
+        matrix.flush()
+        del matrix
+        os.remove(self._raw_path)
+        os.replace(self.prefix + ".ids.jsonl.tmp", self.prefix + ".ids.jsonl")
+
+        header = {
+            "format_version": MATRIX_FORMAT_VERSION,
+            "model": self.model,
+            "dim": dim,
+            "dtype": self.dtype.name,
+            "count": self.count,
+            "normalized": self.normalized,
+            **self.extra,
+        }
+        with open(self.prefix + ".header.json", "w", encoding="utf-8") as f:
+            json.dump(header, f, ensure_ascii=False, indent=2)
+        return header
+
+
+def load_matrix(prefix: str, mmap: bool = True):
+    """
+    저장된 행렬을 읽습니다.
+
+    Args:
+        prefix: 파일 접두어 (예: "output_embeddings/matrix/embeddings").
+        mmap: True면 np.load(mmap_mode="r")로 메모리 매핑 (실제로 접근한 페이지만 읽음).
+
+    Returns:
+        tuple: (matrix, ids, header)
+    """
+    with open(prefix + ".header.json", "r", encoding="utf-8") as f:
+        header = json.load(f)
+    if header.get("format_version") != MATRIX_FORMAT_VERSION:
+        raise ValueError(f"지원하지 않는 행렬 형식 버전입니다: {header.get('format_version')}")
+    matrix = np.load(prefix + ".npy", mmap_mode="r" if mmap else None)
+    with open(prefix + ".ids.jsonl", "r", encoding="utf-8") as f:
+        ids = [json.loads(line) for line in f if line.strip()]
+    if matrix.shape != (header["count"], header["dim"]) or len(ids) != header["count"]:
+        raise ValueError(f"행렬 {matrix.shape}, ID {len(ids)}개가 헤더(count={header['count']}, "
+                         f"dim={header['dim']})와 일치하지 않습니다.")
+    return matrix, ids, header
+
+
+def iter_float32_blocks(matrix, block_rows: int = COPY_BLOCK_ROWS):
+    """
+    행렬을 float32 연속 블록으로 나누어 돌려줍니다 (FAISS add/search 입력용).
+    float32 memmap은 복사 없이 그대로, float16은 블록 단위로만 변환하여 메모리 사용량을 제한합니다.
+    """
+    for start in range(0, matrix.shape[0], block_rows):
+        yield np.ascontiguousarray(matrix[start:start + block_rows], dtype=np.float32)
+
+
+def jsonl_to_matrix(jsonl_paths: list[str], prefix: str, model: str, dtype: str = "float32",
+                    block_rows: int = 4096) -> dict:
+    """
+    {"id", "embedding"} JSONL 파일들을 한 줄씩 읽어 바이너리 행렬로 변환합니다.
+
+    Returns:
+        dict: 저장된 헤더
+    """
+    writer = MatrixWriter(prefix, model, dtype)
+    ids, vectors = [], []
+    for path in jsonl_paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                data = json.loads(line)
+                ids.append(data["id"])
+                vectors.append(data["embedding"])
+                if len(ids) >= block_rows:
+                    writer.add(ids, vectors)
+                    ids, vectors = [], []
+    if ids:
+        writer.add(ids, vectors)
+    return writer.close()
+
+
+def upload_matrix(bucket, prefix: str, gcs_prefix: str):
+    """로컬 행렬 파일 세 개를 gs://<bucket>/<gcs_prefix><접미사>로 업로드합니다."""
+    for suffix in MATRIX_SUFFIXES:
+        blob = bucket.blob(gcs_prefix + suffix)
+        blob.upload_from_filename(prefix + suffix)
+        print(f"[성공] GCS 업로드 완료: gs://{bucket.name}/{blob.name}")
+
+
+def _blob_version(blob) -> list:
+    """GCS 객체의 세대와 체크섬. 같은 크기로 다시 내보낸 파일도 구분합니다."""
+    return [blob.generation, blob.crc32c or blob.md5_hash or ""]
+
+
+def download_matrix(bucket, gcs_prefix: str, prefix: str) -> bool:
+    """
+    GCS의 행렬 파일을 로컬 prefix로 내려받습니다. 파일을 메모리에 올리지 않고 디스크로 바로 내려받습니다.
+
+    내려받은 객체의 세대(generation)와 체크섬을 <prefix>.gcs.json에 기록해 두고, 로컬 파일이 있고
+    기록이 GCS 객체와 같을 때만 다시 받지 않습니다 (크기만 비교하면 행 수/차원이 같은 재내보내기를 놓침).
+
+    Returns:
+        bool: GCS에 행렬이 없으면 False
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(prefix)), exist_ok=True)
+    sidecar_path = prefix + ".gcs.json"
+    try:
+        with open(sidecar_path, "r", encoding="utf-8") as f:
+            downloaded = json.load(f)
+    except (OSError, ValueError):
+        downloaded = {}
+    for suffix in MATRIX_SUFFIXES:
+        blob = bucket.get_blob(gcs_prefix + suffix)
+        if blob is None:
+            return False
+        path = prefix + suffix
+        if os.path.exists(path) and downloaded.get(suffix) == _blob_version(blob):
+            continue
+        print(f"  다운로드 중: gs://{bucket.name}/{blob.name} ({blob.size / 1024 / 1024:.1f}MB)")
+        # 임시 파일로 받은 뒤 교체하고, 교체가 끝난 뒤에 기록 (도중에 실패하면 다음 실행에서 다시 받음)
+        blob.download_to_filename(path + ".tmp")
+        os.replace(path + ".tmp", path)
+        downloaded[suffix] = _blob_version(blob)
+        with open(sidecar_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(downloaded, f)
+        os.replace(sidecar_path + ".tmp", sidecar_path)
+    return True
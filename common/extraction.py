@@ -0,0 +1,267 @@
+"""
+PDF/TXT 텍스트 추출 단계.
+
+PyMuPDF(fitz)의 페이지 텍스트 추출은 CPU 한 코어에 묶이므로, 파일 단위와
+(큰 파일의 경우) 페이지 범위 단위로 작업을 나누어 프로세스 풀에서 병렬로 처리합니다.
+결과는 페이지 순서대로 정렬된 텍스트 리스트로 돌려줍니다.
+
+주의: 프로세스 풀은 spawn 방식(Windows/macOS)에서 메인 모듈을 다시 import하므로,
+이 모듈을 사용하는 스크립트는 반드시 `if __name__ == "__main__":` 블록 안에서 호출해야 합니다.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+
+import fitz  # PyMuPDF
+
+from common.manifest import file_sha256
+from common.text_cache import ExtractedTextCache
+
+# 이 페이지 수보다 큰 PDF는 여러 작업으로 나누어 여러 프로세스가 나눠서 추출
+PAGES_PER_TASK = int(os.getenv("EXTRACT_PAGES_PER_TASK", "64"))
+# 추출 결과 캐시 키에 들어가는 버전. 추출 방식을 바꾸면 리비전(r1)을 올려 이전 캐시를 무효화합니다.
+EXTRACTOR_VERSION = f"pymupdf{fitz.VersionBind}-r1"
+
+
+def default_text_cache() -> ExtractedTextCache:
+    """현재 추출기 버전으로 기본 디렉토리의 추출 텍스트 캐시를 만듭니다."""
+    return ExtractedTextCache(version=EXTRACTOR_VERSION)
+
+
+@dataclass
+class ExtractedDocument:
+    """
+    파일 하나의 추출 결과.
+
+    Attributes:
+        source: 파일 이름 (BigQuery/Matching Engine 행의 source 값).
+        path: 파일 경로.
+        pages: 페이지 순서대로 정렬된 페이지별 텍스트. TXT 파일은 한 페이지로 취급.
+    """
+    source: str
+    path: str
+    pages: list[str] = field(default_factory=list)
+
+    @property
+    def text(self) -> str:
+        """전체 페이지를 이어 붙인 텍스트."""
+        return "".join(self.pages)
+
+
+@dataclass
+class ExtractionStats:
+    """추출 단계 처리량 통계. 워커 수를 정할 때 pages_per_sec를 참고합니다."""
+    files: int = 0
+    pages: int = 0
+    cached_files: int = 0
+    failed_files: int = 0
+    elapsed_sec: float = 0.0
+    workers: int = 1
+
+    @property
+    def pages_per_sec(self) -> float:
+        return self.pages / self.elapsed_sec if self.elapsed_sec > 0 else 0.0
+
+    def report(self) -> str:
+        return (f"추출 통계: 파일 {self.files}개 (캐시 {self.cached_files}개), 페이지 {self.pages}개, 실패 {self.failed_files}개, "
+                f"{self.elapsed_sec:.2f}초, {self.pages_per_sec:.1f} pages/s (워커 {self.workers}개)")
+
+
+def _extract_page_range(path: str, start: int, end: int) -> list[str]:
+    """
+    (워커 프로세스에서 실행) PDF의 [start, end) 페이지 텍스트를 추출합니다.
+    """
+    with fitz.open(path) as doc:
+        return [doc.load_page(i).get_text() for i in range(start, end)]
+
+
+def _read_text_file(path: str) -> list[str]:
+    """(워커 프로세스에서 실행) TXT 파일 전체를 한 페이지로 읽습니다."""
+    with open(path, "r", encoding="utf-8") as f:
+        return [f.read()]
+
+
+@dataclass
+class ExtractionTask:
+    """
+    추출 작업 하나 (파일 하나의 페이지 범위). 프로세스 워커로 넘어가므로 pickle 가능한 값만 담습니다.
+
+    Attributes:
+        path: 파일 경로.
+        start, end: 페이지 범위 [start, end). TXT는 (0, 1).
+        parts: 이 파일을 나눈 작업 수 (모두 모이면 문서 하나를 만듦).
+        sha256: 추출 캐시 키. 캐시를 쓰지 않거나 TXT이면 None.
+        pages: 추출한 페이지 텍스트. 캐시에서 찾은 파일은 계획할 때 채워 두어 파싱을 건너뜁니다.
+        cached: pages를 캐시에서 가져왔으면 True.
+    """
+    path: str
+    start: int
+    end: int
+    parts: int = 1
+    sha256: str = None
+    pages: list = None
+    cached: bool = False
+
+
+def plan_extraction(path: str, pages_per_task: int = PAGES_PER_TASK,
+                    text_cache: ExtractedTextCache = None) -> list[ExtractionTask]:
+    """
+    파일 하나를 페이지 범위 작업들로 나눕니다. pages_per_task보다 큰 PDF는 여러 작업이 되어
+    여러 프로세스가 나눠서 추출합니다. 지원하지 않는 형식이나 빈 PDF는 빈 리스트,
+    PDF를 열지 못하면 예외를 전달합니다.
+
+    text_cache를 주면 PDF는 파일 해시로 캐시를 먼저 조회하고, 있으면 페이지를 채운 작업 하나를 돌려줍니다.
+    """
+    fname = os.path.basename(path)
+    lower = fname.lower()
+    if lower.endswith(".txt"):
+        return [ExtractionTask(path, 0, 1)]
+    if not lower.endswith(".pdf"):
+        print(f"[알림] 지원하지 않는 파일 형식 ({os.path.splitext(fname)[1]}), 건너뜀: {fname}")
+        return []
+    sha256 = file_sha256(path) if text_cache else None
+    pages = text_cache.get(sha256) if text_cache else None
+    if pages is not None:
+        print(f"[정보] 추출 캐시 사용: {fname}")
+        return [ExtractionTask(path, 0, len(pages), sha256=sha256, pages=pages, cached=True)]
+    # 페이지 수 확인은 목차(xref)만 읽으므로 메인 프로세스에서 해도 가볍습니다.
+    with fitz.open(path) as doc:
+        page_count = doc.page_count
+    if page_count == 0:
+        print(f"[알림] 내용이 비어 있음, 건너뜀: {fname}")
+        return []
+    starts = range(0, page_count, pages_per_task)
+    return [ExtractionTask(path, start, min(start + pages_per_task, page_count), parts=len(starts), sha256=sha256)
+            for start in starts]
+
+
+def _run_task(path: str, start: int, end: int) -> list[str]:
+    if path.lower().endswith(".txt"):
+        return _read_text_file(path)
+    return _extract_page_range(path, start, end)
+
+
+def run_extraction_task(task: ExtractionTask) -> list[ExtractionTask]:
+    """
+    (워커 프로세스에서 실행) 작업의 페이지 범위를 추출해 pages를 채웁니다.
+    common.pipeline의 단계 함수로 쓰기 위해 결과를 1개짜리 리스트로 반환하고, 추출 오류는 예외로 전달합니다.
+    """
+    if task.pages is None:
+        task.pages = _run_task(task.path, task.start, task.end)
+    return [task]
+
+
+class DocumentAssembler:
+    """
+    페이지 범위 작업 결과를 파일별로 모아, 한 파일의 작업이 모두 끝나면 ExtractedDocument를 만듭니다.
+    새로 파싱한 PDF는 text_cache에 저장하고, 처리량을 ExtractionStats로 집계합니다.
+    """
+    def __init__(self, text_cache: ExtractedTextCache = None, workers: int = 1):
+        self.text_cache = text_cache
+        self.stats = ExtractionStats(workers=workers)
+        self._parts = {}
+        self._failed = set()
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+
+    def fail(self, path: str):
+        """파일의 작업 하나라도 실패하면 그 파일은 문서로 만들지 않습니다."""
+        with self._lock:
+            self._failed.add(path)
+            self._parts.pop(path, None)
+
+    def add(self, task: ExtractionTask) -> list[ExtractedDocument]:
+        """
+        추출이 끝난 작업을 받습니다.
+
+        Returns:
+            list[ExtractedDocument]: 이 작업으로 파일이 완성되면 문서 1개 (내용이 비어 있으면 0개), 아니면 빈 리스트.
+        """
+        with self._lock:
+            if task.path in self._failed:
+                return []
+            parts = self._parts.setdefault(task.path, {})
+            parts[task.start] = task.pages
+            if len(parts) < task.parts:
+                return []
+            del self._parts[task.path]
+            pages = [page for start in sorted(parts) for page in parts[start]]
+            if task.cached:
+                self.stats.cached_files += 1
+            self.stats.files += 1
+            self.stats.pages += len(pages)
+        if task.sha256 and not task.cached and self.text_cache:
+            self.text_cache.put(task.sha256, pages)
+        doc = ExtractedDocument(source=os.path.basename(task.path), path=task.path, pages=pages)
+        if not doc.text.strip():
+            print(f"[알림] 내용이 비어 있음, 건너뜀: {doc.source}")
+            return []
+        return [doc]
+
+    def finish(self) -> ExtractionStats:
+        """실패했거나 작업이 다 모이지 않은 파일 수와 경과 시간을 기록한 통계를 반환합니다."""
+        with self._lock:
+            self.stats.failed_files = len(self._failed | set(self._parts))
+            self.stats.elapsed_sec = time.perf_counter() - self._started
+        return self.stats
+
+
+def extract_documents(paths: list[str], max_workers: int = None,
+                      pages_per_task: int = PAGES_PER_TASK, text_cache: ExtractedTextCache = None):
+    """
+    여러 파일의 텍스트를 프로세스 풀로 병렬 추출합니다 (파이프라인 없이 한 번에 추출할 때).
+
+    Args:
+        paths: 추출할 파일 경로 목록 (.pdf, .txt).
+        max_workers: 워커 프로세스 수. None이면 CPU 코어 수, 1이면 풀 없이 현재 프로세스에서 처리.
+        pages_per_task: 작업 하나가 담당할 최대 페이지 수.
+        text_cache: 추출 텍스트 캐시. 주면 캐시에 있는 PDF는 파싱하지 않습니다.
+
+    Returns:
+        tuple: (documents, stats)
+               documents (list[ExtractedDocument]): 입력 순서를 유지한 추출 결과 (실패/빈 파일 제외).
+               stats (ExtractionStats): 처리량 통계.
+    """
+    workers = max_workers or os.cpu_count() or 1
+    assembler = DocumentAssembler(text_cache, workers=workers)
+    tasks = []
+    for path in paths:
+        try:
+            tasks.extend(plan_extraction(path, pages_per_task, text_cache))
+        except Exception as e:
+            print(f"[오류] PDF 열기 실패: {os.path.basename(path)} - {e}")
+            assembler.fail(path)
+
+    documents = {}
+
+    def collect(task):
+        for doc in assembler.add(task):
+            documents[doc.path] = doc
+
+    def report_failure(task, error):
+        print(f"[오류] 텍스트 추출 실패: {os.path.basename(task.path)} ({task.start}~{task.end}쪽) - {error}")
+        assembler.fail(task.path)
+
+    pending = [task for task in tasks if task.pages is None]
+    for task in tasks:
+        if task.pages is not None:
+            collect(task)
+    if workers == 1:
+        for task in pending:
+            try:
+                collect(run_extraction_task(task)[0])
+            except Exception as e:
+                report_failure(task, e)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(run_extraction_task, task): task for task in pending}
+            for future in as_completed(futures):
+                try:
+                    collect(future.result()[0])
+                except Exception as e:
+                    report_failure(futures[future], e)
+
+    stats = assembler.finish()
+    return [documents[path] for path in paths if path in documents], stats
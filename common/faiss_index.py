@@ -0,0 +1,403 @@
+"""
+FAISS 인덱스 빌드와 스냅샷 저장/로드.
+
+검색 워커가 시작할 때마다 GCS의 임베딩을 다시 읽어 인덱스를 만들면 수 분이 걸립니다.
+인덱스를 한 번 빌드한 뒤 다음 세 파일을 스냅샷 디렉토리에 저장해 두고,
+
+- index.faiss: faiss.write_index로 저장한 인덱스
+- ids.jsonl: 인덱스 행 순서대로 한 줄에 하나씩 JSON 문자열로 쓴 문서 ID
+- meta.json: {"format_version", "model", "dim", "count", "manifest_hash", "index_type", "created_at"}
+
+다음 시작 때 원본 임베딩의 매니페스트 해시(GCS 객체 이름/크기/체크섬 목록의 해시)가 같으면
+IO_FLAG_MMAP으로 인덱스를 메모리 매핑하여 몇 초 안에 로드합니다. 해시가 다를 때만 다시 빌드합니다.
+
+인덱스 종류는 코퍼스 크기에 따라 정확 검색(IndexFlatIP), HNSW, IVF-Flat, IVF-PQ 중에서 고르고,
+근사 인덱스의 nprobe/efSearch는 정확 검색 결과와 비교해 목표 재현율(recall)을 만족하는 값으로 자동 튜닝합니다.
+선택한 파라미터와 측정한 recall/지연 시간은 meta.json의 "build" 항목에 기록됩니다.
+
+저장할 때는 이전 meta.json을 먼저 지우고 새 meta.json을 마지막에 쓰므로, 중간에 중단된 스냅샷은
+meta.json이 없어 로드되지 않고 다음 실행에서 다시 빌드됩니다.
+"""
+import hashlib
+import json
+import math
+import os
+import time
+
+import faiss
+import numpy as np
+
+from common.embedding_matrix import iter_float32_blocks
+
+SNAPSHOT_FORMAT_VERSION = 1
+SNAPSHOT_FILES = ("index.faiss", "ids.jsonl", "meta.json")
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+# 인덱스 종류: "auto"면 코퍼스 크기로 선택, 또는 INDEX_TYPES 중 하나를 지정
+DEFAULT_INDEX_TYPE = os.getenv("FAISS_INDEX_TYPE", "auto")
+# nprobe/efSearch 자동 튜닝 목표 recall@k
+DEFAULT_TARGET_RECALL = float(os.getenv("FAISS_TARGET_RECALL", "0.95"))
+# IVF 학습에 쓸 최대 표본 수
+TRAIN_SAMPLE_SIZE = int(os.getenv("FAISS_TRAIN_SAMPLE", "200000"))
+# 자동 튜닝에 쓸 질의 수와 top-k
+TUNE_QUERIES = int(os.getenv("FAISS_TUNE_QUERIES", "200"))
+TUNE_K = int(os.getenv("FAISS_TUNE_K", "10"))
+# auto 선택 기준 (벡터 수)
+FLAT_MAX_VECTORS = 20000
+HNSW_MAX_VECTORS = 500000
+IVF_FLAT_MAX_VECTORS = 2000000
+# HNSW 그래프 파라미터
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+
+
+def gcs_manifest_hash(blobs) -> str:
+    """
+    GCS 객체 목록(이름, 크기, 체크섬, 세대)의 SHA-256. 객체 내용을 내려받지 않고 원본 변경 여부를 판단합니다.
+    """
+    entries = sorted((b.name, b.size, b.crc32c or b.md5_hash or "", b.generation) for b in blobs)
+    return hashlib.sha256(json.dumps(entries).encode("utf-8")).hexdigest()
+
+
+def choose_index_type(count: int) -> str:
+    """코퍼스 크기로 인덱스 종류를 고릅니다 (FAISS_INDEX_TYPE=auto일 때)."""
+    if count <= FLAT_MAX_VECTORS:
+        return "flat"      # 작은 코퍼스는 정확 검색으로도 충분히 빠름
+    if count <= HNSW_MAX_VECTORS:
+        return "hnsw"      # 학습 불필요, 높은 재현율. 그래프만큼 메모리 추가
+    if count <= IVF_FLAT_MAX_VECTORS:
+        return "ivf_flat"  # 원본 벡터를 그대로 두고 nprobe개 목록만 탐색
+    return "ivf_pq"        # 수백만 건 이상: PQ 코드(96B) + SQ8 재정렬 벡터(768B) (768차원 float32 3KB 대비)
+
+
+def _nlist_for(count: int) -> int:
+    """IVF 목록 수. 약 4√N으로 하되, 목록당 학습 벡터가 39개 이상이 되도록 제한합니다."""
+    nlist = int(4 * math.sqrt(count))
+    return max(1, min(nlist, count // 39, TRAIN_SAMPLE_SIZE // 39))
+
+
+def _pq_subquantizers(dim: int) -> int:
+    """PQ 부분 양자화기 수. 부분 벡터 하나가 약 8차원이 되도록 dim의 약수 중에서 고릅니다."""
+    for m in (dim // 8, dim // 12, dim // 16, dim // 4, dim // 2):
+        if m >= 1 and dim % m == 0:
+            return m
+    return 1
+
+
+def _sample_rows(embeddings_np, size: int, seed: int = 0) -> np.ndarray:
+    """행렬에서 size개 행을 무작위로 뽑아 float32 연속 배열로 돌려줍니다 (memmap은 정렬된 순서로 읽음)."""
+    count = embeddings_np.shape[0]
+    if size >= count:
+        return np.ascontiguousarray(embeddings_np, dtype=np.float32)
+    rows = np.sort(np.random.default_rng(seed).choice(count, size=size, replace=False))
+    return np.ascontiguousarray(embeddings_np[rows], dtype=np.float32)
+
+
+def _exact_neighbors(embeddings_np, queries: np.ndarray, k: int) -> np.ndarray:
+    """블록 단위 정확 내적 검색으로 질의별 상위 k개 행 번호를 구합니다 (자동 튜닝의 정답 집합)."""
+    heap = faiss.ResultHeap(len(queries), k, keep_max=True)
+    start = 0
+    for block in iter_float32_blocks(embeddings_np):
+        scores = queries @ block.T
+        top = min(k, block.shape[0])
+        idx = np.argpartition(-scores, top - 1, axis=1)[:, :top]
+        heap.add_result(np.take_along_axis(scores, idx, axis=1), idx + start)
+        start += block.shape[0]
+    heap.finalize()
+    return heap.I
+
+
+def _recall_and_latency(index, queries: np.ndarray, query_rows: np.ndarray, truth: np.ndarray, k: int):
+    """
+    질의 자신(코퍼스에서 뽑은 행)을 제외한 recall@k와 질의당 평균 지연(ms)을 측정합니다.
+    """
+    started = time.perf_counter()
+    _, found = index.search(queries, k + 1)
+    latency_ms = (time.perf_counter() - started) * 1000 / len(queries)
+    hits = 0
+    for row, result, expected in zip(query_rows, found, truth):
+        result = [i for i in result if i != row][:k]
+        expected = [i for i in expected if i != row][:k]
+        hits += len(set(result) & set(expected))
+    return hits / (k * len(queries)), latency_ms
+
+
+def apply_search_params(index, params: dict):
+    """nprobe(IVF), efSearch(HNSW), k_factor(IVF-PQ 재정렬) 검색 파라미터를 인덱스에 적용합니다."""
+    if "efSearch" in params:
+        index.hnsw.efSearch = params["efSearch"]
+    if "nprobe" in params:
+        faiss.extract_index_ivf(index).nprobe = params["nprobe"]
+    if "k_factor" in params:
+        index.k_factor = params["k_factor"]
+    return index
+
+
+def build_faiss_index(embeddings_np, embedding_dimension, index_type: str = DEFAULT_INDEX_TYPE,
+                      target_recall: float = DEFAULT_TARGET_RECALL, k: int = TUNE_K):
+    """
+    주어진 임베딩으로 FAISS 인덱스를 빌드하고, 근사 인덱스이면 검색 파라미터를 자동 튜닝합니다.
+
+    - flat: IndexFlatIP (정확 검색)
+    - ivf_flat / ivf_pq: TRAIN_SAMPLE_SIZE개 표본으로 학습한 뒤 블록 단위로 추가
+    - hnsw: IndexHNSWFlat (학습 불필요)
+
+    근사 인덱스는 코퍼스에서 뽑은 TUNE_QUERIES개 질의의 정확 검색 결과를 정답으로 삼아
+    nprobe(IVF) 또는 efSearch(HNSW)를 작은 값부터 늘려 가며 recall@k가 target_recall 이상이 되는
+    가장 작은(가장 빠른) 값을 고릅니다.
+
+    Args:
+        embeddings_np (numpy.ndarray): 임베딩 numpy 배열 (float32/float16, memmap 가능).
+        embedding_dimension (int): 임베딩 차원.
+        index_type (str): "auto", "flat", "ivf_flat", "ivf_pq", "hnsw".
+        target_recall (float): 자동 튜닝 목표 recall@k.
+        k (int): 튜닝에 사용할 top-k.
+
+    Returns:
+        tuple: (index, build_info)
+               index (faiss.Index): 빌드된 FAISS 인덱스.
+               build_info (dict): 인덱스 종류, 파라미터, 측정한 recall/지연, 튜닝 기록 (스냅샷 meta.json에 기록).
+    """
+    count = embeddings_np.shape[0]
+    if index_type == "auto":
+        index_type = choose_index_type(count)
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"지원하지 않는 FAISS 인덱스 종류입니다: {index_type} (가능: {', '.join(INDEX_TYPES)})")
+    started = time.perf_counter()
+    print(f"\nFAISS 인덱스 빌드 중... (종류: {index_type}, 임베딩 개수: {count}, 차원: {embedding_dimension})")
+
+    params = {}
+    metric = faiss.METRIC_INNER_PRODUCT
+    if index_type == "flat":
+        # DOT_PRODUCT_DISTANCE와 유사하게 작동하도록 IndexFlatIP 사용
+        # (정규화된 벡터의 경우 코사인 유사도와 동일)
+        index = faiss.IndexFlatIP(embedding_dimension)
+    elif index_type == "hnsw":
+        params = {"M": HNSW_M, "efConstruction": HNSW_EF_CONSTRUCTION}
+        index = faiss.IndexHNSWFlat(embedding_dimension, HNSW_M, metric)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    else:
+        nlist = _nlist_for(count)
+        params = {"nlist": nlist}
+        quantizer = faiss.IndexFlatIP(embedding_dimension)
+        if index_type == "ivf_flat":
+            index = faiss.IndexIVFFlat(quantizer, embedding_dimension, nlist, metric)
+        else:
+            m = _pq_subquantizers(embedding_dimension)
+            # 코드북(2^nbits개 중심) 하나당 학습 벡터가 39개 이상 되도록 nbits 제한
+            nbits = max(4, min(8, int(math.log2(max(2, min(count, TRAIN_SAMPLE_SIZE) // 39)))))
+            params.update({"m": m, "nbits": nbits, "refine": "SQ8"})
+            ivf = faiss.IndexIVFPQ(quantizer, embedding_dimension, nlist, m, nbits, metric)
+            # PQ 거리만으로는 상위 k개 순서가 부정확하므로, k × k_factor개 후보를 8비트 스칼라 양자화
+            # 벡터(차원당 1바이트)로 다시 점수 매겨 재정렬합니다. 원본 float32의 1/4 메모리입니다.
+            refine = faiss.IndexScalarQuantizer(embedding_dimension, faiss.ScalarQuantizer.QT_8bit, metric)
+            index = faiss.IndexRefine(ivf, refine)
+        train = _sample_rows(embeddings_np, TRAIN_SAMPLE_SIZE)
+        print(f"  학습 중... (표본 {len(train)}개, nlist={nlist})")
+        index.train(train)
+        params["train_sample"] = len(train)
+        del train
+
+    # 블록 단위로 추가 (float32 memmap은 복사 없이, float16은 블록별로 float32 변환)
+    for block in iter_float32_blocks(embeddings_np):
+        index.add(block)
+    build_info = {"index_type": index_type, "params": params, "build_sec": round(time.perf_counter() - started, 3)}
+
+    if index_type != "flat":
+        tuning = _tune(index, index_type, embeddings_np, target_recall, k)
+        params.update(tuning.pop("search_params"))
+        build_info.update(tuning)
+        print(f"  자동 튜닝 결과: {build_info['params']}, recall@{k}={build_info['recall']:.3f}, "
+              f"질의당 {build_info['latency_ms']:.3f}ms")
+    print(f"FAISS 인덱스 빌드 완료. 인덱스에 총 {index.ntotal}개의 벡터가 있습니다.")
+    return index, build_info
+
+
+def _tune(index, index_type: str, embeddings_np, target_recall: float, k: int) -> dict:
+    """nprobe/efSearch를 자동 튜닝하고 선택한 값을 인덱스에 적용합니다."""
+    count = embeddings_np.shape[0]
+    k = min(k, count - 1)
+    query_rows = np.sort(np.random.default_rng(1).choice(count, size=min(TUNE_QUERIES, count), replace=False))
+    queries = np.ascontiguousarray(embeddings_np[query_rows], dtype=np.float32)
+    truth = _exact_neighbors(embeddings_np, queries, k + 1)
+
+    # 느린 설정일수록 뒤에 오도록 후보를 나열하고, 목표 recall을 처음 만족하는 설정을 고릅니다.
+    if index_type == "hnsw":
+        candidates = [{"efSearch": v} for v in (16, 32, 64, 128, 256, 512, 1024) if v >= k]
+    else:
+        nlist = faiss.extract_index_ivf(index).nlist
+        nprobes = sorted({min(2 ** i, nlist) for i in range(int(math.log2(nlist)) + 2)})
+        if index_type == "ivf_pq":
+            candidates = [{"k_factor": f, "nprobe": n} for f in (4, 16, 64) for n in nprobes]
+        else:
+            candidates = [{"nprobe": n} for n in nprobes]
+
+    trials = []
+    chosen = None
+    for search_params in candidates:
+        apply_search_params(index, search_params)
+        recall, latency_ms = _recall_and_latency(index, queries, query_rows, truth, k)
+        trials.append(dict(search_params, recall=round(recall, 4), latency_ms=round(latency_ms, 4)))
+        if recall >= target_recall:
+            chosen = trials[-1]
+            break
+    if chosen is None:
+        chosen = max(trials, key=lambda t: t["recall"])
+        print(f"[알림] 목표 recall@{k}({target_recall})에 도달하지 못해 최고 recall({chosen['recall']}) 설정을 사용합니다.")
+    search_params = {name: value for name, value in chosen.items() if name not in ("recall", "latency_ms")}
+    apply_search_params(index, search_params)
+    return {
+        "search_params": search_params,
+        "target_recall": target_recall,
+        "tune_k": k,
+        "tune_queries": len(queries),
+        "recall": chosen["recall"],
+        "latency_ms": chosen["latency_ms"],
+        "trials": trials,
+    }
+
+
+def save_index_snapshot(directory: str, index, ids: list, model: str, manifest_hash: str,
+                        extra: dict = None) -> dict:
+    """
+    인덱스, ID, 메타데이터를 스냅샷 디렉토리에 저장합니다.
+
+    Args:
+        directory: 스냅샷 디렉토리.
+        index: 저장할 faiss.Index.
+        ids: 인덱스 행 순서대로의 문서 ID.
+        model: 임베딩 모델 이름.
+        manifest_hash: 원본 임베딩 매니페스트 해시 (gcs_manifest_hash).
+        extra: meta.json에 함께 기록할 추가 정보.
+
+    Returns:
+        dict: 저장한 메타데이터.
+    """
+    if index.ntotal != len(ids):
+        raise ValueError(f"인덱스 벡터 수({index.ntotal})와 ID 수({len(ids)})가 다릅니다.")
+    os.makedirs(directory, exist_ok=True)
+    index_path, ids_path, meta_path = (os.path.join(directory, name) for name in SNAPSHOT_FILES)
+
+    faiss.write_index(index, index_path + ".tmp")
+    with open(ids_path + ".tmp", "w", encoding="utf-8") as f:
+        for doc_id in ids:
+            f.write(json.dumps(str(doc_id), ensure_ascii=False) + "\n")
+    meta = {
+        "format_version": SNAPSHOT_FORMAT_VERSION,
+        "model": model,
+        "dim": index.d,
+        "count": index.ntotal,
+        "manifest_hash": manifest_hash,
+        "index_type": type(index).__name__,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+    meta.update(extra or {})
+    with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    _remove_meta(directory)
+    os.replace(index_path + ".tmp", index_path)
+    os.replace(ids_path + ".tmp", ids_path)
+    os.replace(meta_path + ".tmp", meta_path)
+    return meta
+
+
+def _remove_meta(directory: str):
+    meta_path = os.path.join(directory, "meta.json")
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+
+
+def read_snapshot_meta(directory: str):
+    """스냅샷의 meta.json을 읽습니다. 없거나 읽을 수 없으면 None."""
+    try:
+        with open(os.path.join(directory, "meta.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def build_config(index_type: str = DEFAULT_INDEX_TYPE, target_recall: float = DEFAULT_TARGET_RECALL) -> dict:
+    """스냅샷에 기록하는 빌드 설정. 설정이 바뀌면 원본이 같아도 다시 빌드합니다."""
+    return {"index_type": index_type, "target_recall": target_recall}
+
+
+def snapshot_is_current(meta, model: str, dim: int, manifest_hash: str, config: dict = None) -> bool:
+    """스냅샷 메타데이터가 현재 모델/차원/원본 매니페스트 (그리고 빌드 설정)와 일치하는지 확인합니다."""
+    return bool(meta) and meta.get("format_version") == SNAPSHOT_FORMAT_VERSION and \
+        meta.get("model") == model and meta.get("dim") == dim and meta.get("manifest_hash") == manifest_hash and \
+        (config is None or meta.get("build_config") == config)
+
+
+def load_index_snapshot(directory: str, mmap: bool = True):
+    """
+    저장된 스냅샷을 로드합니다.
+
+    Args:
+        directory: 스냅샷 디렉토리.
+        mmap: True면 IO_FLAG_MMAP | IO_FLAG_READ_ONLY로 메모리 매핑 (실제로 접근한 페이지만 읽음).
+              인덱스 종류가 메모리 매핑을 지원하지 않으면 일반 읽기로 대체합니다.
+
+    Returns:
+        tuple: (index, ids, meta). 스냅샷이 없거나 손상되었으면 None.
+    """
+    meta = read_snapshot_meta(directory)
+    if meta is None or meta.get("format_version") != SNAPSHOT_FORMAT_VERSION:
+        return None
+    index_path = os.path.join(directory, "index.faiss")
+    try:
+        if mmap:
+            try:
+                index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+            except RuntimeError:
+                index = faiss.read_index(index_path)
+        else:
+            index = faiss.read_index(index_path)
+        with open(os.path.join(directory, "ids.jsonl"), "r", encoding="utf-8") as f:
+            ids = [json.loads(line) for line in f if line.strip()]
+    except (OSError, RuntimeError, ValueError) as e:
+        print(f"[알림] FAISS 스냅샷을 읽을 수 없습니다: {directory} - {e}")
+        return None
+    if index.ntotal != meta.get("count") or len(ids) != meta.get("count"):
+        print(f"[알림] FAISS 스냅샷이 불완전합니다 (벡터 {index.ntotal}개, ID {len(ids)}개, "
+              f"메타 {meta.get('count')}개): {directory}")
+        return None
+    return apply_search_params(index, (meta.get("build") or {}).get("params", {})), ids, meta
+
+
+def upload_snapshot(bucket, directory: str, gcs_prefix: str):
+    """스냅샷 파일들을 gs://<bucket>/<gcs_prefix><파일명>으로 업로드합니다 (meta.json은 마지막)."""
+    for name in SNAPSHOT_FILES:
+        blob = bucket.blob(gcs_prefix + name)
+        blob.upload_from_filename(os.path.join(directory, name))
+        print(f"[성공] GCS 업로드 완료: gs://{bucket.name}/{blob.name}")
+
+
+def download_snapshot(bucket, gcs_prefix: str, directory: str, model: str, dim: int, manifest_hash: str,
+                      config: dict = None) -> bool:
+    """
+    GCS의 스냅샷이 현재 원본과 일치하면 로컬 디렉토리로 내려받습니다.
+    meta.json을 먼저 확인하므로 오래된 스냅샷은 인덱스 파일을 내려받지 않습니다.
+
+    Returns:
+        bool: 일치하는 스냅샷을 내려받았으면 True
+    """
+    meta_blob = bucket.get_blob(gcs_prefix + "meta.json")
+    if meta_blob is None:
+        return False
+    meta = json.loads(meta_blob.download_as_text())
+    if not snapshot_is_current(meta, model, dim, manifest_hash, config):
+        return False
+    os.makedirs(directory, exist_ok=True)
+    for name in SNAPSHOT_FILES[:-1]:
+        blob = bucket.get_blob(gcs_prefix + name)
+        if blob is None:
+            return False
+        print(f"  다운로드 중: gs://{bucket.name}/{blob.name} ({blob.size / 1024 / 1024:.1f}MB)")
+        blob.download_to_filename(os.path.join(directory, name) + ".tmp")
+    _remove_meta(directory)
+    for name in SNAPSHOT_FILES[:-1]:
+        os.replace(os.path.join(directory, name) + ".tmp", os.path.join(directory, name))
+    with open(os.path.join(directory, "meta.json.tmp"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    os.replace(os.path.join(directory, "meta.json.tmp"), os.path.join(directory, "meta.json"))
+    return True
@@ -0,0 +1,406 @@
+"""
+메타데이터 필터 검색: 청크별 메타데이터 열 테이블(side table)과 필터 식 변환.
+
+지금까지의 검색 경로는 모두 코퍼스 전체에서 top-k를 찾았기 때문에 "이 파일에서만", "최근 올린 문서에서만"
+같은 조건은 결과를 받은 뒤 거르는 수밖에 없었고, 조건이 까다로우면 k개를 채우지 못했습니다.
+여기서는 필터를 검색 안에서 적용합니다.
+
+- MetadataTable: 인덱스 행 순서대로의 메타데이터 열 (source, chunk_index, ingested_at).
+  문자열 열은 범주 코드(정수)로, 숫자 열은 NumPy 배열로 저장하여 필터를 행 비트맵(bool 배열)으로 바로 계산하고,
+  인덱스 옆에 .npz 파일로 저장합니다.
+- FAISS: 비트맵을 IDSelectorBitmap 검색 파라미터로 넘겨 선택된 행만 거리 계산 (to_faiss_params)
+- BigQuery: 필터를 WHERE 절로 바꾸어 ML.DISTANCE/VECTOR_SEARCH 앞에서 행을 거름 (to_sql)
+- Matching Engine: restricts(Namespace)와 numeric restricts(NumericNamespace)로 변환 (to_matching_engine)
+
+필터 형식 ({열: 조건}, 조건끼리는 AND):
+    {"source": "manual.pdf"}                          # 같음
+    {"source": ["a.pdf", "b.pdf"]}                    # 목록 중 하나
+    {"chunk_index": {"gte": 10, "lt": 40}}            # 범위 (eq, in, gt, gte, lt, lte)
+    {"ingested_at": {"gte": "2026-01-01"}}            # 날짜 (ISO 문자열 또는 유닉스 초)
+    {"notebook": "nb-1"}                              # 노트북 (resolve_notebook으로 source 목록으로 바꿈)
+
+청크 추출기는 페이지 번호를 기록하지 않으므로 페이지 범위 대신 chunk_index 범위로 문서의 앞/뒤 부분을 고릅니다.
+
+근접 중복 제거(common.dedup)로 건너뛴 청크는 다른 source의 원본 행으로만 저장되어 있으므로, source 조건은
+linked_sources({원본 청크 ID: 링크한 source 목록}, common.dedup.load_linked_sources)를 주면
+원본 행을 링크한 source의 행으로도 취급합니다 (MetadataTable, to_sql).
+"""
+import json
+import os
+from datetime import datetime, timezone
+
+import numpy as np
+
+# 메타데이터 테이블 저장 형식 버전
+METADATA_FORMAT_VERSION = 1
+# BigQuery 임베딩 테이블에 실제로 있는 필터 열 (나머지 열은 MetadataTable로 source 목록으로 바꾸어 적용)
+SQL_COLUMNS = ("id", "source", "chunk_index")
+# 값을 유닉스 초로 저장하는 날짜 열
+DATE_COLUMNS = ("ingested_at",)
+# 범위 연산자
+OPERATORS = {"eq": "=", "gt": ">", "gte": ">=", "lt": "<", "lte": "<="}
+# Matching Engine NumericNamespace 연산자
+ME_OPERATORS = {"eq": "EQUAL", "gt": "GREATER", "gte": "GREATER_EQUAL", "lt": "LESS", "lte": "LESS_EQUAL"}
+# 필터가 있을 때 HNSW efSearch 상한. 선택된 행이 적을수록 그래프에서 만나는 후보가 줄어 efSearch를 선택 비율만큼 늘림
+FILTER_MAX_EF_SEARCH = int(os.getenv("FILTER_MAX_EF_SEARCH", "1024"))
+
+
+def to_timestamp(value) -> float:
+    """ISO 날짜/시각 문자열, datetime 또는 숫자를 유닉스 초로 바꿉니다 (시간대가 없으면 UTC)."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def _conditions(column: str, condition) -> list[tuple]:
+    """필터 조건 하나를 (연산자, 값) 목록으로 풉니다. 연산자는 "in" 또는 OPERATORS의 키."""
+    if isinstance(condition, dict):
+        unknown = set(condition) - set(OPERATORS) - {"in"}
+        if unknown:
+            raise ValueError(f"지원하지 않는 필터 연산자입니다 ({column}): {sorted(unknown)}")
+        items = list(condition.items())
+    elif isinstance(condition, (list, tuple, set, frozenset)):
+        items = [("in", condition)]
+    else:
+        items = [("eq", condition)]
+    parsed = []
+    for op, value in items:
+        if op == "in":
+            value = sorted(value, key=str)
+        if column in DATE_COLUMNS:
+            value = [to_timestamp(v) for v in value] if op == "in" else to_timestamp(value)
+        parsed.append((op, value))
+    return parsed
+
+
+def _compare(values: np.ndarray, op: str, value) -> np.ndarray:
+    if op == "in":
+        if not len(value):
+            return np.zeros(len(values), dtype=bool)
+        # 값 배열의 dtype(고정 폭 문자열)으로 바꾸면 긴 값이 잘려 다른 값과 같아지므로 dtype을 강제하지 않음
+        return np.isin(values, np.asarray(list(value)))
+    if op == "eq":
+        return values == value
+    if op == "gt":
+        return values > value
+    if op == "gte":
+        return values >= value
+    if op == "lt":
+        return values < value
+    return values <= value
+
+
+def resolve_notebook(filters: dict, registry) -> dict:
+    """
+    {"notebook": ID} 조건을 노트북의 source 목록 조건으로 바꿉니다.
+    source 조건이 이미 있으면 둘 다 만족하는 source만 남깁니다.
+
+    Args:
+        registry: common.shards.NotebookRegistry.
+    """
+    if not filters or "notebook" not in filters:
+        return filters
+    filters = dict(filters)
+    notebook_ids = filters.pop("notebook")
+    if isinstance(notebook_ids, str):
+        notebook_ids = [notebook_ids]
+    sources = {source for notebook_id in notebook_ids for source in registry.sources(notebook_id)}
+    if "source" in filters:
+        table = MetadataTable(sorted(sources), {"source": sorted(sources)})
+        sources = {table.ids[row] for row in np.flatnonzero(table.mask({"source": filters["source"]}))}
+    filters["source"] = sorted(sources)
+    return filters
+
+
+class MetadataTable:
+    """
+    인덱스 행 순서대로의 청크 메타데이터 열 테이블.
+
+    사용 예:
+        metadata = MetadataTable.from_ids(doc_ids, manifest)
+        mask = metadata.mask({"source": "a.pdf", "chunk_index": {"lt": 20}})   # 행 비트맵
+    """
+    def __init__(self, ids: list, columns: dict, linked_sources: dict = None):
+        """
+        Args:
+            ids: 인덱스 행 순서의 ID 목록.
+            columns: {열 이름: ids 순서의 값 목록}. 문자열 열은 범주 코드로, 숫자 열은 배열로 저장합니다.
+            linked_sources: {원본 청크 ID: 그 청크를 중복으로 링크한 source 목록}. source 조건에 함께 적용합니다.
+        """
+        self.ids = list(ids)
+        self.codes = {}   # 문자열 열 → (int32 코드 배열, 값 목록)
+        self.values = {}  # 숫자 열 → float64/int64 배열
+        for name, values in columns.items():
+            if len(values) != len(self.ids):
+                raise ValueError(f"메타데이터 열 {name}의 길이({len(values)})가 ID 수({len(self.ids)})와 다릅니다.")
+            array = np.asarray(values)
+            if array.dtype.kind in "iufb":
+                self.values[name] = array
+            else:
+                vocabulary, codes = np.unique(array.astype(str), return_inverse=True)
+                self.codes[name] = (codes.astype(np.int32), vocabulary)
+        self._row_of = None
+        # 행 번호 → 이 행을 원본으로 링크한 source들 (인덱스에 없는 원본 ID는 무시)
+        self.linked = {}
+        for canonical, sources in (linked_sources or {}).items():
+            row = self.row_of(canonical)
+            if row is not None:
+                self.linked[row] = tuple(sources)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def columns(self) -> list[str]:
+        return ["id"] + sorted(self.codes) + sorted(self.values)
+
+    @classmethod
+    def from_ids(cls, ids: list, manifest=None, linked_sources: dict = None) -> "MetadataTable":
+        """
+        "source#청크번호" 형식의 청크 ID로 source/chunk_index 열을 만들고,
+        매니페스트가 주어지면 source별 인제스트 시각(ingested_at)을 붙입니다. 기록이 없으면 NaN.
+        linked_sources는 생성자와 같습니다.
+        """
+        sources, chunk_indexes = [], []
+        for doc_id in ids:
+            source, sep, index = str(doc_id).rpartition("#")
+            if sep and index.isdigit():
+                sources.append(source)
+                chunk_indexes.append(int(index))
+            else:
+                sources.append(str(doc_id))
+                chunk_indexes.append(-1)
+        columns = {"source": np.array(sources, dtype=str), "chunk_index": np.array(chunk_indexes, dtype=np.int64)}
+        if manifest is not None:
+            ingested = {}
+            for entry in manifest.entries.values():
+                if entry.get("ingested_at") is not None:
+                    ingested[entry["source"]] = max(ingested.get(entry["source"], 0.0), entry["ingested_at"])
+            columns["ingested_at"] = np.array([ingested.get(s, np.nan) for s in sources], dtype=np.float64)
+        return cls(ids, columns, linked_sources)
+
+    @classmethod
+    def from_manifest(cls, manifest, linked_sources: dict = None) -> "MetadataTable":
+        """매니페스트에 기록된 모든 행 ID로 만듭니다 (BigQuery 테이블처럼 인덱스 행 순서가 없는 저장소용)."""
+        ids = [doc_id for entry in manifest.entries.values() for doc_id in entry["ids"]]
+        return cls.from_ids(ids, manifest, linked_sources)
+
+    def row_of(self, doc_id):
+        """ID의 행 번호. 없으면 None."""
+        if self._row_of is None:
+            self._row_of = {doc_id: row for row, doc_id in enumerate(self.ids)}
+        return self._row_of.get(doc_id)
+
+    def column(self, name: str) -> np.ndarray:
+        """열 값 배열 (문자열 열은 코드를 값으로 풀어서)."""
+        if name in self.values:
+            return self.values[name]
+        if name in self.codes:
+            codes, vocabulary = self.codes[name]
+            return vocabulary[codes]
+        if name == "id":
+            return np.array(self.ids, dtype=str)
+        raise ValueError(f"메타데이터 열이 없습니다: {name} (가능: {', '.join(self.columns)})")
+
+    def mask(self, filters: dict, follow_links: bool = True) -> np.ndarray:
+        """
+        필터를 만족하는 행의 bool 비트맵. 필터가 비어 있으면 모든 행.
+        follow_links이면 source 조건을 만족하는 source가 링크한 원본 행도 포함합니다.
+        """
+        mask = np.ones(len(self), dtype=bool)
+        for column, condition in (filters or {}).items():
+            for op, value in _conditions(column, condition):
+                if column in self.codes:
+                    # 문자열 열은 값 목록(작음)에서 조건을 계산한 뒤 코드로 행에 펼침
+                    codes, vocabulary = self.codes[column]
+                    value = [str(v) for v in value] if op == "in" else str(value)
+                    matched = _compare(vocabulary, op, value)[codes]
+                    if column == "source" and follow_links:
+                        for row, sources in self.linked.items():
+                            if not matched[row] and _compare(np.array(sources), op, value).any():
+                                matched[row] = True
+                    mask &= matched
+                elif column == "id":
+                    allowed = np.zeros(len(self), dtype=bool)
+                    targets = value if op == "in" else [value]
+                    if op not in ("eq", "in"):
+                        raise ValueError("id 열은 eq/in 조건만 지원합니다.")
+                    allowed[[row for row in map(self.row_of, targets) if row is not None]] = True
+                    mask &= allowed
+                else:
+                    mask &= _compare(self.column(column), op, value)
+        return mask
+
+    def rows(self, filters: dict) -> np.ndarray:
+        """필터를 만족하는 행 번호 (int64, 오름차순)."""
+        return np.flatnonzero(self.mask(filters))
+
+    def to_source_filter(self, filters: dict, keep=SQL_COLUMNS) -> dict:
+        """
+        keep에 없는 열(예: ingested_at)의 조건을 만족하는 source 목록 조건으로 바꿉니다.
+        BigQuery 테이블처럼 그 열이 없는 저장소에 필터를 넘길 때 씁니다 (source 단위로 같은 값인 열에만 정확함).
+        링크된 원본 행의 source는 넣지 않습니다 (링크는 to_sql의 linked_sources로 적용).
+        """
+        if not filters or all(column in keep for column in filters):
+            return filters
+        pushed = {column: condition for column, condition in filters.items() if column not in keep or column == "source"}
+        sources = self.column("source")[self.mask(pushed, follow_links=False)]
+        result = {column: condition for column, condition in filters.items() if column in keep}
+        result["source"] = sorted(set(sources.tolist()))
+        return result
+
+    def save(self, path: str, source_hash: str = None):
+        """
+        .npz 파일 하나로 저장합니다 (임시 파일에 쓴 뒤 교체).
+
+        Args:
+            source_hash: 테이블을 만든 원본의 해시 (예: 인덱스 스냅샷의 manifest_hash). load에서 비교합니다.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        arrays = {"ids": np.array(self.ids, dtype=str)}
+        for name, (codes, vocabulary) in self.codes.items():
+            arrays[f"codes__{name}"] = codes
+            arrays[f"vocab__{name}"] = vocabulary
+        for name, values in self.values.items():
+            arrays[f"values__{name}"] = values
+        meta = {"format_version": METADATA_FORMAT_VERSION, "count": len(self), "source_hash": source_hash,
+                "linked": {str(row): list(sources) for row, sources in self.linked.items()}}
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, meta=np.array(json.dumps(meta)), **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, ids: list = None, source_hash: str = None):
+        """
+        저장된 테이블을 읽습니다. 파일이 없거나 형식 버전이 다르거나,
+        ids가 주어졌는데 저장된 ID 순서와 다르면 None (인덱스가 다시 빌드된 경우).
+        source_hash가 주어졌는데 저장할 때의 해시와 다르면 None
+        (ID가 같아도 원본이 다시 인제스트되어 ingested_at 등이 바뀌었을 수 있음).
+        """
+        if not os.path.exists(path):
+            return None
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data["meta"]))
+            if meta.get("format_version") != METADATA_FORMAT_VERSION:
+                return None
+            if source_hash is not None and meta.get("source_hash") != source_hash:
+                return None
+            stored_ids = data["ids"].tolist()
+            if ids is not None and stored_ids != [str(doc_id) for doc_id in ids]:
+                return None
+            table = cls(ids if ids is not None else stored_ids, {})
+            for key in data.files:
+                kind, _, name = key.partition("__")
+                if kind == "codes":
+                    table.codes[name] = (data[key], data[f"vocab__{name}"])
+                elif kind == "values":
+                    table.values[name] = data[key]
+            table.linked = {int(row): tuple(sources) for row, sources in meta.get("linked", {}).items()}
+        return table
+
+
+def to_sql(filters: dict, columns=SQL_COLUMNS, alias: str = "", linked_sources: dict = None) -> tuple:
+    """
+    필터를 BigQuery WHERE 조건과 쿼리 파라미터로 바꿉니다.
+
+    Args:
+        columns: 테이블에 있는 열. 다른 열의 조건은 ValueError (MetadataTable.to_source_filter로 먼저 바꿈).
+        alias: 열 앞에 붙일 테이블 별칭 (예: "t").
+        linked_sources: {원본 청크 ID: 링크한 source 목록}. source 조건을 만족하는 source가 링크한
+            원본 행도 함께 고릅니다 (source 조건 OR id IN 원본 ID 목록).
+
+    Returns:
+        tuple: (WHERE 조건 문자열, 쿼리 파라미터 목록). 필터가 없으면 ("TRUE", []).
+    """
+    from google.cloud import bigquery
+
+    clauses, params = [], []
+    prefix = f"{alias}." if alias else ""
+    for column, condition in (filters or {}).items():
+        if column not in columns:
+            raise ValueError(f"BigQuery 테이블에 없는 필터 열입니다: {column} (가능: {', '.join(columns)})")
+        for op, value in _conditions(column, condition):
+            name = f"filter_{len(params)}"
+            sample = value[0] if op == "in" and value else value
+            kind = "INT64" if isinstance(sample, (int, np.integer)) and not isinstance(sample, bool) else \
+                "FLOAT64" if isinstance(sample, (float, np.floating)) else "STRING"
+            if op == "in":
+                params.append(bigquery.ArrayQueryParameter(name, kind, list(value)))
+                clause = f"{prefix}{column} IN UNNEST(@{name})"
+            else:
+                params.append(bigquery.ScalarQueryParameter(name, kind, value))
+                clause = f"{prefix}{column} {OPERATORS[op]} @{name}"
+            if column == "source" and linked_sources:
+                targets = [str(v) for v in value] if op == "in" else str(value)
+                linked_ids = sorted(canonical for canonical, sources in linked_sources.items()
+                                    if _compare(np.array(sources), op, targets).any())
+                if linked_ids:
+                    ids_name = f"filter_{len(params)}"
+                    params.append(bigquery.ArrayQueryParameter(ids_name, "STRING", linked_ids))
+                    clause = f"({clause} OR {prefix}id IN UNNEST(@{ids_name}))"
+            clauses.append(clause)
+    return (" AND ".join(clauses) or "TRUE"), params
+
+
+def to_faiss_params(index, mask: np.ndarray):
+    """
+    행 비트맵을 FAISS 검색 파라미터(IDSelectorBitmap)로 바꿉니다.
+    IVF는 nprobe, 재정렬(IndexRefine)은 k_factor를 인덱스의 현재 값으로 유지하고,
+    HNSW는 efSearch를 선택 비율의 역수만큼 늘립니다 (FILTER_MAX_EF_SEARCH까지).
+
+    Returns:
+        faiss.SearchParameters: index.search(..., params=...)에 넘길 파라미터.
+    """
+    import faiss
+
+    bitmap = np.packbits(np.asarray(mask, dtype=bool), bitorder="little")
+    selector = faiss.IDSelectorBitmap(len(mask), faiss.swig_ptr(bitmap))
+    index = faiss.downcast_index(index)
+    base = faiss.downcast_index(index.base_index) if isinstance(index, faiss.IndexRefine) else index
+    if isinstance(base, faiss.IndexIVF):
+        params = faiss.SearchParametersIVF(sel=selector, nprobe=base.nprobe)
+    elif isinstance(base, faiss.IndexHNSW):
+        fraction = max(float(np.count_nonzero(mask)) / max(len(mask), 1), 1e-6)
+        ef_search = max(base.hnsw.efSearch, min(FILTER_MAX_EF_SEARCH, int(base.hnsw.efSearch / fraction)))
+        params = faiss.SearchParametersHNSW(sel=selector, efSearch=ef_search)
+    else:
+        params = faiss.SearchParameters(sel=selector)
+    if base is not index:
+        params = faiss.IndexRefineSearchParameters(k_factor=index.k_factor, base_index_params=params)
+    # SWIG 객체는 파이썬 배열을 참조하지 않으므로 검색이 끝날 때까지 비트맵/선택자를 파라미터에 붙들어 둠
+    params.referenced_objects = [bitmap, selector]
+    return params
+
+
+def to_matching_engine(filters: dict) -> tuple:
+    """
+    필터를 Matching Engine find_neighbors의 filter(Namespace)와 numeric_filter(NumericNamespace)로 바꿉니다.
+    문자열/값 목록 조건은 restricts 토큰, 숫자 조건은 numeric restricts로 적용됩니다.
+
+    Returns:
+        tuple: (Namespace 목록, NumericNamespace 목록).
+    """
+    from google.cloud.aiplatform.matching_engine.matching_engine_index_endpoint import Namespace, NumericNamespace
+
+    namespaces, numeric = [], []
+    for column, condition in (filters or {}).items():
+        for op, value in _conditions(column, condition):
+            if op == "in":
+                namespaces.append(Namespace(column, [str(v) for v in value], []))
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                # 날짜 열은 유닉스 초(정수)로 기록됨
+                if isinstance(value, int) or column in DATE_COLUMNS:
+                    numeric.append(NumericNamespace(name=column, value_int=int(value), op=ME_OPERATORS[op]))
+                else:
+                    numeric.append(NumericNamespace(name=column, value_double=value, op=ME_OPERATORS[op]))
+            elif op == "eq":
+                namespaces.append(Namespace(column, [str(value)], []))
+            else:
+                raise ValueError(f"Matching Engine 범위 필터는 숫자 값만 지원합니다: {column}")
+    return namespaces, numeric
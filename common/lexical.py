@@ -0,0 +1,258 @@
+"""
+로컬 역색인(inverted index) BM25 검색과 벡터 검색의 하이브리드 결합.
+
+밀집(dense) 벡터 검색만으로는 "Matching Engine", "Agent Builder" 같은 제품명이나 한국어 기술 용어가
+정확히 들어간 청크를 놓치는 경우가 많습니다. BM25Index는 content 열로 작은 역색인을 만들어
+용어가 정확히 일치하는 청크를 찾고, reciprocal_rank_fusion(RRF)으로 벡터 검색 순위와 합칩니다.
+
+토크나이저는 형태소 분석기 없이 동작하도록 한글 연속 구간은 음절 bigram("매칭엔진" -> 매칭, 칭엔, 엔진)으로,
+영문은 소문자 단어, 숫자는 그대로 나눕니다. 조사가 붙어도("엔진이") "엔진" bigram이 그대로 남습니다.
+
+역색인은 용어별 게시 목록(posting list)을 CSR 형태의 numpy 배열(문서 번호 int32, 빈도 uint16)로 저장하므로
+청크 수십만 개도 수십 MB 안에 들어가고, 질의 하나는 질의 용어의 게시 목록만 훑습니다.
+그래서 hybrid_search에서 BM25 상위 후보로 벡터 검색 대상을 먼저 줄이는(pre-filter) 데 쓸 수 있습니다.
+"""
+import json
+import math
+import os
+import re
+from collections import Counter
+
+import numpy as np
+
+# BM25 파라미터 (일반적인 기본값)
+BM25_K1 = 1.2
+BM25_B = 0.75
+# RRF 상수: 순위 r의 점수는 1 / (RRF_K + r)
+RRF_K = 60
+# 하이브리드 검색에서 각 검색기가 가져올 후보 수
+DEFAULT_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "200"))
+
+# 한글 음절 연속 구간, 영문 단어, 숫자, 한자 1글자
+_LEX_RE = re.compile(r"[가-힣]+|[A-Za-z]+|\d+|[一-鿿]")
+
+
+def tokenize(text: str) -> list[str]:
+    """
+    검색용 토큰 목록을 만듭니다. 한글은 음절 bigram(한 글자 단어는 그대로), 영문은 소문자 단어.
+
+    예: "Agent Builder의 역할" -> ["agent", "builder", "의", "역할"]
+    """
+    tokens = []
+    for match in _LEX_RE.finditer(text):
+        token = match.group(0)
+        if "가" <= token[0] <= "힣":
+            if len(token) == 1:
+                tokens.append(token)
+            else:
+                tokens.extend(token[i:i + 2] for i in range(len(token) - 1))
+        else:
+            tokens.append(token.lower())
+    return tokens
+
+
+class BM25Index:
+    """
+    BM25 역색인.
+
+    사용 예:
+        index = BM25Index(ids, texts)
+        index.search("Matching Engine 배포", k=10)   # [(id, BM25 점수), ...]
+    """
+    def __init__(self, ids: list, texts: list[str], version: str = "", store_text: bool = False,
+                 k1: float = BM25_K1, b: float = BM25_B):
+        """
+        Args:
+            ids: 문서(청크) ID 목록.
+            texts: ids와 같은 순서의 본문.
+            version: 코퍼스 버전 문자열. load()에서 저장된 버전과 비교합니다.
+            store_text: True면 본문도 보관하여 text(id)로 돌려줄 수 있습니다 (검색 결과 본문이 필요할 때).
+            k1, b: BM25 파라미터.
+        """
+        self.ids = list(ids)
+        self.version = version
+        self.k1 = k1
+        self.b = b
+        self.texts = list(texts) if store_text else None
+        self._row_of = None
+
+        self.vocab = {}
+        term_ids, doc_rows, freqs = [], [], []
+        self.doc_len = np.zeros(len(self.ids), dtype=np.float32)
+        for row, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            self.doc_len[row] = sum(counts.values())
+            for term, tf in counts.items():
+                term_ids.append(self.vocab.setdefault(term, len(self.vocab)))
+                doc_rows.append(row)
+                freqs.append(min(tf, 65535))
+        self._set_postings(np.array(term_ids, dtype=np.int64), np.array(doc_rows, dtype=np.int32),
+                           np.array(freqs, dtype=np.uint16))
+
+    def _set_postings(self, term_ids: np.ndarray, doc_rows: np.ndarray, freqs: np.ndarray):
+        """(용어, 문서, 빈도) 목록을 용어 순서로 정렬하여 CSR 게시 목록으로 만듭니다."""
+        order = np.argsort(term_ids, kind="stable")
+        self.postings = doc_rows[order]
+        self.freqs = freqs[order]
+        counts = np.bincount(term_ids, minlength=len(self.vocab))
+        self.offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        self.avg_len = float(self.doc_len.mean()) if len(self.doc_len) else 0.0
+
+    def __len__(self):
+        return len(self.ids)
+
+    def text(self, doc_id):
+        """store_text=True로 만든 인덱스에서 문서 본문을 돌려줍니다. 없으면 None."""
+        if self.texts is None:
+            return None
+        row = self.row_of(doc_id)
+        return None if row is None else self.texts[row]
+
+    def row_of(self, doc_id):
+        """문서 ID의 행 번호. 없으면 None."""
+        if self._row_of is None:
+            self._row_of = {doc_id: row for row, doc_id in enumerate(self.ids)}
+        return self._row_of.get(doc_id)
+
+    def scores(self, query: str) -> np.ndarray:
+        """모든 문서의 BM25 점수 (질의 용어가 없는 문서는 0)."""
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        n = len(self.ids)
+        for term in set(tokenize(query)):
+            term_id = self.vocab.get(term)
+            if term_id is None:
+                continue
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            rows = self.postings[start:end]
+            tf = self.freqs[start:end].astype(np.float32)
+            df = end - start
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * self.doc_len[rows] / (self.avg_len or 1.0))
+            scores[rows] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return scores
+
+    def search(self, query: str, k: int = 10, rows=None) -> list[tuple]:
+        """
+        BM25 상위 k개 문서를 찾습니다.
+
+        Args:
+            rows: 주어지면 이 행 번호들의 문서만 후보로 삼습니다 (예: 노트북/메타데이터 필터로 고른 행).
+
+        Returns:
+            list[tuple]: 점수 내림차순 (ID, BM25 점수). 질의 용어가 하나도 없는 문서는 포함하지 않습니다.
+        """
+        scores = self.scores(query)
+        matched = np.flatnonzero(scores > 0)
+        if rows is not None:
+            matched = np.intersect1d(matched, np.asarray(rows, dtype=np.int64))
+        if len(matched) > k:
+            matched = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        matched = matched[np.argsort(-scores[matched])]
+        return [(self.ids[row], float(scores[row])) for row in matched]
+
+    def save(self, path: str):
+        """인덱스를 npz 파일로 저장합니다 (임시 파일 + os.replace)."""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        terms = [None] * len(self.vocab)
+        for term, term_id in self.vocab.items():
+            terms[term_id] = term
+        meta = {"version": self.version, "k1": self.k1, "b": self.b, "ids": self.ids, "terms": terms,
+                "texts": self.texts}
+        tmp_path = path + ".tmp.npz"
+        np.savez_compressed(tmp_path, postings=self.postings, freqs=self.freqs, offsets=self.offsets,
+                            doc_len=self.doc_len, meta=np.array(json.dumps(meta, ensure_ascii=False)))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, version: str = None):
+        """
+        저장된 인덱스를 읽습니다.
+
+        Returns:
+            BM25Index. 파일이 없거나 version이 저장된 버전과 다르면 None (다시 만들어야 함).
+        """
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            meta = json.loads(str(data["meta"]))
+            if version is not None and meta["version"] != version:
+                return None
+            index = cls.__new__(cls)
+            index.postings = data["postings"]
+            index.freqs = data["freqs"]
+            index.offsets = data["offsets"]
+            index.doc_len = data["doc_len"]
+        index.ids = meta["ids"]
+        index.version = meta["version"]
+        index.k1 = meta["k1"]
+        index.b = meta["b"]
+        index.texts = meta["texts"]
+        index.vocab = {term: term_id for term_id, term in enumerate(meta["terms"])}
+        index.avg_len = float(index.doc_len.mean()) if len(index.doc_len) else 0.0
+        index._row_of = None
+        return index
+
+    @classmethod
+    def from_bigquery(cls, client, table: str, text_column: str = "content", id_column: str = "id",
+                      version: str = "", store_text: bool = False, bqstorage_client=None) -> "BM25Index":
+        """
+        BigQuery 테이블의 (ID, 본문) 열을 Storage Read API로 읽어 인덱스를 만듭니다 (임베딩 열은 읽지 않음).
+        """
+        from common.vector_search import _bqstorage_client
+
+        table_ref = client.get_table(table)
+        fields = [f for f in table_ref.schema if f.name in (id_column, text_column)]
+        rows = client.list_rows(table_ref, selected_fields=fields)
+        if bqstorage_client is None:
+            bqstorage_client = _bqstorage_client()
+        ids, texts = [], []
+        for batch in rows.to_arrow_iterable(bqstorage_client=bqstorage_client):
+            ids.extend(batch.column(batch.schema.get_field_index(id_column)).to_pylist())
+            texts.extend(t or "" for t in batch.column(batch.schema.get_field_index(text_column)).to_pylist())
+        return cls(ids, texts, version=version, store_text=store_text)
+
+
+def reciprocal_rank_fusion(rankings, k: int = RRF_K, limit: int = None) -> list[tuple]:
+    """
+    여러 검색 결과 순위를 RRF로 합칩니다. 점수 척도가 다른 BM25와 코사인 유사도를 순위만으로 결합합니다.
+
+    Args:
+        rankings: 검색기별 (ID, 점수) 리스트 목록. 각 리스트는 점수 내림차순이어야 합니다.
+        k: RRF 상수 (클수록 하위 순위의 기여가 커짐).
+        limit: 반환할 최대 개수. None이면 전부.
+
+    Returns:
+        list[tuple]: RRF 점수 내림차순 (ID, RRF 점수).
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, (doc_id, _) in enumerate(ranking, start=1):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (k + rank)
+    ordered = sorted(fused.items(), key=lambda item: item[1], reverse=True)
+    return ordered[:limit] if limit is not None else ordered
+
+
+def hybrid_search(query_text: str, query_vector, lexical: BM25Index, dense, k: int = 10,
+                  candidates: int = DEFAULT_CANDIDATES, prefilter: bool = True) -> list[tuple]:
+    """
+    BM25와 벡터 검색 결과를 RRF로 합친 top-k.
+
+    Args:
+        query_text: 질문 텍스트 (BM25용).
+        query_vector: 질문 임베딩 (벡터 검색용).
+        lexical: BM25Index.
+        dense: common.vector_search.InMemoryVectorIndex (lexical과 같은 ID 체계).
+        k: 반환할 결과 수.
+        candidates: 각 검색기에서 가져올 후보 수.
+        prefilter: True면 BM25 상위 후보(k개 이상일 때)의 벡터만 점수를 매깁니다 (전체 행렬 대신 후보 행만 계산).
+                   용어가 전혀 겹치지 않는 의미상 유사 문서는 놓칠 수 있으므로, 재현율이 중요하면 False.
+
+    Returns:
+        list[tuple]: RRF 점수 내림차순 (ID, RRF 점수).
+    """
+    lexical_ranked = lexical.search(query_text, candidates)
+    if prefilter and len(lexical_ranked) >= k:
+        dense_ranked = dense.search(query_vector, candidates, ids=[doc_id for doc_id, _ in lexical_ranked])
+    else:
+        dense_ranked = dense.search(query_vector, candidates)
+    return reciprocal_rank_fusion([lexical_ranked, dense_ranked], limit=k)
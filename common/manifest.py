@@ -0,0 +1,153 @@
+"""
+증분(incremental) 인제스트를 위한 매니페스트.
+
+파일 경로별로 (내용 SHA-256, 임베딩 모델, 저장된 행 ID 목록)을 JSON 파일에 기록해 두고,
+다음 실행 때 현재 파일들과 비교하여 새 파일/변경된 파일/삭제된 파일/변경 없는 파일을 구분합니다.
+변경 없는 파일은 다시 추출·임베딩하지 않고, 저장소(BigQuery 테이블, JSONL 샤드)의 기존 행도 그대로 둡니다.
+"""
+import hashlib
+import json
+import os
+import time
+from dataclasses import dataclass, field
+
+MANIFEST_VERSION = 1
+
+
+def file_sha256(path: str, block_size: int = 1 << 20) -> str:
+    """파일 내용의 SHA-256 해시(16진 문자열)를 계산합니다."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+@dataclass
+class IngestPlan:
+    """
+    이번 실행에서 처리할 작업 목록.
+
+    Attributes:
+        new: 매니페스트에 없는 파일 경로.
+        changed: 내용 해시 또는 임베딩 모델이 바뀐 파일 경로.
+        unchanged: 그대로 둘 파일 경로.
+        deleted: 매니페스트에는 있지만 더 이상 존재하지 않는 파일 경로.
+        hashes: 현재 존재하는 파일의 경로별 SHA-256.
+    """
+    new: list = field(default_factory=list)
+    changed: list = field(default_factory=list)
+    unchanged: list = field(default_factory=list)
+    deleted: list = field(default_factory=list)
+    hashes: dict = field(default_factory=dict)
+
+    @property
+    def to_ingest(self) -> list:
+        """추출·임베딩이 필요한 파일 경로 (새 파일 + 변경된 파일)."""
+        return self.new + self.changed
+
+    @property
+    def to_remove(self) -> list:
+        """
+        저장소에서 기존 행을 지워야 하는 파일 경로 (변경된 파일 + 삭제된 파일).
+        새 파일도 포함합니다. 이전 실행이 적재 도중 중단되었다면 매니페스트에 기록되지 않은
+        행이 남아 있을 수 있기 때문입니다.
+        """
+        return self.new + self.changed + self.deleted
+
+    def reprocess(self, paths: list[str]):
+        """변경 없는 파일 중 일부를 다시 처리하도록 변경된 파일로 옮깁니다 (예: 중복 원본이 사라진 파일)."""
+        targets = set(paths)
+        self.changed += [path for path in self.unchanged if path in targets]
+        self.unchanged = [path for path in self.unchanged if path not in targets]
+
+    def summary(self) -> str:
+        return (f"새 파일 {len(self.new)}개, 변경 {len(self.changed)}개, "
+                f"변경 없음 {len(self.unchanged)}개, 삭제 {len(self.deleted)}개")
+
+
+class IngestManifest:
+    """
+    경로별 인제스트 상태를 JSON 파일로 보관하는 매니페스트.
+
+    항목 형식:
+        {"source": 파일 이름, "sha256": 해시, "model": 임베딩 모델, "ids": [행 ID, ...],
+         "shards": [JSONL 샤드 이름, ...], "ingested_at": 인제스트 시각(유닉스 초)}
+    ingested_at은 메타데이터 필터(common.filters)의 업로드 날짜 조건에 쓰입니다.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == MANIFEST_VERSION:
+                self.entries = data.get("files", {})
+            else:
+                print(f"[알림] 매니페스트 버전이 달라 무시합니다 (전체 재처리): {path}")
+
+    def plan(self, paths: list[str], model: str) -> IngestPlan:
+        """
+        현재 파일 목록과 매니페스트를 비교해 이번 실행의 작업 목록을 만듭니다.
+
+        Args:
+            paths: 현재 데이터 디렉토리의 파일 경로 목록.
+            model: 이번 실행에서 사용할 임베딩 모델 이름. 모델이 바뀐 파일은 변경된 것으로 취급.
+
+        Returns:
+            IngestPlan 객체.
+        """
+        plan = IngestPlan()
+        for path in paths:
+            sha256 = file_sha256(path)
+            plan.hashes[path] = sha256
+            entry = self.entries.get(path)
+            if entry is None:
+                plan.new.append(path)
+            elif entry["sha256"] != sha256 or entry["model"] != model:
+                plan.changed.append(path)
+            else:
+                plan.unchanged.append(path)
+        current = set(paths)
+        plan.deleted = [path for path in self.entries if path not in current]
+        return plan
+
+    def sources(self, paths: list[str]) -> list[str]:
+        """경로들의 source 목록. 매니페스트에 없는 경로는 파일 이름을 source로 봅니다."""
+        return [self.entries[path]["source"] if path in self.entries else os.path.basename(path)
+                for path in paths]
+
+    def paths_for(self, sources) -> list[str]:
+        """source 목록에 해당하는 매니페스트 경로 목록."""
+        targets = set(sources)
+        return [path for path, entry in self.entries.items() if entry["source"] in targets]
+
+    def record(self, path: str, source: str, sha256: str, model: str,
+               ids: list[str], shards: list[str] = None, ingested_at: float = None):
+        """파일 하나의 인제스트 결과를 기록합니다. ingested_at을 생략하면 현재 시각."""
+        self.entries[path] = {
+            "source": source,
+            "sha256": sha256,
+            "model": model,
+            "ids": list(ids),
+            "shards": sorted(shards or []),
+            "ingested_at": int(ingested_at if ingested_at is not None else time.time()),
+        }
+
+    def forget(self, path: str):
+        """삭제된 파일의 항목을 제거합니다."""
+        self.entries.pop(path, None)
+
+    def reset(self):
+        """모든 항목을 지웁니다 (저장소를 새로 만든 경우 전체 재처리용)."""
+        self.entries = {}
+
+    def save(self):
+        """임시 파일에 쓴 뒤 교체하여, 중간에 중단되어도 매니페스트가 깨지지 않도록 저장합니다."""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": MANIFEST_VERSION, "files": self.entries}, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.path)
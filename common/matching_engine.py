@@ -0,0 +1,192 @@
+"""
+Vertex AI Matching Engine(Vector Search) 스트림 업데이트와 배포 준비 상태 확인.
+
+- 스트림 업데이트: index_update_method="STREAM_UPDATE"로 만든 인덱스는 upsert_datapoints/remove_datapoints로
+  데이터포인트를 바로 추가·삭제할 수 있어, 문서 하나를 추가할 때 contents_delta_uri 전체로 다시 빌드할 필요가
+  없고 몇 초 안에 검색됩니다 (common.sinks.MatchingEngineStreamSink가 인제스트 중에 호출).
+- 배포 준비 확인: deploy_index는 배포가 끝날 때까지(수십 분) 막히므로, request_deploy로 배포만 요청하고
+  wait_until_ready가 실제 상태(배포 작업 완료, 엔드포인트의 배포 인덱스, 프로브 검색 성공)를
+  지수 백오프 + 지터 간격으로 비동기로 확인합니다.
+"""
+import asyncio
+import os
+import random
+import time
+
+# upsert/remove 요청 하나에 담을 최대 데이터포인트 수
+UPSERT_BATCH_SIZE = int(os.getenv("ME_UPSERT_BATCH", "500"))
+# 배포 준비 확인 간격(초): 처음 간격부터 두 배씩 늘려 최대 간격까지
+READY_INITIAL_DELAY_SEC = float(os.getenv("ME_READY_INITIAL_DELAY", "5"))
+READY_MAX_DELAY_SEC = float(os.getenv("ME_READY_MAX_DELAY", "120"))
+# 배포 준비를 기다릴 최대 시간(초)
+READY_TIMEOUT_SEC = float(os.getenv("ME_READY_TIMEOUT", "1800"))
+
+
+def find_index(display_name: str):
+    """표시 이름으로 MatchingEngineIndex를 찾습니다. 없으면 None."""
+    from google.cloud import aiplatform
+
+    indexes = aiplatform.MatchingEngineIndex.list(filter=f'display_name="{display_name}"')
+    return indexes[0] if indexes else None
+
+
+def to_datapoint(row: dict):
+    """
+    Matching Engine JSONL 행({"id", "embedding", "restricts", "numeric_restricts", "crowding_tag"})을
+    IndexDatapoint로 바꿉니다.
+    """
+    from google.cloud.aiplatform_v1.types import IndexDatapoint
+
+    datapoint = IndexDatapoint(datapoint_id=str(row["id"]), feature_vector=[float(v) for v in row["embedding"]])
+    for restrict in row.get("restricts", []):
+        datapoint.restricts.append(IndexDatapoint.Restriction(
+            namespace=restrict["namespace"], allow_list=restrict.get("allow", []),
+            deny_list=restrict.get("deny", [])))
+    for restrict in row.get("numeric_restricts", []):
+        value = {key: restrict[key] for key in ("value_int", "value_float", "value_double") if key in restrict}
+        datapoint.numeric_restricts.append(IndexDatapoint.NumericRestriction(namespace=restrict["namespace"], **value))
+    if row.get("crowding_tag"):
+        datapoint.crowding_tag = IndexDatapoint.CrowdingTag(crowding_attribute=row["crowding_tag"])
+    return datapoint
+
+
+def upsert_datapoints(index, rows: list[dict], batch_size: int = UPSERT_BATCH_SIZE) -> int:
+    """
+    데이터포인트를 추가하거나 덮어씁니다 (같은 ID는 교체). STREAM_UPDATE 인덱스에서만 동작합니다.
+
+    Returns:
+        int: 보낸 데이터포인트 수.
+    """
+    for start in range(0, len(rows), batch_size):
+        index.upsert_datapoints(datapoints=[to_datapoint(row) for row in rows[start:start + batch_size]])
+    return len(rows)
+
+
+def remove_datapoints(index, ids, batch_size: int = UPSERT_BATCH_SIZE) -> int:
+    """
+    데이터포인트를 ID로 삭제합니다 (없는 ID는 무시됨).
+
+    Returns:
+        int: 삭제를 요청한 ID 수.
+    """
+    ids = [str(i) for i in ids]
+    for start in range(0, len(ids), batch_size):
+        index.remove_datapoints(datapoint_ids=ids[start:start + batch_size])
+    return len(ids)
+
+
+def request_deploy(index_endpoint, index, deployed_index_id: str, display_name: str = None):
+    """
+    인덱스 배포를 요청만 하고 바로 반환합니다 (MatchingEngineIndexEndpoint.deploy_index는 완료까지 대기).
+
+    Returns:
+        google.api_core.operation.Operation: 배포 작업. wait_until_ready(operation=...)에 넘길 수 있습니다.
+    """
+    from google.cloud.aiplatform.compat.types import index_endpoint as gca_index_endpoint
+
+    deployed_index = gca_index_endpoint.DeployedIndex(
+        id=deployed_index_id, index=index.resource_name, display_name=display_name or deployed_index_id)
+    return index_endpoint.api_client.deploy_index(index_endpoint=index_endpoint.resource_name,
+                                                  deployed_index=deployed_index)
+
+
+def deployment_state(endpoint_name: str, deployed_index_id: str, dimensions: int = None) -> dict:
+    """
+    엔드포인트의 실제 배포 상태를 확인합니다.
+
+    Args:
+        endpoint_name: 엔드포인트 리소스 이름.
+        deployed_index_id: 배포 인덱스 ID.
+        dimensions: 주어지면 영벡터로 프로브 검색을 보내 실제로 질의를 받는지 확인합니다.
+
+    Returns:
+        dict: {"deployed": 엔드포인트에 배포 인덱스가 있음, "index_sync_time": 마지막 동기화 시각,
+               "serving": 프로브 검색 성공 (dimensions가 없으면 deployed와 같음), "error": 프로브 오류 메시지}
+    """
+    from google.cloud import aiplatform
+
+    endpoint = aiplatform.MatchingEngineIndexEndpoint(endpoint_name)
+    deployed = next((di for di in endpoint.deployed_indexes if di.id == deployed_index_id), None)
+    state = {"deployed": deployed is not None, "index_sync_time": None, "serving": False, "error": None}
+    if deployed is None:
+        return state
+    if deployed.index_sync_time:
+        state["index_sync_time"] = deployed.index_sync_time.isoformat()
+    if not dimensions:
+        state["serving"] = True
+        return state
+    try:
+        endpoint.find_neighbors(deployed_index_id=deployed_index_id, queries=[[0.0] * dimensions], num_neighbors=1)
+        state["serving"] = True
+    except Exception as e:
+        state["error"] = str(e)
+    return state
+
+
+async def _poll(check, description: str, initial_delay: float, max_delay: float, timeout: float) -> bool:
+    """check()가 True를 돌려줄 때까지 지수 백오프 + 지터 간격으로 다시 확인합니다 (동기 SDK는 스레드에서 실행)."""
+    deadline = time.monotonic() + timeout
+    delay = initial_delay
+    attempt = 0
+    while True:
+        attempt += 1
+        if await asyncio.to_thread(check):
+            return True
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            print(f"[알림] {description}: {timeout:.0f}초 안에 준비되지 않았습니다.")
+            return False
+        wait = min(remaining, random.uniform(delay / 2, delay))
+        print(f"[정보] {description}: 아직 준비되지 않음 (시도 {attempt}), {wait:.0f}초 후 다시 확인")
+        await asyncio.sleep(wait)
+        delay = min(max_delay, delay * 2)
+
+
+async def wait_until_ready(endpoint_name: str, deployed_index_id: str, dimensions: int = None, operation=None,
+                           initial_delay: float = READY_INITIAL_DELAY_SEC, max_delay: float = READY_MAX_DELAY_SEC,
+                           timeout: float = READY_TIMEOUT_SEC) -> bool:
+    """
+    배포 인덱스가 실제로 질의를 받을 수 있을 때까지 기다립니다.
+
+    Args:
+        endpoint_name: 엔드포인트 리소스 이름.
+        deployed_index_id: 배포 인덱스 ID.
+        dimensions: 프로브 검색에 쓸 임베딩 차원 (None이면 배포 인덱스 존재만 확인).
+        operation: request_deploy가 돌려준 배포 작업. 주어지면 작업이 끝난 뒤에 엔드포인트를 확인하고,
+                   작업이 실패하면 그 예외를 다시 발생시킵니다.
+        initial_delay, max_delay: 확인 간격(초)의 처음 값과 최댓값.
+        timeout: 최대 대기 시간(초).
+
+    Returns:
+        bool: 준비되면 True, timeout 안에 준비되지 않으면 False.
+    """
+    def check() -> bool:
+        if operation is not None:
+            if not operation.done():
+                return False
+            if operation.exception():
+                raise operation.exception()
+        state = deployment_state(endpoint_name, deployed_index_id, dimensions)
+        if state["error"]:
+            print(f"[정보] 프로브 검색 실패: {state['error']}")
+        return state["serving"]
+
+    return await _poll(check, f"배포 인덱스 '{deployed_index_id}'", initial_delay, max_delay, timeout)
+
+
+async def wait_until_searchable(index_endpoint, deployed_index_id: str, ids: list,
+                                initial_delay: float = 1.0, max_delay: float = 10.0, timeout: float = 120.0) -> bool:
+    """
+    upsert한 데이터포인트가 배포 인덱스에서 조회될 때까지 기다립니다 (스트림 업데이트 반영 확인).
+
+    Args:
+        index_endpoint: aiplatform.MatchingEngineIndexEndpoint.
+        ids: 확인할 데이터포인트 ID 목록.
+    """
+    ids = [str(i) for i in ids]
+
+    def check() -> bool:
+        found = index_endpoint.read_index_datapoints(deployed_index_id=deployed_index_id, ids=ids)
+        return len(found) >= len(ids)
+
+    return await _poll(check, f"데이터포인트 {len(ids)}개 반영", initial_delay, max_delay, timeout)
@@ -0,0 +1,459 @@
+"""
+단계(stage)별 병렬 인제스트 파이프라인.
+
+discover → extract → chunk → embed → sink처럼 단계들을 크기가 정해진 큐로 연결합니다.
+뒤 단계(예: 쿼터에 묶인 임베딩)가 느리면 앞 단계의 큐가 가득 차서 put()이 대기하므로
+추출이 임베딩보다 앞서 나가며 메모리를 채우지 않습니다(backpressure).
+
+각 단계는 자신의 병렬도(workers)와 실행 방식을 가집니다.
+- "thread": 스레드 워커 (I/O 위주 작업, 상태를 가진 단계는 workers=1)
+- "process": 프로세스 풀 (PDF 추출처럼 CPU에 묶인 작업, fn은 pickle 가능한 최상위 함수)
+- fn이 async def이면 워커 스레드 하나에서 이벤트 루프를 돌리고 코루틴 workers개로 실행
+
+단계 함수는 입력 항목 하나를 받아 다음 단계로 넘길 출력들의 iterable(또는 None)을 반환합니다.
+"""
+import asyncio
+import inspect
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable
+
+_DONE = object()  # 입력 종료 표시
+
+
+@dataclass
+class Stage:
+    """
+    파이프라인 단계 설정.
+
+    Attributes:
+        name: 단계 이름 (지표 출력용).
+        fn: 입력 항목 하나를 받아 출력 iterable(또는 None)을 반환하는 함수. async def 가능.
+            executor="process"이면 pickle 가능한 리스트를 반환해야 합니다.
+        workers: 병렬 워커 수.
+        queue_size: 이 단계 입력 큐의 최대 크기.
+        executor: "thread" 또는 "process".
+        flush: 입력이 모두 끝난 뒤 한 번 호출되어 남은 출력을 반환하는 함수 (묶음 단계 등).
+        unit: 항목 수와 별도로 처리량을 보고할 작업 단위 이름 (예: "pages"). 비어 있으면 보고하지 않습니다.
+        count_units: 출력 하나가 담당한 작업량(예: 추출한 페이지 수)을 세는 함수.
+    """
+    name: str
+    fn: Callable
+    workers: int = 1
+    queue_size: int = 16
+    executor: str = "thread"
+    flush: Callable = None
+    unit: str = ""
+    count_units: Callable = None
+
+
+@dataclass
+class StageMetrics:
+    """단계별 처리량과 큐 깊이 지표."""
+    name: str
+    workers: int
+    queue_size: int
+    items_in: int = 0
+    items_out: int = 0
+    errors: int = 0
+    busy_sec: float = 0.0
+    elapsed_sec: float = 0.0
+    max_queue_depth: int = 0
+    depth_samples: int = 0
+    depth_total: int = 0
+    unit: str = ""
+    units: int = 0
+
+    @property
+    def throughput(self) -> float:
+        """초당 처리한 입력 항목 수."""
+        return self.items_in / self.elapsed_sec if self.elapsed_sec > 0 else 0.0
+
+    @property
+    def unit_throughput(self) -> float:
+        """초당 처리한 작업 단위 수 (예: pages/s)."""
+        return self.units / self.elapsed_sec if self.elapsed_sec > 0 else 0.0
+
+    @property
+    def avg_queue_depth(self) -> float:
+        return self.depth_total / self.depth_samples if self.depth_samples else 0.0
+
+    @property
+    def utilization(self) -> float:
+        """워커들이 실제로 일한 시간의 비율 (1에 가까우면 이 단계가 병목)."""
+        capacity = self.elapsed_sec * self.workers
+        return self.busy_sec / capacity if capacity > 0 else 0.0
+
+    def report(self) -> str:
+        units = f", {self.unit_throughput:.1f} {self.unit}/s ({self.units}개)" if self.unit else ""
+        return (f"[{self.name}] 워커 {self.workers}개, 입력 {self.items_in}개 → 출력 {self.items_out}개, "
+                f"오류 {self.errors}개, {self.throughput:.1f} items/s{units}, 가동률 {self.utilization:.0%}, "
+                f"큐 평균 {self.avg_queue_depth:.1f} / 최대 {self.max_queue_depth} (크기 {self.queue_size})")
+
+
+class Pipeline:
+    """
+    Stage 목록을 크기 제한 큐로 연결해 실행하는 파이프라인.
+
+    사용 예:
+        pipeline = Pipeline([
+            Stage("extract", run_extraction_task, workers=4, executor="process"),
+            Stage("chunk", chunk_document),
+            Stage("embed", embed_batch, workers=8),
+            Stage("sink", write_records),
+        ])
+        pipeline.run(paths)
+        print(pipeline.report())
+    """
+    def __init__(self, stages: list[Stage], on_error: Callable = None):
+        """
+        Args:
+            stages: 실행 순서대로의 단계 목록. 마지막 단계의 출력은 버립니다.
+            on_error: 단계 함수에서 예외가 나면 on_error(stage_name, item, error)를 호출.
+                기본값은 오류 메시지 출력. 예외가 난 항목은 다음 단계로 넘어가지 않습니다.
+        """
+        if not stages:
+            raise ValueError("단계가 하나 이상 필요합니다.")
+        self.stages = stages
+        self.on_error = on_error or self._print_error
+        self.metrics = [StageMetrics(s.name, s.workers, s.queue_size, unit=s.unit) for s in stages]
+        self._queues = []
+        self._locks = [threading.Lock() for _ in stages]
+        self._remaining = [s.workers for s in stages]
+        self._pools = {}
+        self._abort = threading.Event()
+        self.abort_reason = None
+        self._started = 0.0
+
+    @staticmethod
+    def _print_error(stage_name, item, error):
+        print(f"[오류] {stage_name} 단계 실패: {item!r:.80} - {error}")
+
+    def abort(self, reason: str = ""):
+        """실행을 중단합니다. 남은 항목은 처리하지 않고 버립니다 (예: 적재 실패)."""
+        self.abort_reason = reason
+        self._abort.set()
+
+    @property
+    def aborted(self) -> bool:
+        return self._abort.is_set()
+
+    def run(self, source) -> list[StageMetrics]:
+        """
+        source의 항목들을 첫 단계에 넣고 모든 단계가 끝날 때까지 기다립니다.
+
+        Returns:
+            list[StageMetrics]: 단계별 지표.
+        """
+        self._started = time.perf_counter()
+        self._queues = [queue.Queue(maxsize=s.queue_size) for s in self.stages]
+        threads = []
+        for i, stage in enumerate(self.stages):
+            if stage.executor == "process":
+                self._pools[i] = ProcessPoolExecutor(max_workers=stage.workers)
+            if inspect.iscoroutinefunction(stage.fn):
+                threads.append(threading.Thread(target=self._run_async_stage, args=(i,), daemon=True))
+            else:
+                threads.extend(threading.Thread(target=self._thread_worker, args=(i,), daemon=True)
+                               for _ in range(stage.workers))
+        for t in threads:
+            t.start()
+
+        try:
+            for item in source:
+                if self.aborted:
+                    break
+                self._queues[0].put(item)
+        finally:
+            for _ in range(self.stages[0].workers):
+                self._queues[0].put(_DONE)
+            for t in threads:
+                t.join()
+            for pool in self._pools.values():
+                pool.shutdown()
+            self._pools.clear()
+        return self.metrics
+
+    def _record_depth(self, i: int):
+        depth = self._queues[i].qsize()
+        with self._locks[i]:
+            m = self.metrics[i]
+            m.depth_samples += 1
+            m.depth_total += depth
+            m.max_queue_depth = max(m.max_queue_depth, depth)
+
+    def _call(self, i: int, item):
+        stage = self.stages[i]
+        if stage.executor == "process":
+            return self._pools[i].submit(stage.fn, item).result()
+        return stage.fn(item)
+
+    def _process(self, i: int, item, outputs_fn):
+        """항목 하나를 처리하고 (출력 목록 또는 None)을 반환합니다. outputs_fn은 실제 호출."""
+        started = time.perf_counter()
+        try:
+            outputs = list(outputs_fn() or ())
+        except Exception as e:
+            with self._locks[i]:
+                self.metrics[i].errors += 1
+            self.on_error(self.stages[i].name, item, e)
+            outputs = None
+        with self._locks[i]:
+            self.metrics[i].items_in += 1
+            self.metrics[i].busy_sec += time.perf_counter() - started
+        return outputs
+
+    def _emit(self, i: int, output):
+        count_units = self.stages[i].count_units
+        units = count_units(output) if count_units else 0
+        with self._locks[i]:
+            self.metrics[i].items_out += 1
+            self.metrics[i].units += units
+        if i + 1 < len(self.stages):
+            self._queues[i + 1].put(output)
+
+    def _thread_worker(self, i: int):
+        while True:
+            self._record_depth(i)
+            item = self._queues[i].get()
+            if item is _DONE:
+                break
+            if self.aborted:
+                continue
+            outputs = self._process(i, item, lambda: self._call(i, item))
+            for output in outputs or ():
+                self._emit(i, output)
+        self._worker_finished(i)
+
+    def _run_async_stage(self, i: int):
+        stage = self.stages[i]
+        # 큐 get/put은 블로킹이므로 코루틴 수만큼의 전용 스레드에서 기다립니다.
+        io_pool = ThreadPoolExecutor(max_workers=stage.workers * 2)
+
+        async def worker():
+            loop = asyncio.get_running_loop()
+            while True:
+                self._record_depth(i)
+                item = await loop.run_in_executor(io_pool, self._queues[i].get)
+                if item is _DONE:
+                    break
+                if self.aborted:
+                    continue
+                started = time.perf_counter()
+                try:
+                    outputs = list(await stage.fn(item) or ())
+                except Exception as e:
+                    with self._locks[i]:
+                        self.metrics[i].errors += 1
+                    self.on_error(stage.name, item, e)
+                    outputs = ()
+                with self._locks[i]:
+                    self.metrics[i].items_in += 1
+                    self.metrics[i].busy_sec += time.perf_counter() - started
+                for output in outputs:
+                    await loop.run_in_executor(io_pool, self._emit, i, output)
+
+        async def main():
+            await asyncio.gather(*(worker() for _ in range(stage.workers)))
+
+        try:
+            asyncio.run(main())
+        finally:
+            io_pool.shutdown()
+        # 코루틴 workers개가 모두 끝났으므로 한 번에 완료 처리
+        with self._locks[i]:
+            self._remaining[i] = 1
+        self._worker_finished(i)
+
+    def _worker_finished(self, i: int):
+        """단계의 마지막 워커가 끝나면 flush를 실행하고 다음 단계에 종료를 알립니다."""
+        with self._locks[i]:
+            self._remaining[i] -= 1
+            last = self._remaining[i] == 0
+        if not last:
+            return
+        stage = self.stages[i]
+        if stage.flush is not None and not self.aborted:
+            outputs = self._process(i, "<flush>", stage.flush)
+            # flush 호출은 입력 항목이 아니므로 입력 수에서 제외
+            with self._locks[i]:
+                self.metrics[i].items_in -= 1
+            for output in outputs or ():
+                self._emit(i, output)
+        self.metrics[i].elapsed_sec = time.perf_counter() - self._started
+        if i + 1 < len(self.stages):
+            for _ in range(self.stages[i + 1].workers):
+                self._queues[i + 1].put(_DONE)
+
+    def report(self) -> str:
+        lines = ["파이프라인 단계별 지표:"] + [f"  {m.report()}" for m in self.metrics]
+        if self.aborted:
+            lines.append(f"  (중단됨: {self.abort_reason})")
+        return "\n".join(lines)
+
+
+@dataclass
+class IngestResult:
+    """
+    run_ingestion 결과.
+
+    Attributes:
+        pipeline: 실행한 Pipeline (report(), aborted 확인용).
+        paths: 추출에 성공한 파일의 {source: 경로}.
+        ids_by_source: 파일별로 sink에 기록된 레코드 ID 목록.
+        failed_sources: 임베딩에 실패한 청크가 있는 파일 (다음 실행에서 다시 처리).
+            중복 제거를 쓰면, 실패한 파일의 청크를 원본으로 삼아 건너뛴 청크가 있는 파일도 포함됩니다.
+        embedded: 임베딩된 청크 수.
+        duplicates: 근접 중복으로 건너뛴 청크 수.
+        duplicate_tokens: 건너뛴 청크의 토큰 합계.
+        duplicate_text_bytes: 건너뛴 청크 본문의 UTF-8 바이트 합계.
+        dim: 임베딩 차원 (첫 응답 기준).
+        extraction: 추출 처리량 통계 (common.extraction.ExtractionStats, 파일/페이지 수와 pages/s).
+    """
+    pipeline: Pipeline
+    paths: dict
+    ids_by_source: dict
+    failed_sources: set
+    embedded: int = 0
+    duplicates: int = 0
+    duplicate_tokens: int = 0
+    duplicate_text_bytes: int = 0
+    dim: int = 0
+    extraction: object = None
+
+    def dedup_report(self, max_inputs: int = None) -> str:
+        """근접 중복 제거로 절약한 임베딩 요청 수와 인덱스 크기."""
+        from common.chunking import MAX_INPUTS_PER_REQUEST, MAX_TOKENS_PER_REQUEST
+        max_inputs = max_inputs or MAX_INPUTS_PER_REQUEST
+        saved_requests = max(-(-self.duplicates // max_inputs), -(-self.duplicate_tokens // MAX_TOKENS_PER_REQUEST))
+        vector_mb = self.duplicates * self.dim * 4 / 1024 / 1024
+        return (f"근접 중복 제거: 청크 {self.duplicates}개 건너뜀 (약 {self.duplicate_tokens} 토큰), "
+                f"임베딩 요청 약 {saved_requests}회 절약, 인덱스 벡터 {vector_mb:.2f}MB + "
+                f"본문 {self.duplicate_text_bytes / 1024 / 1024:.2f}MB 절약")
+
+
+def run_ingestion(paths: list[str], chunk_fn: Callable, embedding_client, to_records: Callable, sink,
+                  extract_workers: int = None, chunk_workers: int = 1, queue_size: int = 16,
+                  task_type: str = "RETRIEVAL_DOCUMENT", text_cache=None, dedup=None,
+                  pages_per_task: int = None) -> IngestResult:
+    """
+    discover → extract → assemble → chunk → dedup → batch → embed → sink 파이프라인으로 파일들을 인제스트합니다.
+    discover 단계에서 큰 PDF는 PAGES_PER_TASK쪽 단위 작업으로 나누므로 파일 하나도 여러 추출 프로세스가 나눠 처리하고,
+    assemble 단계가 파일별로 페이지를 모아 문서를 만듭니다.
+
+    Args:
+        paths: 인제스트할 파일 경로 (IngestPlan.to_ingest).
+        chunk_fn: ExtractedDocument를 받아 Chunk 리스트를 반환하는 함수.
+        embedding_client: common.async_embedding.AsyncEmbeddingClient.
+            embed 단계의 코루틴 수는 max_concurrency이고, 실제 동시성은 클라이언트가 쿼터에 맞춰 조절합니다.
+        to_records: (청크 묶음, 벡터 목록)을 받아 sink에 쓸 레코드 리스트를 반환하는 함수.
+        sink: BigQuerySink 또는 JsonlSink. write()가 False를 반환하거나 예외가 나면 파이프라인을 중단합니다.
+        extract_workers: 추출 프로세스 수 (None이면 CPU 코어 수).
+        pages_per_task: 추출 작업 하나가 담당할 최대 페이지 수 (None이면 EXTRACT_PAGES_PER_TASK).
+        chunk_workers: 청킹 스레드 수.
+        queue_size: 단계 사이 큐 크기.
+        task_type: 임베딩 task_type.
+        text_cache: common.text_cache.ExtractedTextCache. 주면 이미 추출한 PDF는 파싱하지 않습니다.
+        dedup: common.dedup.NearDuplicateIndex. 주면 이미 본 청크와 근접 중복인 청크는 임베딩하지 않습니다.
+            인덱스 저장은 호출한 쪽에서 합니다 (실패한 파일의 청크는 여기서 인덱스에서 제거).
+
+    Returns:
+        IngestResult
+    """
+    from common.chunking import BatchPacker
+    from common.extraction import PAGES_PER_TASK, DocumentAssembler, plan_extraction, run_extraction_task
+
+    result = IngestResult(pipeline=None, paths={}, ids_by_source={}, failed_sources=set())
+    lock = threading.Lock()
+    packer = BatchPacker()
+    extract_workers = extract_workers or os.cpu_count() or 1
+    assembler = DocumentAssembler(text_cache, workers=extract_workers)
+
+    def discover(path):
+        if not os.path.isfile(path):
+            return None
+        return plan_extraction(path, pages_per_task or PAGES_PER_TASK, text_cache)
+
+    def on_error(stage_name, item, error):
+        Pipeline._print_error(stage_name, item, error)
+        # 계획/추출에 실패한 파일은 나머지 페이지 범위가 끝나도 문서로 만들지 않음
+        if stage_name == "discover":
+            assembler.fail(item)
+        elif stage_name == "extract":
+            assembler.fail(item.path)
+
+    def chunk(doc):
+        chunks = chunk_fn(doc)
+        with lock:
+            result.paths[doc.source] = doc.path
+        print(f"[정보] 청킹 완료: {doc.source} - {len(chunks)}개 청크")
+        return chunks
+
+    def deduplicate(chunk):
+        if dedup.add(chunk.chunk_id, chunk.source, chunk.text) is None:
+            return [chunk]
+        result.duplicates += 1
+        result.duplicate_tokens += chunk.token_count
+        result.duplicate_text_bytes += len(chunk.text.encode("utf-8"))
+        return None
+
+    def batch(chunk):
+        full = packer.add(chunk)
+        return [full] if full else None
+
+    def flush_batch():
+        last = packer.flush()
+        return [last] if last else None
+
+    async def embed(chunks):
+        try:
+            vectors = await embedding_client.embed_batch([c.text for c in chunks], task_type=task_type)
+        except Exception as e:
+            print(f"[오류] 임베딩 생성 실패: {len(chunks)}개 청크 ({chunks[0].chunk_id} ~ {chunks[-1].chunk_id}) - {e}")
+            with lock:
+                result.failed_sources.update(c.source for c in chunks)
+            return None
+        result.dim = result.dim or len(vectors[0])
+        return [to_records(chunks, vectors)]
+
+    def write(records):
+        try:
+            written = sink.write(records)
+        except Exception as e:
+            print(f"[오류] 레코드 저장 실패: {len(records)}개 - {e}")
+            written = False
+        if not written:
+            result.pipeline.abort("sink 적재 실패")
+            return
+        result.embedded += len(records)
+        for record in records:
+            result.ids_by_source.setdefault(record["source"], []).append(record["id"])
+        print(f"[성공] 임베딩 저장 완료: {len(records)}개 (누적 {result.embedded}개)")
+
+    stages = [
+        Stage("discover", discover, queue_size=queue_size),
+        Stage("extract", run_extraction_task, workers=extract_workers, queue_size=queue_size, executor="process",
+              unit="pages", count_units=lambda task: 0 if task.cached else len(task.pages)),
+        # 파일별로 페이지 범위를 모으는 상태를 가지므로 워커 하나
+        Stage("assemble", assembler.add, queue_size=queue_size),
+        Stage("chunk", chunk, workers=chunk_workers, queue_size=queue_size),
+    ]
+    if dedup is not None:
+        # 인덱스 상태를 가지므로 워커 하나
+        stages.append(Stage("dedup", deduplicate, queue_size=queue_size))
+    stages += [
+        Stage("batch", batch, queue_size=queue_size, flush=flush_batch),
+        Stage("embed", embed, workers=embedding_client.max_concurrency, queue_size=queue_size),
+        Stage("sink", write, queue_size=queue_size),
+    ]
+    result.pipeline = Pipeline(stages, on_error=on_error)
+    result.pipeline.run(paths)
+    result.extraction = assembler.finish()
+    if dedup is not None and result.failed_sources:
+        # 실패한 파일의 청크는 저장되지 않았으므로 인덱스에서 빼고, 그 청크에 링크된 파일도 실패로 처리
+        result.failed_sources |= dedup.remove_sources(result.failed_sources)
+    return result
@@ -0,0 +1,301 @@
+"""
+2단계 검색: 1단계 후보 검색 뒤 재순위(rerank).
+
+벡터/하이브리드 검색의 top-3을 그대로 프롬프트에 넣으면, 질문과 표현만 비슷한 청크가 섞여도 걸러지지 않습니다.
+프롬프트를 키우지 않고 정밀도를 높이기 위해 저렴한 1단계 검색으로 후보를 넉넉히(RERANK_CANDIDATES, 기본 50개)
+가져온 뒤, 질문과 후보를 함께 보는 재순위 모델로 점수를 다시 매겨 상위 몇 개(RERANK_TOP_N)만 생성에 씁니다.
+
+재순위 모델:
+- LLMReranker: Gemini에 질문과 후보 전체를 한 번의 요청으로 보내 후보별 관련도(0~10)를 JSON으로 받음
+- CrossEncoderReranker: sentence-transformers CrossEncoder를 로컬 CPU에서 실행 (네트워크/쿼터 없음)
+
+재순위 점수는 (재순위 모델, 코퍼스 버전, 질문 해시, 청크 ID)를 키로 SQLite에 저장하여
+같은 질문의 같은 후보는 다시 채점하지 않고, 재순위 지연 시간은 1단계 검색과 따로 집계합니다.
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import replace
+
+from common.retrievers import Hit
+
+# 재순위 방식: "none", "llm", "cross_encoder"
+DEFAULT_RERANKER = os.getenv("RERANK", "none")
+# 1단계 검색 후보 수와 재순위 후 생성에 넘길 수
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "50"))
+RERANK_TOP_N = int(os.getenv("RERANK_TOP_N", "3"))
+# LLM 재순위 모델과 후보 하나당 프롬프트에 넣을 최대 글자 수
+RERANK_LLM_MODEL = os.getenv("RERANK_LLM_MODEL", "gemini-2.0-flash-lite-001")
+RERANK_MAX_CHARS = int(os.getenv("RERANK_MAX_CHARS", "1500"))
+# 로컬 cross-encoder 모델 (한국어를 포함한 다국어 MS MARCO 학습 모델)
+CROSS_ENCODER_MODEL = os.getenv("RERANK_CROSS_ENCODER_MODEL", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1")
+# 재순위 점수 캐시 위치와 최대 항목 수
+DEFAULT_RERANK_CACHE_PATH = os.getenv(
+    "RERANK_CACHE_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "notebooklm", "rerank.sqlite3"),
+)
+DEFAULT_RERANK_CACHE_MAX_ENTRIES = int(os.getenv("RERANK_CACHE_MAX_ENTRIES", "200000"))
+
+
+def query_hash(query: str) -> str:
+    """질문 텍스트의 SHA-256 (앞뒤 공백 제거)."""
+    return hashlib.sha256(query.strip().encode("utf-8")).hexdigest()
+
+
+class RerankCache:
+    """
+    (재순위 모델, 코퍼스 버전, 질문 해시, 청크 ID) → 재순위 점수 SQLite 캐시 (여러 스레드에서 함께 사용해도 안전).
+    max_entries를 넘으면 가장 오래 사용하지 않은 항목부터 지웁니다(LRU).
+    """
+    def __init__(self, path: str = DEFAULT_RERANK_CACHE_PATH, max_entries: int = DEFAULT_RERANK_CACHE_MAX_ENTRIES):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS scores ("
+            " key TEXT PRIMARY KEY, score REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_scores_last_access ON scores(last_access)")
+        self._conn.commit()
+
+    @staticmethod
+    def key(reranker: str, version: str, query: str, chunk_id) -> str:
+        return f"{reranker}|{version}|{query_hash(query)}|{chunk_id}"
+
+    def get_many(self, keys: list[str]) -> dict:
+        """캐시에 있는 키 → 점수."""
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        with self._lock:
+            for i in range(0, len(unique_keys), 500):
+                part = unique_keys[i:i + 500]
+                placeholders = ",".join("?" * len(part))
+                found.update(self._conn.execute(
+                    f"SELECT key, score FROM scores WHERE key IN ({placeholders})", part).fetchall())
+            if found:
+                now = time.time()
+                self._conn.executemany("UPDATE scores SET last_access = ? WHERE key = ?", [(now, k) for k in found])
+                self._conn.commit()
+            self.hits += sum(1 for k in keys if k in found)
+            self.misses += sum(1 for k in keys if k not in found)
+        return found
+
+    def put_many(self, items: dict):
+        """키 → 점수 항목들을 저장하고 필요하면 오래된 항목을 정리합니다."""
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO scores (key, score, last_access) VALUES (?, ?, ?)",
+                                   [(key, float(score), now) for key, score in items.items()])
+            count = self._conn.execute("SELECT COUNT(*) FROM scores").fetchone()[0]
+            if count > self.max_entries:
+                # 상한의 90%까지 줄여 매 삽입마다 정리가 반복되지 않도록 함
+                self._conn.execute(
+                    "DELETE FROM scores WHERE key IN (SELECT key FROM scores ORDER BY last_access LIMIT ?)",
+                    (count - int(self.max_entries * 0.9),))
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class LLMReranker:
+    """
+    Gemini 재순위: 질문과 후보 목록을 한 번의 generate_content 요청으로 보내 후보별 관련도(0~10)를 받습니다.
+    후보 50개를 하나씩 채점하면 요청이 50번이지만, 여기서는 질문당 요청 한 번입니다.
+    """
+    def __init__(self, model_name: str = RERANK_LLM_MODEL, max_chars: int = RERANK_MAX_CHARS):
+        """
+        Args:
+            model_name: 생성 모델 이름 (vertexai.init 이후 사용).
+            max_chars: 후보 하나당 프롬프트에 넣을 최대 글자 수.
+        """
+        self.model_name = model_name
+        self.max_chars = max_chars
+        self.name = f"llm:{model_name}"
+        self._model = None
+
+    def _prompt(self, query: str, texts: list[str]) -> str:
+        passages = "\n\n".join(f"[{i}] {' '.join(text.split())[:self.max_chars]}" for i, text in enumerate(texts))
+        return ("다음 질문에 답하는 데 각 문서가 얼마나 관련 있는지 0~10점으로 평가하세요. "
+                "10은 질문에 직접 답하는 문서, 0은 관련 없는 문서입니다.\n"
+                f'모든 문서에 대해 [{{"index": 번호, "score": 점수}}, ...] 형식의 JSON 배열만 출력하세요.\n\n'
+                f"질문: {query}\n\n문서:\n{passages}")
+
+    @staticmethod
+    def _parse(text: str, count: int) -> list:
+        """응답 JSON에서 후보별 점수를 읽습니다. 빠진 후보는 None."""
+        match = re.search(r"\[.*\]", text or "", re.S)
+        scores = [None] * count
+        if not match:
+            return scores
+        try:
+            items = json.loads(match.group(0))
+        except ValueError:
+            return scores
+        for position, item in enumerate(items):
+            if isinstance(item, dict):
+                index, score = item.get("index", position), item.get("score")
+            else:
+                index, score = position, item
+            if isinstance(index, int) and 0 <= index < count and isinstance(score, (int, float)):
+                scores[index] = float(score)
+        return scores
+
+    def score(self, query: str, texts: list[str]) -> list:
+        if not texts:
+            return []
+        if self._model is None:
+            from vertexai.generative_models import GenerationConfig, GenerativeModel
+
+            self._model = GenerativeModel(self.model_name)
+            self._config = GenerationConfig(temperature=0, response_mime_type="application/json")
+        response = self._model.generate_content(self._prompt(query, texts), generation_config=self._config)
+        return self._parse(response.text, len(texts))
+
+
+class CrossEncoderReranker:
+    """로컬 CPU cross-encoder 재순위 (sentence-transformers). 모델은 처음 채점할 때 한 번 불러옵니다."""
+    def __init__(self, model_name: str = CROSS_ENCODER_MODEL, batch_size: int = 16, max_length: int = 512):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.name = f"cross_encoder:{model_name}"
+        self._model = None
+
+    def score(self, query: str, texts: list[str]) -> list:
+        if not texts:
+            return []
+        if self._model is None:
+            try:
+                from sentence_transformers import CrossEncoder
+            except ImportError as e:
+                raise ImportError("cross_encoder 재순위에는 sentence-transformers 패키지가 필요합니다 "
+                                  "(pip install sentence-transformers).") from e
+            self._model = CrossEncoder(self.model_name, max_length=self.max_length, device="cpu")
+        scores = self._model.predict([(query, text) for text in texts], batch_size=self.batch_size,
+                                     show_progress_bar=False)
+        return [float(s) for s in scores]
+
+
+RERANKERS = {"llm": LLMReranker, "cross_encoder": CrossEncoderReranker}
+
+
+class TwoStageReranker:
+    """
+    1단계 후보(Hit 목록)를 재순위 모델로 다시 채점하여 상위 top_n개를 돌려줍니다.
+
+    사용 예:
+        reranker = TwoStageReranker(LLMReranker(), RerankCache())
+        hits = reranker.rerank(question, candidates, version=corpus_version)
+        print(reranker.report())   # 재순위 지연 시간, 캐시 적중
+    """
+    def __init__(self, scorer, cache: RerankCache = None, top_n: int = RERANK_TOP_N):
+        """
+        Args:
+            scorer: score(query, texts) -> 점수 목록을 제공하는 재순위 모델 (LLMReranker, CrossEncoderReranker).
+            cache: RerankCache. None이면 캐시하지 않습니다.
+            top_n: 재순위 후 남길 후보 수.
+        """
+        self.scorer = scorer
+        self.cache = cache
+        self.top_n = top_n
+        self.calls = 0
+        self.scored = 0
+        self.cached = 0
+        self.rerank_sec = 0.0
+        self.last_sec = 0.0
+
+    def rerank(self, query: str, hits: list[Hit], top_n: int = None, version: str = "") -> list[Hit]:
+        """
+        Returns:
+            list[Hit]: 재순위 점수 내림차순 상위 top_n개. score는 재순위 점수이고,
+                       1단계 점수와 순위는 metadata["first_stage_score"], ["first_stage_rank"]에 남깁니다.
+                       본문이 없거나 채점되지 않은 후보는 1단계 순서대로 뒤에 둡니다.
+        """
+        started = time.perf_counter()
+        top_n = top_n or self.top_n
+        keys = [RerankCache.key(self.scorer.name, version, query, hit.id) for hit in hits]
+        scores = self.cache.get_many(keys) if self.cache else {}
+        self.cached += len(scores)
+        missing = [i for i, (hit, key) in enumerate(zip(hits, keys)) if key not in scores and hit.text]
+        if missing:
+            # 캐시에 없는 후보만 한 번에 채점
+            new_scores = self.scorer.score(query, [hits[i].text for i in missing])
+            fresh = {keys[i]: s for i, s in zip(missing, new_scores) if s is not None}
+            scores.update(fresh)
+            if self.cache:
+                self.cache.put_many(fresh)
+            self.calls += 1
+            self.scored += len(missing)
+        ranked = sorted(range(len(hits)), key=lambda i: (keys[i] not in scores, -scores.get(keys[i], 0.0), i))
+        results = [replace(hits[i], score=scores.get(keys[i], float("-inf")),
+                           metadata={**hits[i].metadata, "first_stage_score": hits[i].score, "first_stage_rank": i})
+                   for i in ranked[:top_n]]
+        self.last_sec = time.perf_counter() - started
+        self.rerank_sec += self.last_sec
+        return results
+
+    def stats(self) -> dict:
+        return {"reranker": self.scorer.name, "calls": self.calls, "scored": self.scored, "cached": self.cached,
+                "rerank_sec": self.rerank_sec, "last_sec": self.last_sec}
+
+    def report(self) -> str:
+        s = self.stats()
+        return (f"재순위({s['reranker']}): 마지막 {s['last_sec'] * 1000:.0f}ms, 누적 {s['rerank_sec']:.2f}초, "
+                f"채점 요청 {s['calls']}회 ({s['scored']}개 후보), 캐시 적중 {s['cached']}개")
+
+
+def create_reranker(kind: str = DEFAULT_RERANKER, cache_path: str = DEFAULT_RERANK_CACHE_PATH,
+                    top_n: int = RERANK_TOP_N, **kwargs):
+    """
+    이름으로 재순위기를 만듭니다. kind가 "none"이거나 비어 있으면 None.
+
+    Args:
+        kind: "llm" 또는 "cross_encoder".
+        cache_path: 재순위 점수 캐시 경로. None이면 캐시하지 않습니다.
+        kwargs: 재순위 모델 생성자 인자 (예: model_name).
+    """
+    if not kind or kind == "none":
+        return None
+    if kind not in RERANKERS:
+        raise ValueError(f"지원하지 않는 재순위 방식입니다: {kind} (가능: none, {', '.join(RERANKERS)})")
+    return TwoStageReranker(RERANKERS[kind](**kwargs), RerankCache(cache_path) if cache_path else None, top_n=top_n)
+
+
+class RerankingRetriever:
+    """
+    텍스트 질의 Retriever를 2단계 검색으로 감쌉니다: 후보 candidates개를 검색한 뒤 재순위하여 k개를 돌려줍니다.
+    (벡터 백엔드는 TextRetriever로 감싼 뒤 사용)
+    """
+    input_kind = "text"
+
+    def __init__(self, retriever, reranker: TwoStageReranker, candidates: int = RERANK_CANDIDATES,
+                 version: str = ""):
+        self.retriever = retriever
+        self.reranker = reranker
+        self.candidates = candidates
+        self.version = version
+        self.name = f"{retriever.name}+rerank"
+        self.retrieve_sec = 0.0
+
+    def search(self, queries, k: int = 10, filters: dict = None) -> list[list[Hit]]:
+        queries = list(queries)
+        started = time.perf_counter()
+        candidates = self.retriever.search(queries, k=max(k, self.candidates), filters=filters)
+        self.retrieve_sec += time.perf_counter() - started
+        return [self.reranker.rerank(query, hits, top_n=k, version=self.version)
+                for query, hits in zip(queries, candidates)]
@@ -0,0 +1,346 @@
+"""
+검색 백엔드 공통 인터페이스(Retriever).
+
+지금까지 검색은 chap5/bigquery.py(메모리 행렬), chap6/bigquery6.py·chap11/qa_agent.py(BigQuery),
+chap6/faiss_search.py(FAISS), chap6/vertex_ai_matching_engine.py(find_neighbors), rag.py(rag.retrieval_query)에서
+각자 다른 결과 형식으로 구현되어 있었습니다. 여기의 어댑터는 모두 같은 메서드
+
+    search(queries, k=10, filters=None) -> list[list[Hit]]
+
+를 제공하므로 노트북(테넌트)마다 백엔드를 바꾸거나, 같은 입력으로 백엔드끼리 성능을 비교할 수 있습니다.
+
+- queries: 질의 목록. input_kind가 "vector"인 백엔드는 임베딩 벡터, "text"인 백엔드(RagEngineRetriever)는 텍스트.
+  벡터 백엔드를 텍스트로 검색하려면 TextRetriever로 감쌉니다.
+- 결과: 질의 순서대로 점수 내림차순 Hit 리스트. score는 클수록 유사합니다 (코사인 유사도 또는 내적).
+- filters: {메타데이터 열: 조건} 형태의 필터 (형식은 common.filters 참고). 검색 안에서 적용되어
+  조건을 만족하는 행 중 top-k를 돌려줍니다. 지원하지 않는 백엔드는 ValueError.
+
+NumpyRetriever는 네트워크 없이 동작하므로 오프라인 테스트와 벤치마크의 기준(정확 검색)으로 씁니다.
+"""
+import os
+from dataclasses import dataclass, field
+from typing import Protocol
+
+import numpy as np
+
+from common.filters import MetadataTable, to_faiss_params, to_matching_engine
+from common.vector_search import InMemoryVectorIndex, normalize_rows
+
+# 필터로 고른 행이 이 수 이하면 FAISS 인덱스를 거치지 않고 그 행들만 정확 검색 (선택도가 높을수록 저렴)
+FILTER_EXACT_MAX_ROWS = int(os.getenv("FILTER_EXACT_MAX_ROWS", "20000"))
+
+
+@dataclass
+class Hit:
+    """
+    검색 결과 하나.
+
+    Attributes:
+        id: 청크 ID.
+        score: 유사도 점수 (클수록 유사함).
+        text: 청크 본문. 백엔드가 본문을 돌려주지 않으면 None.
+        metadata: 백엔드가 함께 돌려준 그 밖의 열.
+    """
+    id: str
+    score: float
+    text: str = None
+    metadata: dict = field(default_factory=dict)
+
+
+class Retriever(Protocol):
+    """모든 검색 백엔드가 제공하는 인터페이스."""
+    name: str
+    input_kind: str  # "vector" 또는 "text"
+
+    def search(self, queries, k: int = 10, filters: dict = None) -> list[list[Hit]]:
+        ...
+
+
+def _reject_filters(name: str, filters: dict):
+    if filters:
+        raise ValueError(f"{name} 백엔드는 메타데이터 필터를 지원하지 않습니다: {sorted(filters)}")
+
+
+class NumpyRetriever:
+    """
+    메모리 내 NumPy 정확 검색 백엔드 (오프라인, InMemoryVectorIndex 기반).
+
+    filters는 metadata 열로 허용 행 비트맵을 먼저 만든 뒤 그 행들만 점수를 매깁니다.
+    """
+    name = "numpy"
+    input_kind = "vector"
+
+    def __init__(self, index: InMemoryVectorIndex, texts: dict = None, metadata: dict = None):
+        """
+        Args:
+            index: InMemoryVectorIndex.
+            texts: {ID: 본문}. 주어지면 Hit.text를 채웁니다.
+            metadata: common.filters.MetadataTable 또는 {열 이름: index.ids 순서의 값 목록}. filters에 사용합니다.
+        """
+        self.index = index
+        self.texts = texts or {}
+        if metadata is not None and not isinstance(metadata, MetadataTable):
+            metadata = MetadataTable(index.ids, metadata)
+        self.metadata = metadata
+
+    @classmethod
+    def from_arrays(cls, ids: list, matrix, texts: dict = None, metadata: dict = None) -> "NumpyRetriever":
+        return cls(InMemoryVectorIndex(ids, matrix), texts=texts, metadata=metadata)
+
+    def _hit(self, doc_id, score: float) -> Hit:
+        return Hit(doc_id, score, self.texts.get(doc_id))
+
+    def search(self, queries, k: int = 10, filters: dict = None) -> list[list[Hit]]:
+        rows = None
+        if filters:
+            if self.metadata is None:
+                raise ValueError("메타데이터 테이블 없이 필터를 적용할 수 없습니다.")
+            rows = self.metadata.rows(filters)
+        return [[self._hit(doc_id, score) for doc_id, score in results]
+                for results in self.index.search_batch(queries, k, rows=rows)]
+
+
+class FaissRetriever:
+    """
+    FAISS 인덱스 백엔드 (common.faiss_index로 빌드/로드한 내적 인덱스).
+
+    filters는 metadata로 행 비트맵을 만든 뒤, 고른 행이 exact_max_rows개 이하면 그 행의 벡터만 꺼내 정확 검색하고,
+    더 많으면 IDSelectorBitmap으로 인덱스 검색 안에서 고른 행만 거리를 계산합니다.
+    """
+    name = "faiss"
+    input_kind = "vector"
+
+    def __init__(self, index, ids: list, texts: dict = None, normalize: bool = True,
+                 metadata: MetadataTable = None, exact_max_rows: int = FILTER_EXACT_MAX_ROWS):
+        """
+        Args:
+            index: faiss.Index (METRIC_INNER_PRODUCT).
+            ids: 인덱스 행 순서의 ID 목록.
+            texts: {ID: 본문}. 주어지면 Hit.text를 채웁니다.
+            normalize: True면 질의를 L2 정규화하여 점수를 코사인 유사도로 맞춥니다.
+            metadata: 인덱스 행 순서의 common.filters.MetadataTable. filters에 사용합니다.
+            exact_max_rows: 필터로 고른 행이 이 수 이하면 정확 검색으로 바꿉니다 (0이면 항상 인덱스 검색).
+        """
+        self.index = index
+        self.ids = list(ids)
+        self.texts = texts or {}
+        self.normalize = normalize
+        self.metadata = metadata
+        self.exact_max_rows = exact_max_rows
+
+    @classmethod
+    def from_snapshot(cls, directory: str, texts: dict = None, mmap: bool = True, metadata: MetadataTable = None):
+        """common.faiss_index 스냅샷 디렉토리에서 만듭니다. 스냅샷이 없으면 None."""
+        from common.faiss_index import load_index_snapshot
+
+        loaded = load_index_snapshot(directory, mmap=mmap)
+        if not loaded:
+            return None
+        return cls(loaded[0], loaded[1], texts=texts, metadata=metadata)
+
+    def _hits(self, distances, indices) -> list[list[Hit]]:
+        # IVF/HNSW는 탐색 범위가 좁으면 k개보다 적게 찾아 -1을 돌려줌
+        return [[Hit(self.ids[i], float(d), self.texts.get(self.ids[i])) for d, i in zip(row_d, row_i) if i != -1]
+                for row_d, row_i in zip(distances, indices)]
+
+    def _exact_search(self, q: np.ndarray, rows: np.ndarray, k: int):
+        """고른 행의 벡터만 꺼내 정확 검색합니다. 벡터를 복원할 수 없는 인덱스(IVF 등)면 None."""
+        try:
+            vectors = self.index.reconstruct_batch(rows)
+        except RuntimeError:
+            return None
+        scores = q @ vectors.T
+        top = np.argsort(-scores, axis=1)[:, :k]
+        return np.take_along_axis(scores, top, axis=1), rows[top]
+
+    def search(self, queries, k: int = 10, filters: dict = None) -> list[list[Hit]]:
+        q = np.array(queries, dtype=np.float32, ndmin=2)
+        if self.normalize:
+            q = normalize_rows(q)
+        if filters:
+            if self.metadata is None:
+                raise ValueError("메타데이터 테이블 없이 필터를 적용할 수 없습니다.")
+            mask = self.metadata.mask(filters)
+            rows = np.flatnonzero(mask)
+            if len(rows) == 0:
+                return [[] for _ in range(len(q))]
+            if len(rows) <= self.exact_max_rows:
+                exact = self._exact_search(q, rows, k)
+                if exact is not None:
+                    return self._hits(*exact)
+            distances, indices = self.index.search(q, k, params=to_faiss_params(self.index, mask))
+            return self._hits(distances, indices)
+        distances, indices = self.index.search(q, k)
+        return self._hits(distances, indices)
+
+
+class BigQueryRetriever:
+    """
+    BigQuery 임베딩 테이블 백엔드 (common.bq_search: 전체 스캔 또는 VECTOR_SEARCH).
+
+    filters는 WHERE 절로 바꾸어 거리 계산 앞에서 행을 거릅니다. 테이블에 없는 열(예: ingested_at)의 조건은
+    metadata(MetadataTable)로 source 목록 조건으로 바꾸어 넘깁니다.
+    """
+    name = "bigquery"
+    input_kind = "vector"
+
+    def __init__(self, client, table: str, text_column: str = "content", columns=("id", "content"),
+                 mode: str = None, metadata: MetadataTable = None, **search_kwargs):
+        """
+        Args:
+            client: bigquery.Client.
+            table: "project.dataset.table" 형식의 테이블 ID.
+            text_column: Hit.text로 쓸 열.
+            columns: 함께 가져올 열 ("id" 포함). 나머지 열은 Hit.metadata에 들어갑니다.
+            mode: "brute_force" 또는 "vector_index". None이면 BQ_SEARCH_MODE 기본값.
+            metadata: 테이블에 없는 열의 필터를 source 조건으로 바꿀 MetadataTable (예: MetadataTable.from_manifest).
+            search_kwargs: common.bq_search.search_vectors에 넘길 그 밖의 인자.
+        """
+        from common.bq_search import DEFAULT_SEARCH_MODE
+
+        self.client = client
+        self.table = table
+        self.text_column = text_column
+        self.columns = tuple(columns)
+        self.mode = mode or DEFAULT_SEARCH_MODE
+        self.metadata = metadata
+        self.search_kwargs = search_kwargs
+
+    def search(self, queries, k: int = 10, filters: dict = None) -> list[list[Hit]]:
+        from common.bq_search import search_vectors
+
+        if filters and self.metadata is not None:
+            filters = self.metadata.to_source_filter(filters)
+        results = search_vectors(self.client, self.table, queries, top_k=k, columns=self.columns,
+                                 mode=self.mode, filters=filters, **self.search_kwargs)
+        return [[Hit(row["id"], row["cosine_sim"], row.get(self.text_column),
+                     {col: row[col] for col in self.columns if col not in ("id", self.text_column)})
+                 for row in rows]
+                for rows in results]
+
+
+class MatchingEngineRetriever:
+    """
+    Vertex AI Matching Engine(Vector Search) 배포 인덱스 백엔드 (find_neighbors).
+
+    filters는 Matching Engine의 restricts(Namespace allow 토큰)와 numeric restricts로 바꾸어 서버에서 적용합니다.
+    (인덱스의 데이터 포인트에 같은 네임스페이스가 기록되어 있어야 함: JsonlSink의 restrict_fields/numeric_restrict_fields)
+    """
+    name = "matching_engine"
+    input_kind = "vector"
+
+    def __init__(self, index_endpoint, deployed_index_id: str, texts: dict = None):
+        """
+        Args:
+            index_endpoint: aiplatform.MatchingEngineIndexEndpoint.
+            deployed_index_id: 배포된 인덱스 ID.
+            texts: {ID: 본문}. 주어지면 Hit.text를 채웁니다.
+        """
+        self.index_endpoint = index_endpoint
+        self.deployed_index_id = deployed_index_id
+        self.texts = texts or {}
+
+    def search(self, queries, k: int = 10, filters: dict = None) -> list[list[Hit]]:
+        kwargs = {}
+        if filters:
+            namespaces, numeric = to_matching_engine(filters)
+            if namespaces:
+                kwargs["filter"] = namespaces
+            if numeric:
+                kwargs["numeric_filter"] = numeric
+        response = self.index_endpoint.find_neighbors(
+            deployed_index_id=self.deployed_index_id,
+            queries=[list(map(float, q)) for q in queries],
+            num_neighbors=k,
+            **kwargs,
+        )
+        # DOT_PRODUCT_DISTANCE 인덱스의 distance는 내적값 (클수록 유사함)
+        return [[Hit(n.id, float(n.distance), self.texts.get(n.id)) for n in neighbors]
+                for neighbors in response]
+
+
+def _proto_field(message, name: str):
+    """proto 메시지에서 설정된 필드 값. 필드가 없거나 설정되지 않았으면 None."""
+    try:
+        return getattr(message, name) if name in message else None
+    except (AttributeError, KeyError, ValueError):
+        # 이 SDK 버전의 메시지에 없는 필드
+        return None
+
+
+class RagEngineRetriever:
+    """Vertex AI RAG Engine 코퍼스 백엔드 (rag.retrieval_query). 질의는 텍스트입니다."""
+    name = "rag_engine"
+    input_kind = "text"
+
+    def __init__(self, corpus_name: str):
+        """
+        Args:
+            corpus_name: RAG 코퍼스 리소스 이름 (projects/.../ragCorpora/...).
+        """
+        self.corpus_name = corpus_name
+
+    def search(self, queries, k: int = 10, filters: dict = None) -> list[list[Hit]]:
+        from vertexai.preview import rag
+
+        _reject_filters(self.name, filters)
+        results = []
+        for text in queries:
+            # retrieval_query는 질의 하나씩만 받음
+            response = rag.retrieval_query(
+                rag_resources=[rag.RagResource(rag_corpus=self.corpus_name)],
+                text=text,
+                rag_retrieval_config=rag.RagRetrievalConfig(top_k=k),
+            )
+            hits = []
+            for rank, ctx in enumerate(response.contexts.contexts):
+                # SDK 버전에 따라 score(클수록 유사) 또는 distance(작을수록 유사)만 있음.
+                # proto 필드는 설정되지 않아도 0.0을 돌려주므로 설정 여부를 확인하고, 둘 다 없으면 순위로 점수를 매김
+                score = _proto_field(ctx, "score")
+                if score is None:
+                    distance = _proto_field(ctx, "distance")
+                    score = -float(distance if distance is not None else rank)
+                hits.append(Hit(f"{ctx.source_uri}#{rank}", float(score), ctx.text,
+                                {"source_uri": ctx.source_uri}))
+            results.append(hits)
+        return results
+
+
+class TextRetriever:
+    """벡터 백엔드를 텍스트 질의로 검색하도록 감쌉니다 (질의를 한 번에 임베딩)."""
+    input_kind = "text"
+
+    def __init__(self, retriever: Retriever, embedding_service, task_type: str = "RETRIEVAL_QUERY"):
+        """
+        Args:
+            retriever: input_kind가 "vector"인 Retriever.
+            embedding_service: common.embedding.EmbeddingService.
+            task_type: 질의 임베딩 작업 유형.
+        """
+        self.retriever = retriever
+        self.embedding_service = embedding_service
+        self.task_type = task_type
+        self.name = retriever.name
+
+    def search(self, queries, k: int = 10, filters: dict = None) -> list[list[Hit]]:
+        vectors = self.embedding_service.embed(list(queries), task_type=self.task_type)
+        return self.retriever.search(vectors, k=k, filters=filters)
+
+
+RETRIEVERS = {
+    cls.name: cls for cls in (NumpyRetriever, FaissRetriever, BigQueryRetriever, MatchingEngineRetriever,
+                              RagEngineRetriever)
+}
+
+
+def create_retriever(backend: str, **kwargs) -> Retriever:
+    """
+    이름으로 백엔드를 만듭니다 (노트북/테넌트 설정에서 백엔드를 고를 때).
+
+    Args:
+        backend: "numpy", "faiss", "bigquery", "matching_engine", "rag_engine".
+        kwargs: 해당 어댑터의 생성자 인자.
+    """
+    if backend not in RETRIEVERS:
+        raise ValueError(f"지원하지 않는 검색 백엔드입니다: {backend} (가능: {', '.join(RETRIEVERS)})")
+    return RETRIEVERS[backend](**kwargs)
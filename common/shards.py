@@ -0,0 +1,246 @@
+"""
+노트북(notebook)별 인덱스 샤드와 메모리 예산 LRU 샤드 풀.
+
+NotebookLM처럼 사용자의 노트북마다 원본 파일(source) 묶음이 따로 있으므로, 질의마다 전체
+book_data.embeddings 테이블이나 전역 FAISS 인덱스를 검색할 필요가 없습니다.
+
+- NotebookRegistry: 노트북 ID → source 목록 (JSON 파일, 인제스트 스크립트가 NOTEBOOK_ID로 기록)
+- BigQueryShardLoader: 노트북의 source 행만 읽어 작은 InMemoryVectorIndex(샤드)를 만들고,
+  embedding_matrix 형식으로 로컬에 저장해 두었다가 source 목록/코퍼스 버전이 같으면 디스크에서 바로 읽음.
+  근접 중복 제거로 다른 노트북 파일의 원본 행에 링크만 남긴 청크는 그 원본 행을 함께 읽어 채움
+- NotebookShardPool: 샤드를 필요할 때 불러오고, 전체 크기가 memory_budget_mb를 넘으면
+  가장 오래 쓰지 않은 샤드부터 내림 (LRU)
+
+질의는 해당 노트북의 샤드만 훑으므로 지연 시간은 전체 테넌트 데이터가 아니라 노트북 크기에 비례합니다.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from google.cloud import bigquery
+
+from common.embedding_matrix import MatrixWriter
+from common.vector_search import InMemoryVectorIndex
+
+# 노트북 → source 목록 파일
+DEFAULT_NOTEBOOKS_PATH = os.getenv("NOTEBOOKS_PATH", os.path.join("output_embeddings", "notebooks.json"))
+# 노트북 샤드 로컬 캐시 디렉토리
+DEFAULT_SHARD_DIR = os.getenv("NOTEBOOK_SHARD_DIR", os.path.join("output_embeddings", "notebook_shards"))
+# 메모리에 올려 둘 샤드 전체 크기 상한(MB)
+DEFAULT_MEMORY_BUDGET_MB = float(os.getenv("NOTEBOOK_SHARD_BUDGET_MB", "512"))
+# ID 하나당 메모리 추정치(바이트): 파이썬 문자열 + 리스트/딕셔너리 항목
+ID_OVERHEAD_BYTES = 120
+
+
+class NotebookRegistry:
+    """노트북 ID별 source(원본 파일 이름) 목록을 JSON 파일로 보관합니다."""
+    def __init__(self, path: str = DEFAULT_NOTEBOOKS_PATH):
+        self.path = path
+        self.notebooks = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.notebooks = json.load(f).get("notebooks", {})
+
+    def sources(self, notebook_id: str) -> list[str]:
+        """노트북의 source 목록. 등록되지 않은 노트북이면 빈 리스트."""
+        return list(self.notebooks.get(notebook_id, []))
+
+    def set_sources(self, notebook_id: str, sources):
+        self.notebooks[notebook_id] = sorted(set(sources))
+
+    def save(self):
+        """임시 파일에 쓴 뒤 교체합니다."""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"notebooks": self.notebooks}, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.path)
+
+
+def shard_version(sources, corpus_version: str = "", linked_ids=()) -> str:
+    """source 목록, 코퍼스 버전, 링크된 원본 행 ID로 만든 샤드 버전 (하나라도 바뀌면 샤드를 다시 만듦)."""
+    payload = json.dumps({"sources": sorted(sources), "corpus": corpus_version, "linked": sorted(linked_ids)},
+                         ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def shard_nbytes(index: InMemoryVectorIndex) -> int:
+    """샤드가 차지하는 메모리 추정치 (행렬 + ID)."""
+    return index.matrix.nbytes + len(index.ids) * ID_OVERHEAD_BYTES
+
+
+class BigQueryShardLoader:
+    """
+    노트북 샤드 로더: 로컬 캐시 → BigQuery(노트북 source 행만 쿼리) 순서로 샤드를 만듭니다.
+
+    NotebookShardPool(loader=BigQueryShardLoader(...))처럼 호출 가능한 객체로 넘깁니다.
+    """
+    def __init__(self, client: bigquery.Client, table: str, registry: NotebookRegistry,
+                 cache_dir: str = DEFAULT_SHARD_DIR, corpus_version: str = "", linked_sources: dict = None,
+                 model: str = ""):
+        """
+        Args:
+            client: bigquery.Client.
+            table: 임베딩 테이블 ID.
+            registry: NotebookRegistry.
+            cache_dir: 샤드를 저장할 로컬 디렉토리. None이면 저장하지 않음.
+            corpus_version: 테이블 버전 문자열 (테이블이 바뀌면 캐시된 샤드를 다시 만듦).
+            linked_sources: 근접 중복 링크 {원본 청크 ID: 링크한 source 목록} (common.dedup.load_linked_sources).
+                노트북 source가 링크한 원본 행은 다른 source의 행이어도 샤드에 넣습니다.
+            model: 테이블의 임베딩 모델 이름 (저장하는 샤드 행렬 헤더의 model 항목).
+        """
+        self.client = client
+        self.table = table
+        self.registry = registry
+        self.cache_dir = cache_dir
+        self.corpus_version = corpus_version
+        self.linked_sources = linked_sources or {}
+        self.model = model
+
+    def _prefix(self, notebook_id: str) -> str:
+        safe = re.sub(r"[^0-9A-Za-z_.-]", "_", notebook_id)
+        return os.path.join(self.cache_dir, safe, "embeddings")
+
+    def __call__(self, notebook_id: str) -> InMemoryVectorIndex:
+        sources = self.registry.sources(notebook_id)
+        if not sources:
+            raise KeyError(f"등록되지 않은 노트북입니다: {notebook_id}")
+        source_set = set(sources)
+        linked_ids = sorted(canonical for canonical, linked in self.linked_sources.items() if source_set & set(linked))
+        version = shard_version(sources, self.corpus_version, linked_ids)
+        prefix = self._prefix(notebook_id) if self.cache_dir else None
+        if prefix and os.path.exists(prefix + ".header.json"):
+            with open(prefix + ".header.json", "r", encoding="utf-8") as f:
+                if json.load(f).get("shard_version") == version:
+                    return InMemoryVectorIndex.from_matrix(prefix)
+
+        sql = f"SELECT id, embedding FROM `{self.table}` WHERE source IN UNNEST(@sources) OR id IN UNNEST(@linked_ids)"
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[bigquery.ArrayQueryParameter("sources", "STRING", sources),
+                              bigquery.ArrayQueryParameter("linked_ids", "STRING", linked_ids)])
+        index = InMemoryVectorIndex.from_query(self.client, sql, job_config=job_config)
+        if prefix:
+            # 헤더에 샤드 버전을 따로 기록해 다음 로드 때 비교.
+            # 인덱스 행렬은 이미 정규화되어 있으므로 그렇게 기록해 다음 로드 때 복사/재정규화를 건너뜀
+            writer = MatrixWriter(prefix, model=self.model, normalized=True, extra={"shard_version": version})
+            writer.add(index.ids, index.matrix)
+            writer.close()
+        return index
+
+
+class NotebookShardPool:
+    """
+    메모리 예산 안에서 노트북 샤드를 LRU로 관리하는 풀 (여러 스레드에서 함께 사용해도 안전).
+
+    사용 예:
+        pool = NotebookShardPool(BigQueryShardLoader(bq_client, table, NotebookRegistry()))
+        pool.search("notebook-123", query_vec, k=5)     # [(id, 코사인 유사도), ...]
+    """
+    def __init__(self, loader, memory_budget_mb: float = DEFAULT_MEMORY_BUDGET_MB):
+        """
+        Args:
+            loader: notebook_id → InMemoryVectorIndex 호출 가능한 객체 (예: BigQueryShardLoader).
+            memory_budget_mb: 메모리에 올려 둘 샤드 전체 크기 상한(MB).
+        """
+        self.loader = loader
+        self.memory_budget = int(memory_budget_mb * 1024 * 1024)
+        self._shards = OrderedDict()   # notebook_id → (index, nbytes), 오래 쓰지 않은 순서
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+        self.load_sec = 0.0
+
+    def _load_lock(self, notebook_id: str) -> threading.Lock:
+        with self._lock:
+            return self._load_locks.setdefault(notebook_id, threading.Lock())
+
+    def get(self, notebook_id: str) -> InMemoryVectorIndex:
+        """노트북 샤드를 돌려줍니다. 메모리에 없으면 불러오고, 예산을 넘으면 오래된 샤드를 내립니다."""
+        with self._lock:
+            if notebook_id in self._shards:
+                self._shards.move_to_end(notebook_id)
+                self.hits += 1
+                return self._shards[notebook_id][0]
+        # 같은 노트북을 여러 스레드가 동시에 불러오지 않도록 노트북별 잠금
+        with self._load_lock(notebook_id):
+            with self._lock:
+                if notebook_id in self._shards:
+                    self._shards.move_to_end(notebook_id)
+                    self.hits += 1
+                    return self._shards[notebook_id][0]
+            started = time.perf_counter()
+            index = self.loader(notebook_id)
+            elapsed = time.perf_counter() - started
+            nbytes = shard_nbytes(index)
+            with self._lock:
+                self.loads += 1
+                self.load_sec += elapsed
+                self._shards[notebook_id] = (index, nbytes)
+                self._bytes += nbytes
+                self._evict(keep=notebook_id)
+            return index
+
+    def _evict(self, keep: str):
+        """예산을 넘는 동안 가장 오래 쓰지 않은 샤드를 내립니다 (방금 불러온 샤드는 유지)."""
+        while self._bytes > self.memory_budget and len(self._shards) > 1:
+            notebook_id, (_, nbytes) = next(iter(self._shards.items()))
+            if notebook_id == keep:
+                break
+            del self._shards[notebook_id]
+            self._bytes -= nbytes
+            self.evictions += 1
+        if self._bytes > self.memory_budget:
+            print(f"[알림] 노트북 샤드 '{keep}'만으로 메모리 예산({self.memory_budget / 2**20:.0f}MB)을 넘습니다.")
+
+    def invalidate(self, notebook_id: str):
+        """노트북 샤드를 내립니다 (source가 바뀐 경우 다음 검색에서 다시 불러옴)."""
+        with self._lock:
+            entry = self._shards.pop(notebook_id, None)
+            if entry:
+                self._bytes -= entry[1]
+
+    def search(self, notebook_ids, query, k: int = 3) -> list[tuple]:
+        """
+        노트북 샤드들에서만 검색하고 결과를 합칩니다.
+
+        Args:
+            notebook_ids: 노트북 ID 하나 또는 목록.
+
+        Returns:
+            list[tuple]: 유사도 내림차순 (ID, 코사인 유사도).
+        """
+        if isinstance(notebook_ids, str):
+            notebook_ids = [notebook_ids]
+        results = []
+        for notebook_id in notebook_ids:
+            results.extend(self.get(notebook_id).search(query, k))
+        return sorted(results, key=lambda item: item[1], reverse=True)[:k]
+
+    def search_batch(self, notebook_ids, queries, k: int = 3) -> list[list[tuple]]:
+        """여러 질의를 search()와 같은 방식으로 검색합니다 (샤드별로 행렬 곱 한 번)."""
+        if isinstance(notebook_ids, str):
+            notebook_ids = [notebook_ids]
+        merged = None
+        for notebook_id in notebook_ids:
+            batch = self.get(notebook_id).search_batch(queries, k)
+            merged = batch if merged is None else [a + b for a, b in zip(merged, batch)]
+        return [sorted(rows, key=lambda item: item[1], reverse=True)[:k] for rows in merged or []]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"shards": len(self._shards), "memory_mb": self._bytes / 2**20, "hits": self.hits,
+                    "loads": self.loads, "evictions": self.evictions, "load_sec": self.load_sec}
+
+    def report(self) -> str:
+        s = self.stats()
+        return (f"노트북 샤드: {s['shards']}개 적재 ({s['memory_mb']:.1f}MB / {self.memory_budget / 2**20:.0f}MB), "
+                f"적중 {s['hits']}회, 로드 {s['loads']}회 ({s['load_sec']:.2f}초), 축출 {s['evictions']}회")
@@ -0,0 +1,465 @@
+"""
+임베딩 레코드 저장소(sink).
+
+- BigQuerySink: book_data.embeddings 테이블 (chap5/embed_store.py)
+- JsonlSink: Matching Engine/FAISS용 크기 제한 JSONL 샤드 + 병렬 GCS 업로드 (chap6/embed_store4vertex_ai_matching_engine.py)
+- MatchingEngineStreamSink: JsonlSink에 쓰면서 STREAM_UPDATE 인덱스에 바로 upsert/remove (ME_UPDATE_MODE=stream)
+
+세 sink는 같은 메서드(prepare, delete_sources, write, flush, locations)를 제공하므로
+IngestManifest와 함께 쓰면 변경된 파일의 행만 지우고 다시 쓰는 증분 인제스트가 가능합니다.
+write와 flush는 모두 성공 여부(bool)를 반환하고, 실패 원인은 [오류]로 출력합니다.
+레코드는 {"id", "content", "embedding", "source", "chunk_index"} 형태의 딕셔너리입니다.
+"""
+import json
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from google.api_core.exceptions import NotFound
+from google.cloud import bigquery
+from google.cloud.bigquery import Dataset, Table, SchemaField
+
+from common.bq_writers import create_writer
+from common.matching_engine import UPSERT_BATCH_SIZE, remove_datapoints, upsert_datapoints
+
+EMBEDDINGS_SCHEMA = [
+    SchemaField("id", "STRING", mode="REQUIRED"),
+    SchemaField("content", "STRING", mode="REQUIRED"),
+    SchemaField("embedding", "FLOAT", mode="REPEATED"), # FLOAT64 대신 FLOAT 사용
+    SchemaField("source", "STRING", mode="REQUIRED"), # 청크가 나온 원본 파일 이름
+    SchemaField("chunk_index", "INTEGER", mode="REQUIRED"), # 원본 파일 내 청크 순번
+]
+
+# Matching Engine 입력 JSON에 허용되는 필드 (그 외 필드는 인덱스 생성 시 오류가 남)
+MATCHING_ENGINE_FIELDS = ("id", "embedding", "restricts", "numeric_restricts", "crowding_tag")
+# JSONL 샤드 하나의 최대 크기 (넘으면 새 샤드로 넘어가고 다 쓴 샤드는 바로 업로드)
+DEFAULT_SHARD_MAX_BYTES = int(os.getenv("ME_SHARD_MAX_MB", "64")) * 1024 * 1024
+# 다 쓴 샤드를 동시에 업로드할 스레드 수
+DEFAULT_UPLOAD_WORKERS = int(os.getenv("ME_UPLOAD_WORKERS", "4"))
+
+
+class BigQuerySink:
+    """
+    BigQuery 임베딩 테이블 sink. 테이블을 매번 삭제하지 않고 source 단위로 행을 지우고 추가합니다.
+
+    write()로 받은 행은 batch_rows개까지만 메모리에 모았다가 적재 방식(mode)에 맞게 내보내므로,
+    전체 코퍼스 크기와 관계없이 메모리 사용량이 일정합니다.
+    """
+    def __init__(self, client: bigquery.Client, table_id: str, location: str = "US",
+                 mode: str = "load", batch_rows: int = 5000):
+        """
+        Args:
+            client: BigQuery 클라이언트.
+            table_id: "프로젝트.데이터셋.테이블" 형식의 전체 테이블 ID.
+            location: 데이터셋을 새로 만들 때 사용할 위치.
+            mode: 적재 방식. "load"(Parquet load job, 대량 적재/backfill), "load_avro",
+                  "storage_write"(Storage Write API, 지속 인제스트), "streaming"(insert_rows_json).
+            batch_rows: 한 번에 내보낼 최대 행 수.
+        """
+        self.client = client
+        self.table_id = table_id
+        self.location = location
+        self.mode = mode
+        self.batch_rows = batch_rows
+        self._buffer = []
+        self._writer = None
+        self.rows_written = 0
+
+    def prepare(self) -> bool:
+        """
+        데이터셋과 테이블이 없으면 만듭니다. 기존 테이블의 스키마가 맞지 않으면
+        (예: 파일당 1행이던 이전 버전 테이블) 삭제 후 다시 만듭니다.
+
+        Returns:
+            bool: 기존 행을 그대로 재사용할 수 있으면 True, 테이블을 새로 만들었으면 False.
+        """
+        dataset = Dataset(self.table_id.rsplit(".", 1)[0])
+        dataset.location = self.location
+        self.client.create_dataset(dataset, exists_ok=True)
+
+        try:
+            table = self.client.get_table(self.table_id)
+        except NotFound:
+            self.client.create_table(Table(self.table_id, schema=EMBEDDINGS_SCHEMA))
+            print(f"테이블 '{self.table_id}' 생성 완료.")
+            return False
+
+        existing = {f.name for f in table.schema}
+        if not {f.name for f in EMBEDDINGS_SCHEMA} <= existing:
+            print(f"[알림] 기존 테이블 스키마가 달라 다시 생성합니다: {self.table_id}")
+            self.client.delete_table(self.table_id, not_found_ok=True)
+            self.client.create_table(Table(self.table_id, schema=EMBEDDINGS_SCHEMA))
+            return False
+        return True
+
+    def delete_sources(self, sources: list[str]):
+        """
+        지정한 원본 파일들의 행을 DML DELETE로 지웁니다.
+        ("streaming" 방식으로 최근 삽입한 행은 스트리밍 버퍼에 있는 동안 DML로 지울 수 없으므로
+        증분 인제스트에는 load job 방식을 권장합니다.)
+        """
+        if not sources:
+            return
+        sql = f"DELETE FROM `{self.table_id}` WHERE source IN UNNEST(@sources)"
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[bigquery.ArrayQueryParameter("sources", "STRING", list(sources))]
+        )
+        job = self.client.query(sql, job_config=job_config)
+        job.result()
+        print(f"기존 행 삭제 완료: {len(sources)}개 파일, {job.num_dml_affected_rows}개 행")
+
+    def _send_buffer(self) -> bool:
+        if not self._buffer:
+            return True
+        if self._writer is None:
+            self._writer = create_writer(self.mode, self.client, self.table_id)
+        try:
+            self._writer.send(self._buffer)
+        except Exception as e:
+            print(f"BigQuery 적재 중 예외 발생 ({self.mode}): {e}")
+            return False
+        self.rows_written += len(self._buffer)
+        print(f"BigQuery 적재 완료 ({self.mode}): {len(self._buffer)}개 행 (누적 {self.rows_written}개)")
+        self._buffer = []
+        return True
+
+    def write(self, records: list[dict]) -> bool:
+        """
+        레코드를 버퍼에 추가하고, batch_rows개가 모일 때마다 테이블에 적재합니다.
+
+        Returns:
+            bool: 적재 중 오류가 없으면 True.
+        """
+        for record in records:
+            self._buffer.append(record)
+            if len(self._buffer) >= self.batch_rows and not self._send_buffer():
+                return False
+        return True
+
+    def flush(self) -> bool:
+        """남은 버퍼를 적재하고 writer(스트림)를 닫습니다. 성공하면 True."""
+        ok = self._send_buffer()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        return ok
+
+    def locations(self, source: str) -> list[str]:
+        """BigQuery는 테이블 하나에 저장하므로 별도의 위치 정보가 없습니다."""
+        return []
+
+
+class JsonlSink:
+    """
+    Matching Engine contents_delta_uri 폴더 구조의 JSONL 샤드 sink.
+
+    실행마다 새 레코드는 "part-<실행ID>-<순번>.json" 샤드에 이어 쓰고, 샤드가 max_shard_bytes를
+    넘으면 닫아서 백그라운드 스레드로 업로드한 뒤 다음 샤드로 넘어갑니다. 따라서 레코드를
+    메모리에 모아 둘 필요가 없고, 임베딩이 계속되는 동안 앞선 샤드가 병렬로 업로드됩니다.
+    변경/삭제된 파일의 행은 매니페스트에 기록된 샤드를 다시 써서 제거합니다.
+    """
+    def __init__(self, local_dir: str, manifest, bucket=None, gcs_folder: str = "embeddings/",
+                 run_id: str = None, max_shard_bytes: int = DEFAULT_SHARD_MAX_BYTES,
+                 upload_workers: int = DEFAULT_UPLOAD_WORKERS, restrict_fields: dict = None,
+                 crowding_tag_field: str = None, numeric_restrict_fields: dict = None):
+        """
+        Args:
+            local_dir: 샤드를 보관할 로컬 디렉토리.
+            manifest: IngestManifest (변경/삭제된 파일의 행이 어느 샤드에 있는지 조회).
+            bucket: 업로드할 google.cloud.storage.Bucket. None이면 로컬에만 저장.
+            gcs_folder: 버킷 내 폴더 경로 (Matching Engine contents_delta_uri의 폴더 부분).
+            run_id: 이번 실행의 샤드 이름에 쓸 ID. 기본값은 현재 시각.
+            max_shard_bytes: 샤드 하나의 최대 크기(바이트).
+            upload_workers: 샤드 업로드 스레드 수.
+            restrict_fields: {네임스페이스: 레코드 필드} 형태. 지정하면 레코드의 해당 값으로
+                restricts(필터링용 allow 목록)를 만듭니다. 예: {"source": "source"}
+            numeric_restrict_fields: {네임스페이스: 레코드 필드} 형태. 지정하면 레코드의 숫자 값으로
+                numeric_restricts(범위 필터용)를 만듭니다. 예: {"chunk_index": "chunk_index"}
+            crowding_tag_field: 지정하면 레코드의 해당 값을 crowding_tag로 기록합니다.
+                (같은 태그의 결과가 검색 결과를 독점하지 않도록 분산)
+        """
+        self.local_dir = local_dir
+        self.manifest = manifest
+        self.bucket = bucket
+        self.gcs_folder = gcs_folder.strip("/")
+        self.run_id = run_id or time.strftime("%Y%m%d-%H%M%S")
+        self.max_shard_bytes = max_shard_bytes
+        self.upload_workers = upload_workers
+        self.restrict_fields = restrict_fields or {}
+        self.numeric_restrict_fields = numeric_restrict_fields or {}
+        self.crowding_tag_field = crowding_tag_field
+        self._shard_seq = 0
+        self.run_shard = self._run_shard_name()
+        self._file = None        # 현재 이어 쓰는 샤드 파일
+        self._file_bytes = 0
+        self._pool = None
+        self._uploads = []       # 진행 중인 업로드 Future 목록
+        self._shards_by_source = defaultdict(set)
+        self._ids_by_source = defaultdict(list)  # 이번 실행에서 쓴 행 ID
+        self._dirty = set()    # GCS에 다시 올려야 하는 샤드
+        self._removed = set()  # 비어서 GCS에서 지워야 하는 샤드
+
+    def _run_shard_name(self) -> str:
+        return f"part-{self.run_id}-{self._shard_seq:05d}.json"
+
+    def _local_path(self, shard: str) -> str:
+        return os.path.join(self.local_dir, shard)
+
+    def _blob_name(self, shard: str) -> str:
+        return f"{self.gcs_folder}/{shard}" if self.gcs_folder else shard
+
+    def prepare(self) -> bool:
+        os.makedirs(self.local_dir, exist_ok=True)
+        return True
+
+    def _ensure_local(self, shard: str) -> bool:
+        """샤드가 로컬에 없으면 GCS에서 내려받습니다. 어디에도 없으면 False."""
+        path = self._local_path(shard)
+        if os.path.exists(path):
+            return True
+        if self.bucket is None:
+            return False
+        blob = self.bucket.blob(self._blob_name(shard))
+        if not blob.exists():
+            return False
+        blob.download_to_filename(path)
+        return True
+
+    def delete_sources(self, sources: list[str]):
+        """
+        지정한 원본 파일들의 행을 해당 샤드에서 제거합니다.
+        매니페스트에 기록된 행과 이번 실행에서 쓴 행을 모두 대상으로 하므로, 이번 실행의 샤드를
+        다시 쓰는 경우에는 flush()로 업로드를 마친 뒤에 호출해야 합니다.
+        """
+        targets = set(sources)
+        removed_ids = self.source_ids(targets)
+        shards = set()
+        for entry in self.manifest.entries.values():
+            if entry["source"] in targets:
+                shards.update(entry.get("shards", []))
+        for source in targets:
+            self._ids_by_source.pop(source, None)
+            shards.update(self._shards_by_source.pop(source, ()))
+
+        for shard in sorted(shards):
+            if not self._ensure_local(shard):
+                print(f"[알림] 샤드를 찾을 수 없어 건너뜀: {shard}")
+                continue
+            path = self._local_path(shard)
+            with open(path, "r", encoding="utf-8") as f:
+                kept = [line for line in f if line.strip() and json.loads(line)["id"] not in removed_ids]
+            if kept:
+                with open(path, "w", encoding="utf-8") as f:
+                    f.writelines(kept)
+                self._dirty.add(shard)
+            else:
+                os.remove(path)
+                self._removed.add(shard)
+        if shards:
+            print(f"기존 행 삭제 완료: {len(targets)}개 파일, 샤드 {len(shards)}개 갱신")
+
+    def source_ids(self, sources) -> set:
+        """지정한 원본 파일들의 행 ID (매니페스트에 기록된 행과 이번 실행에서 쓴 행)."""
+        targets = set(sources)
+        ids = set()
+        for entry in self.manifest.entries.values():
+            if entry["source"] in targets:
+                ids.update(entry["ids"])
+        for source in targets:
+            ids.update(self._ids_by_source.get(source, ()))
+        return ids
+
+    def _row(self, record: dict) -> dict:
+        """레코드에서 Matching Engine 허용 필드만 남기고, 설정에 따라 restricts/numeric_restricts/crowding_tag를 채웁니다."""
+        row = {k: record[k] for k in MATCHING_ENGINE_FIELDS if k in record}
+        if self.restrict_fields and "restricts" not in row:
+            restricts = []
+            for namespace, field in self.restrict_fields.items():
+                value = record.get(field)
+                if value is None:
+                    continue
+                values = value if isinstance(value, (list, tuple, set)) else [value]
+                restricts.append({"namespace": namespace, "allow": [str(v) for v in values]})
+            if restricts:
+                row["restricts"] = restricts
+        if self.numeric_restrict_fields and "numeric_restricts" not in row:
+            numeric = []
+            for namespace, field in self.numeric_restrict_fields.items():
+                value = record.get(field)
+                if value is None:
+                    continue
+                kind = "value_int" if isinstance(value, int) else "value_double"
+                numeric.append({"namespace": namespace, kind: value})
+            if numeric:
+                row["numeric_restricts"] = numeric
+        if self.crowding_tag_field and "crowding_tag" not in row:
+            value = record.get(self.crowding_tag_field)
+            if value is not None:
+                row["crowding_tag"] = str(value)
+        return row
+
+    def write(self, records: list[dict]) -> bool:
+        """레코드를 이번 실행의 현재 샤드에 이어 쓰고, 크기 한도를 넘으면 다음 샤드로 넘어갑니다."""
+        for record in records:
+            if self._file is None:
+                self._file = open(self._local_path(self.run_shard), "a", encoding="utf-8")
+            # json.dumps는 기본적으로 ASCII만 출력하므로 문자열 길이가 곧 바이트 수
+            line = json.dumps(self._row(record)) + "\n"
+            self._file.write(line)
+            self._file_bytes += len(line)
+            self._shards_by_source[record["source"]].add(self.run_shard)
+            self._ids_by_source[record["source"]].append(record["id"])
+            if self._file_bytes >= self.max_shard_bytes:
+                self._close_shard()
+        return True
+
+    def _close_shard(self):
+        """현재 샤드를 닫아 업로드를 시작하고 다음 샤드 이름으로 넘어갑니다."""
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        self._file_bytes = 0
+        self._submit_upload(self.run_shard)
+        self._shard_seq += 1
+        self.run_shard = self._run_shard_name()
+
+    def _submit_upload(self, shard: str):
+        if self.bucket is None:
+            return
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.upload_workers)
+        self._uploads.append(self._pool.submit(self._upload, shard))
+
+    def _upload(self, shard: str):
+        blob = self.bucket.blob(self._blob_name(shard))
+        blob.upload_from_filename(self._local_path(shard))
+        print(f"[성공] GCS 업로드 완료: gs://{self.bucket.name}/{blob.name}")
+
+    def flush(self) -> bool:
+        """
+        현재 샤드와 다시 쓴 샤드를 업로드하고 진행 중인 업로드가 모두 끝날 때까지 기다린 뒤,
+        비게 된 샤드는 GCS에서 삭제합니다. 업로드 중 오류가 있으면 오류를 출력하고 False.
+        """
+        errors = []
+        try:
+            self._close_shard()
+            for shard in sorted(self._dirty - self._removed):
+                self._submit_upload(shard)
+        except OSError as e:
+            errors.append(e)
+        uploads, self._uploads = self._uploads, []
+        for future in uploads:
+            try:
+                future.result()
+            except Exception as e:
+                errors.append(e)
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        if errors:
+            for error in errors:
+                print(f"[오류] 샤드 저장/업로드 실패: {error}")
+            return False
+        if self.bucket is not None:
+            for shard in sorted(self._removed):
+                blob = self.bucket.blob(self._blob_name(shard))
+                try:
+                    blob.delete()
+                    print(f"[정보] 빈 샤드 삭제: gs://{self.bucket.name}/{blob.name}")
+                except NotFound:
+                    pass
+        self._dirty.clear()
+        self._removed.clear()
+        return True
+
+    def locations(self, source: str) -> list[str]:
+        """해당 원본 파일의 행이 기록된 샤드 이름 목록."""
+        return sorted(self._shards_by_source.get(source, ()))
+
+    def shard_paths(self) -> list[str]:
+        """
+        매니페스트에 기록된 모든 샤드의 로컬 경로 (로컬에 없으면 GCS에서 내려받음).
+        전체 JSONL을 다른 형식(예: common.embedding_matrix의 .npy)으로 변환할 때 사용합니다.
+        """
+        shards = set()
+        for entry in self.manifest.entries.values():
+            shards.update(entry.get("shards", []))
+        return [self._local_path(shard) for shard in sorted(shards) if self._ensure_local(shard)]
+
+
+class MatchingEngineStreamSink:
+    """
+    Matching Engine 스트림 업데이트 sink.
+
+    레코드를 JsonlSink 샤드에 그대로 쓰면서(전체 재빌드와 FAISS 행렬 변환용 원본 유지) 같은 행을
+    batch_size개씩 모아 STREAM_UPDATE 인덱스에 upsert하고, 변경/삭제된 파일의 행은 remove_datapoints로 지웁니다.
+    따라서 새로 올린 문서가 배치 재빌드 없이 몇 초 안에 검색됩니다.
+    """
+    def __init__(self, index, inner: JsonlSink, batch_size: int = UPSERT_BATCH_SIZE):
+        """
+        Args:
+            index: index_update_method="STREAM_UPDATE"로 만든 aiplatform.MatchingEngineIndex.
+            inner: 샤드를 기록할 JsonlSink (restricts/crowding_tag 설정도 이 sink의 것을 사용).
+            batch_size: upsert 요청 하나에 담을 최대 데이터포인트 수.
+        """
+        self.index = index
+        self.inner = inner
+        self.batch_size = batch_size
+        self._pending = []
+        self.upserted = 0
+        self.removed = 0
+
+    @property
+    def run_shard(self) -> str:
+        return self.inner.run_shard
+
+    def prepare(self) -> bool:
+        return self.inner.prepare()
+
+    def delete_sources(self, sources: list[str]):
+        """지정한 원본 파일들의 행을 인덱스와 샤드에서 모두 지웁니다."""
+        ids = self.inner.source_ids(sources)
+        if ids:
+            self._send_pending()
+            self.removed += remove_datapoints(self.index, sorted(ids), self.batch_size)
+            print(f"[정보] Matching Engine 데이터포인트 삭제: {len(ids)}개")
+        self.inner.delete_sources(sources)
+
+    def _send_pending(self) -> bool:
+        if not self._pending:
+            return True
+        try:
+            self.upserted += upsert_datapoints(self.index, self._pending, self.batch_size)
+        except Exception as e:
+            print(f"[오류] Matching Engine upsert 실패: {e}")
+            return False
+        print(f"[정보] Matching Engine upsert: {len(self._pending)}개 (누적 {self.upserted}개)")
+        self._pending = []
+        return True
+
+    def write(self, records: list[dict]) -> bool:
+        """레코드를 샤드에 쓰고, batch_size개가 모일 때마다 인덱스에 upsert합니다."""
+        if not self.inner.write(records):
+            return False
+        for record in records:
+            self._pending.append(self.inner._row(record))
+            if len(self._pending) >= self.batch_size and not self._send_pending():
+                return False
+        return True
+
+    def flush(self) -> bool:
+        """남은 행을 upsert하고 샤드 업로드를 마칩니다. 둘 다 성공하면 True."""
+        upserted = self._send_pending()
+        if not upserted:
+            print("[오류] Matching Engine upsert에 실패했습니다.")
+        # upsert가 실패해도 업로드 스레드 풀은 정리
+        uploaded = self.inner.flush()
+        return upserted and uploaded
+
+    def locations(self, source: str) -> list[str]:
+        return self.inner.locations(source)
+
+    def shard_paths(self) -> list[str]:
+        return self.inner.shard_paths()
@@ -0,0 +1,56 @@
+"""
+추출 텍스트 디스크 캐시.
+
+PDF 파싱(PyMuPDF)은 인제스트에서 가장 오래 걸리는 단계이지만, 같은 파일은 추출 결과도 같습니다.
+페이지별 추출 텍스트를 (파일 SHA-256, 추출기 버전) 키로 gzip 압축하여 저장해 두면
+CHUNK_SIZE/CHUNK_OVERLAP이나 임베딩 모델만 바꿔 다시 실행할 때 파싱을 건너뛸 수 있습니다.
+
+파일 하나에 항목 하나(<캐시 디렉토리>/<sha256 앞 2자리>/<sha256>-<버전>.json.gz)를 쓰고
+임시 파일 + os.replace로 원자적으로 저장하므로, 여러 추출 프로세스가 동시에 써도 안전합니다.
+"""
+import gzip
+import json
+import os
+
+DEFAULT_TEXT_CACHE_DIR = os.getenv(
+    "EXTRACT_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "notebooklm", "extracted_text"))
+
+
+class ExtractedTextCache:
+    """
+    (파일 해시, 추출기 버전)별 페이지 텍스트 캐시.
+    추출 로직이나 PyMuPDF 버전이 바뀌면 버전 문자열이 달라져 이전 항목은 자동으로 무시됩니다.
+    """
+    def __init__(self, cache_dir: str = DEFAULT_TEXT_CACHE_DIR, version: str = ""):
+        """
+        Args:
+            cache_dir: 캐시 디렉토리.
+            version: 추출기 버전 문자열 (common.extraction.EXTRACTOR_VERSION).
+        """
+        self.cache_dir = cache_dir
+        self.version = version
+
+    def _path(self, sha256: str) -> str:
+        name = f"{sha256}-{self.version}.json.gz" if self.version else f"{sha256}.json.gz"
+        return os.path.join(self.cache_dir, sha256[:2], name)
+
+    def get(self, sha256: str):
+        """캐시된 페이지 텍스트 리스트를 반환합니다. 없거나 읽을 수 없으면 None."""
+        path = self._path(sha256)
+        if not os.path.exists(path):
+            return None
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                return json.load(f)["pages"]
+        except (OSError, ValueError, KeyError):
+            # 손상된 항목은 다시 추출하도록 캐시 미스로 처리
+            return None
+
+    def put(self, sha256: str, pages: list[str]):
+        """페이지 텍스트 리스트를 압축하여 저장합니다."""
+        path = self._path(sha256)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8", compresslevel=6) as f:
+            json.dump({"version": self.version, "pages": pages}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
@@ -0,0 +1,129 @@
+"""
+로컬 토큰 수 계산과 토큰 예산 맞추기.
+
+임베딩/생성 API는 요청을 보낸 뒤에야 입력이 너무 길다고 실패하거나 조용히 잘라 버립니다.
+이 모듈은 네트워크 호출 없이 토큰 수를 세어, 보내기 전에 입력을 나누거나 프롬프트를 예산 안으로 줄입니다.
+
+- 임베딩 입력: common.chunking.estimate_tokens 휴리스틱 (근사값, 영문은 작게 추정될 수 있음).
+- Gemini 프롬프트: vertexai.preview.tokenization의 로컬 토크나이저가 있으면 정확하게 세고
+  (토크나이저 모델 파일은 처음 한 번만 내려받아 캐시), 없거나 지원하지 않는 모델이면 휴리스틱으로 대체합니다.
+"""
+import os
+from functools import lru_cache
+
+from common.chunking import ChunkingConfig, _split_pieces, chunk_text, estimate_tokens
+
+# 검색 결과(컨텍스트)에 쓸 프롬프트 토큰 예산. 질문/지시문 토큰은 여기서 빼고 계산합니다.
+DEFAULT_PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "8000"))
+# Gemini 로컬 토크나이저 사용 여부 (false면 항상 휴리스틱)
+USE_LOCAL_TOKENIZER = os.getenv("LOCAL_TOKENIZER", "true").lower() == "true"
+# 잘라서라도 넣을 가치가 있는 최소 컨텍스트 조각 크기
+MIN_PASSAGE_TOKENS = 64
+
+
+@lru_cache(maxsize=None)
+def _local_tokenizer(model: str):
+    """모델의 로컬 토크나이저. SDK가 없거나 모델을 지원하지 않으면 None."""
+    if not USE_LOCAL_TOKENIZER or not model:
+        return None
+    try:
+        from vertexai.preview.tokenization import get_tokenizer_for_model
+        return get_tokenizer_for_model(model)
+    except Exception as e:
+        print(f"[알림] 로컬 토크나이저를 쓸 수 없어 추정값을 사용합니다 ({model}): {e}")
+        return None
+
+
+def count_tokens(text: str, model: str = None) -> int:
+    """
+    텍스트의 토큰 수를 로컬에서 셉니다.
+
+    Args:
+        text: 토큰 수를 셀 텍스트.
+        model: 생성 모델 이름 (예: "gemini-2.0-flash-lite-001"). None이면 휴리스틱 추정.
+
+    Returns:
+        토큰 수.
+    """
+    tokenizer = _local_tokenizer(model) if model else None
+    if tokenizer is not None:
+        try:
+            return tokenizer.count_tokens(text).total_tokens
+        except Exception:
+            pass
+    return estimate_tokens(text)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """텍스트 앞부분을 단어 단위로 max_tokens 추정 토큰 이내로 자릅니다."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    kept = []
+    total = 0
+    for piece in _split_pieces(text, max_tokens):
+        tokens = estimate_tokens(piece)
+        if total + tokens > max_tokens:
+            break
+        kept.append(piece)
+        total += tokens
+    return "".join(kept).rstrip()
+
+
+def split_to_tokens(text: str, max_tokens: int) -> list[str]:
+    """
+    텍스트를 겹침 없이 max_tokens 추정 토큰 이하의 조각들로 나눕니다.
+    입력당 토큰 한도를 넘는 임베딩 입력을 API에 보내기 전에 나누는 데 사용합니다.
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return [text]
+    return [chunk.text for chunk in chunk_text(text, ChunkingConfig(chunk_size=max_tokens, chunk_overlap=0))]
+
+
+def fit_passages(passages: list[str], budget: int = DEFAULT_PROMPT_TOKEN_BUDGET,
+                 model: str = None, separator: str = "\n\n") -> list[str]:
+    """
+    순위순 검색 결과를 토큰 예산 안에 들어가도록 고릅니다.
+
+    앞(상위)에서부터 통째로 넣고, 다음 조각이 남은 예산을 넘으면 남은 예산이
+    MIN_PASSAGE_TOKENS 이상일 때만 그 조각을 잘라 넣은 뒤 멈춥니다.
+
+    Args:
+        passages: 순위순 컨텍스트 텍스트 목록.
+        budget: 컨텍스트 전체에 허용할 토큰 수.
+        model: 토큰을 셀 생성 모델 이름. None이면 휴리스틱.
+        separator: 조각 사이 구분자 (구분자 토큰도 예산에 포함).
+
+    Returns:
+        예산 안에 들어가는 컨텍스트 텍스트 목록.
+    """
+    separator_tokens = count_tokens(separator, model) if separator.strip() else 0
+    kept = []
+    remaining = budget
+    for passage in passages:
+        cost = count_tokens(passage, model) + (separator_tokens if kept else 0)
+        if cost <= remaining:
+            kept.append(passage)
+            remaining -= cost
+            continue
+        if remaining >= MIN_PASSAGE_TOKENS:
+            truncated = _truncate_to_budget(passage, remaining - (separator_tokens if kept else 0), model)
+            if truncated:
+                kept.append(truncated)
+        break
+    return kept
+
+
+def _truncate_to_budget(text: str, limit: int, model: str = None) -> str:
+    """
+    텍스트를 model 토큰 기준 limit 이내로 자릅니다. 자르기는 추정 토큰 기준이고 추정값이 실제보다
+    작을 수 있으므로(예: 영어는 글자당 토큰이 더 많음) 실제 토큰을 다시 세어 넘치면 비율만큼 줄여 다시 자릅니다.
+    MIN_PASSAGE_TOKENS 아래로 줄여야 하면 빈 문자열.
+    """
+    target = limit
+    while target >= MIN_PASSAGE_TOKENS:
+        truncated = truncate_to_tokens(text, target)
+        actual = count_tokens(truncated, model)
+        if actual <= limit:
+            return truncated
+        target = min(target - 1, target * limit // actual)
+    return ""
@@ -0,0 +1,238 @@
+"""
+메모리 내(in-memory) 벡터화 코사인 top-k 검색.
+
+BigQuery 테이블의 임베딩을 BigQuery Storage Read API(Arrow 레코드 배치)로 스트리밍하여
+연속된 float32 행렬 하나에 채우고, 적재할 때 행마다 L2 정규화해 둡니다.
+그러면 코사인 유사도는 내적과 같으므로
+
+- 질의 하나: 행렬-벡터 곱 한 번 + np.argpartition (전체 정렬 없이 top-k만 선택)
+- 질의 여러 개: 행렬 곱(matmul) 한 번
+
+으로 계산됩니다. 행마다 Python에서 노름을 다시 계산하던 방식보다 훨씬 빠릅니다.
+"""
+import os
+
+import numpy as np
+
+# 여러 질의를 한 번에 검색할 때 (질의 수 × 행 수) 점수 행렬이 너무 커지지 않도록 나누는 질의 블록 크기
+QUERY_BLOCK_SIZE = int(os.getenv("VECTOR_SEARCH_QUERY_BLOCK", "256"))
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """float32 행렬의 각 행을 제자리에서 L2 정규화합니다. 노름이 0인 행은 그대로 둡니다."""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix /= norms
+    return matrix
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """점수 벡터에서 상위 k개 인덱스를 점수 내림차순으로 반환합니다."""
+    if k >= len(scores):
+        return np.argsort(-scores)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+def _bqstorage_client():
+    """BigQuery Storage Read API 클라이언트. 패키지가 없으면 None (REST 페이지 읽기로 대체)."""
+    try:
+        from google.cloud import bigquery_storage
+        return bigquery_storage.BigQueryReadClient()
+    except ImportError:
+        print("[알림] google-cloud-bigquery-storage가 없어 REST API로 행을 읽습니다 (느릴 수 있음).")
+        return None
+
+
+class InMemoryVectorIndex:
+    """
+    정규화된 float32 행렬 기반 정확(brute-force) 코사인 검색 인덱스.
+
+    사용 예:
+        index = InMemoryVectorIndex.from_bigquery(bq_client, "project.book_data.embeddings")
+        print(index.search(query_vec, k=3))               # [(id, 점수), ...]
+        print(index.search_batch([q1, q2], k=3))          # 질의별 결과 리스트
+    """
+    def __init__(self, ids: list, matrix: np.ndarray, normalized: bool = False):
+        """
+        Args:
+            ids: 행 순서대로의 ID 목록.
+            matrix: (행 수, 차원) 임베딩 행렬.
+            normalized: True면 이미 행별로 정규화된 행렬로 보고 다시 정규화하지 않습니다.
+        """
+        matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        if matrix.ndim != 2 or matrix.shape[0] != len(ids):
+            raise ValueError(f"행렬 {matrix.shape}과 ID {len(ids)}개가 맞지 않습니다.")
+        self.ids = list(ids)
+        self.matrix = matrix if normalized else normalize_rows(matrix.copy())
+
+    @property
+    def dim(self) -> int:
+        return self.matrix.shape[1]
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    @classmethod
+    def from_bigquery(cls, client, table: str, id_column: str = "id", embedding_column: str = "embedding",
+                      bqstorage_client=None) -> "InMemoryVectorIndex":
+        """
+        BigQuery 테이블의 (ID, 임베딩) 열을 Storage Read API로 스트리밍하여 인덱스를 만듭니다.
+        쿼리 작업 없이 테이블을 직접 읽으므로 쿼리 비용도 들지 않습니다.
+
+        Args:
+            client: bigquery.Client.
+            table: "project.dataset.table" 형식의 테이블 ID.
+            id_column: ID 열 이름.
+            embedding_column: 임베딩(ARRAY<FLOAT64>) 열 이름.
+            bqstorage_client: 재사용할 BigQueryReadClient. None이면 새로 만듭니다.
+        """
+        table_ref = client.get_table(table)
+        fields = [f for f in table_ref.schema if f.name in (id_column, embedding_column)]
+        rows = client.list_rows(table_ref, selected_fields=fields)
+        if bqstorage_client is None:
+            bqstorage_client = _bqstorage_client()
+        return cls._from_arrow_batches(rows.to_arrow_iterable(bqstorage_client=bqstorage_client),
+                                       rows.total_rows, id_column, embedding_column)
+
+    @classmethod
+    def from_query(cls, client, sql: str, job_config=None, id_column: str = "id",
+                   embedding_column: str = "embedding", bqstorage_client=None) -> "InMemoryVectorIndex":
+        """
+        쿼리 결과의 (ID, 임베딩) 열로 인덱스를 만듭니다 (예: 노트북 하나의 source 행만 읽을 때).
+        결과는 from_bigquery와 같이 Storage Read API로 스트리밍합니다.
+        """
+        rows = client.query(sql, job_config=job_config).result()
+        if bqstorage_client is None:
+            bqstorage_client = _bqstorage_client()
+        return cls._from_arrow_batches(rows.to_arrow_iterable(bqstorage_client=bqstorage_client),
+                                       rows.total_rows, id_column, embedding_column)
+
+    @classmethod
+    def _from_arrow_batches(cls, batches, total_rows, id_column: str, embedding_column: str) -> "InMemoryVectorIndex":
+        """Arrow 레코드 배치를 미리 할당한 float32 행렬에 채우며 행별로 정규화합니다."""
+        import pyarrow.compute as pc
+
+        ids = []
+        matrix = None
+        count = 0
+        skipped = 0
+        for batch in batches:
+            embeddings = batch.column(batch.schema.get_field_index(embedding_column))
+            batch_ids = batch.column(batch.schema.get_field_index(id_column))
+            lengths = pc.fill_null(pc.list_value_length(embeddings), 0).to_numpy()
+            if matrix is None:
+                nonzero = lengths[lengths > 0]
+                if len(nonzero) == 0:
+                    skipped += len(lengths)
+                    continue
+                # 행 수는 테이블 메타데이터로 미리 알 수 있으므로 한 번에 할당
+                matrix = np.empty((max(total_rows or 0, len(lengths)), int(nonzero[0])), dtype=np.float32)
+            dim = matrix.shape[1]
+            valid = lengths == dim
+            skipped += int((~valid).sum())
+            if not valid.any():
+                continue
+            if not valid.all():
+                embeddings = embeddings.filter(valid)
+                batch_ids = batch_ids.filter(valid)
+            block = embeddings.flatten().to_numpy(zero_copy_only=False).astype(np.float32, copy=False)
+            block = block.reshape(-1, dim)
+            if count + len(block) > matrix.shape[0]:
+                # 메타데이터 이후에 행이 추가된 경우
+                matrix = np.resize(matrix, (max(count + len(block), matrix.shape[0] * 2), dim))
+            matrix[count:count + len(block)] = block
+            normalize_rows(matrix[count:count + len(block)])
+            ids.extend(batch_ids.to_pylist())
+            count += len(block)
+
+        if skipped:
+            print(f"[알림] 임베딩이 없거나 차원이 다른 행 {skipped}개를 건너뛰었습니다.")
+        if matrix is None:
+            return cls([], np.zeros((0, 0), dtype=np.float32), normalized=True)
+        return cls(ids, matrix[:count], normalized=True)
+
+    @classmethod
+    def from_matrix(cls, prefix: str) -> "InMemoryVectorIndex":
+        """
+        common.embedding_matrix 형식(<prefix>.npy 등)으로 저장된 행렬로 인덱스를 만듭니다.
+        헤더에 normalized가 기록된 float32 행렬은 복사하지 않고 메모리 매핑 그대로 검색합니다.
+        """
+        from common.embedding_matrix import load_matrix
+
+        matrix, ids, header = load_matrix(prefix, mmap=True)
+        return cls(ids, matrix, normalized=header.get("normalized", False))
+
+    def _normalize_queries(self, queries) -> np.ndarray:
+        queries = np.array(queries, dtype=np.float32, ndmin=2)
+        if queries.shape[1] != self.dim:
+            raise ValueError(f"질의 차원({queries.shape[1]})이 인덱스 차원({self.dim})과 다릅니다.")
+        return normalize_rows(queries)
+
+    def row_of(self, doc_id):
+        """ID의 행 번호. 없으면 None."""
+        if getattr(self, "_row_of", None) is None:
+            self._row_of = {doc_id: row for row, doc_id in enumerate(self.ids)}
+        return self._row_of.get(doc_id)
+
+    def search(self, query, k: int = 3, ids=None, rows=None) -> list[tuple]:
+        """
+        질의 벡터 하나와 코사인 유사도가 가장 높은 k개 행을 찾습니다.
+
+        Args:
+            ids: 주어지면 이 ID들의 행만 점수를 매깁니다 (예: BM25 후보로 미리 좁힌 경우).
+                 인덱스에 없는 ID는 무시합니다.
+            rows: 주어지면 이 행 번호들만 점수를 매깁니다 (예: 메타데이터 필터 비트맵으로 고른 행).
+
+        Returns:
+            list[tuple]: 유사도 내림차순 (ID, 코사인 유사도) 리스트.
+        """
+        if len(self) == 0:
+            return []
+        q = self._normalize_queries(query)[0]
+        if ids is None and rows is None:
+            scores = self.matrix @ q
+            return [(self.ids[i], float(scores[i])) for i in _top_k(scores, k)]
+        if rows is None:
+            rows = np.array([row for row in map(self.row_of, ids) if row is not None], dtype=np.int64)
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(rows) == 0:
+            return []
+        scores = self.matrix[rows] @ q
+        return [(self.ids[rows[i]], float(scores[i])) for i in _top_k(scores, k)]
+
+    def search_batch(self, queries, k: int = 3, rows=None) -> list[list[tuple]]:
+        """
+        여러 질의를 행렬 곱으로 한 번에 검색합니다.
+
+        Args:
+            rows: 주어지면 이 행 번호들만 점수를 매깁니다 (선택된 행 수에 비례하는 비용).
+
+        Returns:
+            list[list[tuple]]: 질의 순서대로 search()와 같은 형식의 결과.
+        """
+        queries = np.array(queries, dtype=np.float32, ndmin=2)
+        # 빈 인덱스(예: 문서가 없는 노트북 샤드는 (0, 0) 행렬)는 차원 검사 전에 빈 결과를 돌려줌
+        if len(self) == 0 or (rows is not None and len(rows) == 0):
+            return [[] for _ in range(len(queries))]
+        q = self._normalize_queries(queries)
+        ids = self.ids
+        matrix = self.matrix
+        if rows is not None:
+            rows = np.asarray(rows, dtype=np.int64)
+            ids = [self.ids[row] for row in rows]
+            matrix = self.matrix[rows]
+        results = []
+        for start in range(0, len(q), QUERY_BLOCK_SIZE):
+            scores = q[start:start + QUERY_BLOCK_SIZE] @ matrix.T
+            if k < scores.shape[1]:
+                top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            else:
+                top = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+            top_scores = np.take_along_axis(scores, top, axis=1)
+            order = np.argsort(-top_scores, axis=1)
+            top = np.take_along_axis(top, order, axis=1)
+            top_scores = np.take_along_axis(top_scores, order, axis=1)
+            results.extend([(ids[i], float(s)) for i, s in zip(row, row_scores)]
+                           for row, row_scores in zip(top, top_scores))
+        return results
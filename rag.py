@@ -1,12 +1,21 @@
 # rag.py (쿼터 초과 예외 처리 및 대체 모델 적용 버전)
 
+import hashlib
 import os
+import sys
+import time
 from dotenv import load_dotenv
 from google.cloud import aiplatform
 from vertexai.preview import rag
 from vertexai.generative_models import GenerativeModel, Tool
 import logging
 
+# 저장소 루트의 공통 모듈(common/)을 가져오기 위해 경로 추가
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common.tokens import DEFAULT_PROMPT_TOKEN_BUDGET, count_tokens, fit_passages # 로컬 토큰 계산
+from common.rerank import RERANK_CANDIDATES, RERANK_TOP_N, create_reranker # 2단계 검색 (후보 검색 → 재순위)
+from common.retrievers import Hit
+
 logging.basicConfig(level=logging.DEBUG)
 load_dotenv()
 
@@ -14,6 +23,9 @@ project_id = os.environ["GOOGLE_CLOUD_PROJECT"]
 project_location = os.environ["GOOGLE_CLOUD_LOCATION"]
 print("project_id=", project_id, " : project_location=", project_location)
 
+# 답변 생성 모델 (컨텍스트 토큰 예산 계산과 7) 생성형 모델 초기화에서 함께 사용)
+GENERATION_MODEL = "gemini-2.0-flash-lite-001"#"gemini-2.0-flash-001"
+
 # 1) Vertex AI 및 임베딩 모델 초기화
 aiplatform.init(project=project_id, location=project_location)
 
@@ -97,13 +109,27 @@ context = ""
 if corpus:
     try:
         print("▶ retrieval_query 호출 시도...")
+        # RERANK=llm 또는 cross_encoder이면 후보 RERANK_CANDIDATES개를 가져와 재순위한 뒤 RERANK_TOP_N개만 사용
+        reranker = create_reranker()
+        started = time.perf_counter()
         response_rag = rag.retrieval_query(
             rag_resources=[rag.RagResource(rag_corpus=corpus.name)],
             text=user_question,
-            rag_retrieval_config=rag.RagRetrievalConfig(top_k=3),
+            rag_retrieval_config=rag.RagRetrievalConfig(top_k=RERANK_CANDIDATES if reranker else 3),
         )
+        retrieve_sec = time.perf_counter() - started
         # 'response_rag.contexts.contexts'는 반복 가능한 컨텍스트 리스트
         context_texts = [ctx.text for ctx in response_rag.contexts.contexts]
+        if reranker:
+            candidates = [Hit(f"{ctx.source_uri}|{hashlib.sha256(ctx.text.encode('utf-8')).hexdigest()[:16]}",
+                              -float(rank), ctx.text)
+                          for rank, ctx in enumerate(response_rag.contexts.contexts)]
+            context_texts = [hit.text for hit in reranker.rerank(user_question, candidates, top_n=RERANK_TOP_N,
+                                                                 version=corpus.name)]
+            print(f"▶ 1단계 검색 {retrieve_sec * 1000:.0f}ms ({len(candidates)}개 후보), {reranker.report()}")
+        # 생성 요청 전에 로컬에서 토큰을 세어 상위 컨텍스트부터 예산(PROMPT_TOKEN_BUDGET) 안으로 채움
+        context_texts = fit_passages(context_texts, DEFAULT_PROMPT_TOKEN_BUDGET,
+                                     model=GENERATION_MODEL, separator="\n")
         context = "\n".join(context_texts)
 
         print(">> RAG 조회 성공, 컨텍스트:")
@@ -140,7 +166,7 @@ if retrieval:
 #    - 쿼터 문제로 인해, 특정 LLM 모델이 제한될 수 있으므로
 #      필요하다면 다른 LLM(예: "text-bison@001")으로 폴백할 수도 있습니다.
 try:
-    model = "gemini-2.0-flash-lite-001"#"gemini-2.0-flash-001"
+    model = GENERATION_MODEL
     llm_agent = GenerativeModel(model, tools=[rag_tool] if rag_tool else [])
     print("▶ LLM 에이전트(",model, ") 초기화 성공")
 except Exception as e:
@@ -151,6 +177,7 @@ except Exception as e:
 
 # 8) 컨텍스트와 질문을 프롬프트로 결합
 prompt = f"Context: {context}\nQuestion: {user_question}"
+print("▶ 프롬프트 토큰 수:", count_tokens(prompt, model))
 
 # 9) 응답 생성 (예외 처리 포함)
 try: